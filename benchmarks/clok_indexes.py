@@ -0,0 +1,174 @@
+"""Benchmarks the time_clok lookup patterns before and after the composite indexes declared
+on the Clok model are created. The table is seeded without those indexes, every query
+is planned (EXPLAIN) and timed, then the indexes are added through
+SqlAlchemyConnGenerator.create_missing_indexes (the same path used to migrate an existing
+database) and everything is measured again.
+
+    python -m benchmarks.clok_indexes --rows 10000000 --users 2000
+    python -m benchmarks.clok_indexes --host 127.0.0.1 --user root --db-name clok_db
+"""
+import argparse
+import os
+import random
+import statistics
+import time
+from datetime import timedelta
+
+from sqlalchemy import desc
+
+from benchmarks.seed import SEED_START, seed_database
+from core.date_utils import get_date_key, get_month, get_week
+from web_server.database import DB, BaseModel
+from web_server.models import Clok, clok_hours
+
+
+def _query_builders():
+    session = DB.session
+
+    def last_record(user_id, job_id, when):
+        return (
+            session.query(Clok.id)
+            .filter(Clok.user_id == user_id)
+            .filter(Clok.job_id == job_id)
+            .order_by(desc(Clok.time_in))
+            .limit(1)
+        )
+
+    # the queries the hour reports run
+    def span_all_jobs(user_id, job_id, when):
+        return clok_hours.total_query(
+            user_id, start=when - timedelta(days=30), end=when
+        )
+
+    def day_hours(user_id, job_id, when):
+        return clok_hours.total_query(
+            user_id, job_id=job_id, date_key=get_date_key(when)
+        )
+
+    def week_hours(user_id, job_id, when):
+        return clok_hours.total_query(user_id, job_id=job_id, week_key=get_week(when))
+
+    def month_hours(user_id, job_id, when):
+        return clok_hours.total_query(user_id, month_key=get_month(when))
+
+    return dict(
+        last_record=last_record,
+        span_all_jobs=span_all_jobs,
+        day_hours=day_hours,
+        week_hours=week_hours,
+        month_hours=month_hours,
+    )
+
+
+def _explain(query) -> list:
+    engine = DB.engine
+    compiled = query.statement.compile(dialect=engine.dialect)
+    if compiled.positional:
+        params = tuple(compiled.params[k] for k in compiled.positiontup)
+    else:
+        params = compiled.params
+    prefix = "EXPLAIN QUERY PLAN" if engine.dialect.name == "sqlite" else "EXPLAIN"
+    rows = DB.session.connection().execute(f"{prefix} {compiled}", params)
+    return [" | ".join(str(v) for v in row) for row in rows]
+
+
+def _analyze():
+    connection = DB.session.connection()
+    if DB.engine.dialect.name == "sqlite":
+        connection.execute("ANALYZE")
+    else:
+        connection.execute(f"ANALYZE TABLE {Clok.__tablename__}")
+    DB.session.commit()
+
+
+def _measure(samples: list, repeat: int) -> dict:
+    results = {}
+    for name, builder in _query_builders().items():
+        timings = []
+        for _ in range(repeat):
+            for user_id, job_id, when in samples:
+                start = time.perf_counter()
+                builder(user_id, job_id, when).all()
+                timings.append((time.perf_counter() - start) * 1000.0)
+        user_id, job_id, when = samples[0]
+        results[name] = dict(
+            plan=_explain(builder(user_id, job_id, when)),
+            mean=statistics.mean(timings),
+            p95=sorted(timings)[int(len(timings) * 0.95) - 1],
+        )
+    return results
+
+
+def _report(label: str, results: dict):
+    print(f"\n== {label} ==")
+    for name, result in results.items():
+        print(f"{name:<14} mean {result['mean']:9.3f} ms   p95 {result['p95']:9.3f} ms")
+        for line in result["plan"]:
+            print(f"    {line}")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[0])
+    parser.add_argument("--rows", type=int, default=10000000)
+    parser.add_argument("--users", type=int, default=2000)
+    parser.add_argument("--jobs-per-user", type=int, default=3)
+    parser.add_argument("--samples", type=int, default=50)
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--sqlite", default="clok_indexes_bench.db")
+    parser.add_argument("--host", help="benchmark against MySQL instead of SQLite")
+    parser.add_argument("--port", type=int, default=3306)
+    parser.add_argument("--user", default="root")
+    parser.add_argument("--password", default="")
+    parser.add_argument("--db-name", default="clok_db")
+    args = parser.parse_args(argv)
+
+    if args.host:
+        DB.init_app(
+            dict(
+                DATABASE_HOST=args.host,
+                DATABASE_PORT=args.port,
+                DATABASE_USERNAME=args.user,
+                DATABASE_PASSWORD=args.password,
+                DATABASE_NAME=args.db_name,
+            )
+        )
+    else:
+        if os.path.exists(args.sqlite):
+            os.remove(args.sqlite)
+        DB.init_app(dict(USE_SQLITE_DATABASE=True, SQLITE_DATABASE_NAME=args.sqlite))
+
+    BaseModel.metadata.drop_all(DB.engine)
+    DB.create_tables(BaseModel)
+    for index in Clok.__table__.indexes:
+        index.drop(DB.engine)
+
+    start = time.perf_counter()
+    counts = seed_database(
+        DB.session,
+        users=args.users,
+        jobs_per_user=args.jobs_per_user,
+        cloks=args.rows,
+    )
+    print(f"seeded {counts} in {time.perf_counter() - start:.1f}s")
+    _analyze()
+
+    rand = random.Random(2)
+    days = max(args.rows // args.users, 1)
+    samples = []
+    for _ in range(args.samples):
+        user_id = rand.randint(1, args.users)
+        job_id = (user_id - 1) * args.jobs_per_user + 1
+        samples.append((user_id, job_id, SEED_START + timedelta(rand.randrange(days))))
+
+    _report("before", _measure(samples, args.repeat))
+
+    start = time.perf_counter()
+    created = DB.create_missing_indexes(BaseModel)
+    _analyze()
+    print(f"\ncreated {created} in {time.perf_counter() - start:.1f}s")
+
+    _report("after", _measure(samples, args.repeat))
+
+
+if __name__ == "__main__":
+    main()
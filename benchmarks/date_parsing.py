@@ -0,0 +1,100 @@
+"""Micro benchmarks for core.date_utils parsing. Every input shape of TIME_FORMATS is
+parsed with the current regex based DateTimeParser and with the previous implementation
+(strptime against each of DATE_TIME_FORMATS until one matches), and the results are
+checked to be identical before they are timed.
+
+    python -m benchmarks.date_parsing --number 20000
+"""
+import argparse
+import timeit
+from datetime import datetime
+
+from core.date_utils import (
+    DateTimeParser,
+    parse_date_and_time,
+    parse_date_time_junction,
+)
+from core.defines import DATE_FORMAT, DATE_TIME_FORMATS
+
+DATE = datetime(2020, 3, 2)
+SAMPLES = {
+    "%I:%M:%S%p": "07:45:00PM",
+    "%-I:%M:%S%p": "7:45:00PM",
+    "%H:%M:%S": "17:45:00",
+    "%-H:%M:%S": "9:45:00",
+    "%I:%M%p": "07:45PM",
+    "%-I:%M%p": "7:45PM",
+    "%H:%M": "17:45",
+    "full date time": "2020-03-02 17:45:00",
+}
+
+
+def legacy_parse_date_and_time(time: str, date: datetime = None):
+    date_str = (date or datetime.now()).strftime(DATE_FORMAT)
+    if len(time) <= 11:
+        date_time_str = f"{date_str} {time.upper()}"
+    else:
+        date_time_str = time
+    for fmt in DATE_TIME_FORMATS:
+        try:
+            return datetime.strptime(date_time_str, fmt)
+        except ValueError:
+            pass
+    raise ValueError(f"Could not parse time string {time}")
+
+
+def legacy_parse_date_time_junction(junction: str):
+    date_str, time_junc = junction.split(" ")
+    date = datetime.strptime(date_str, DATE_FORMAT)
+    time_str1, time_str2 = time_junc.split("-")
+    return (
+        legacy_parse_date_and_time(time_str1, date),
+        legacy_parse_date_and_time(time_str2, date),
+    )
+
+
+def _time(func, number: int) -> float:
+    """Returns the microseconds per call."""
+    return min(timeit.repeat(func, number=number, repeat=3)) / number * 1e6
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[0])
+    parser.add_argument("--number", type=int, default=20000)
+    args = parser.parse_args(argv)
+
+    print(f"{'input':<16} {'legacy us':>10} {'current us':>10} {'speedup':>8}")
+    for name, sample in SAMPLES.items():
+        assert legacy_parse_date_and_time(sample, DATE) == parse_date_and_time(
+            sample, DATE
+        )
+        legacy = _time(lambda: legacy_parse_date_and_time(sample, DATE), args.number)
+        current = _time(lambda: parse_date_and_time(sample, DATE), args.number)
+        print(f"{name:<16} {legacy:10.2f} {current:10.2f} {legacy / current:7.1f}x")
+
+    # a whole timesheet with mixed formats through one parser, like a bulk import
+    shifts = (("8:00AM", "4:30PM"), ("07:15", "15:45"), ("9:00:00", "17:00"))
+    junctions = [
+        f"2020-03-{day:02d} {start}-{end}"
+        for day in range(1, 29)
+        for start, end in shifts
+    ]
+    batch = DateTimeParser()
+    assert [legacy_parse_date_time_junction(j) for j in junctions] == [
+        parse_date_time_junction(j, batch) for j in junctions
+    ]
+    number = max(args.number // len(junctions), 1)
+    legacy = _time(
+        lambda: [legacy_parse_date_time_junction(j) for j in junctions], number
+    )
+    current = _time(
+        lambda: [parse_date_time_junction(j, batch) for j in junctions], number
+    )
+    print(
+        f"{'timesheet':<16} {legacy:10.2f} {current:10.2f} {legacy / current:7.1f}x"
+        f"   ({len(junctions)} junctions per call)"
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,82 @@
+"""Measures login throughput of PasswordHasher.check_pass_hash_async at different pool
+sizes, next to checking the hashes inline on the event loop. While the logins run a
+ticker coroutine records how late the event loop wakes it up, which is the delay every
+other request (e.g. a clock in) would see during a login storm.
+
+    python -m benchmarks.password_hashing --logins 200 --sizes 1 2 4 8
+"""
+import argparse
+import asyncio
+import time
+
+from core.auth import PasswordHasher
+
+
+class HasherConfig:
+    PASSWORD_HASH_MODE = "pbkdf2:sha256:50000"
+    PASSWORD_SALT_LENGTH = 16
+    PASSWORD_HASH_POOL = "thread"
+    PASSWORD_HASH_WORKERS = 1
+    PASSWORD_HASH_MAX_PENDING = None
+    PASSWORD_HASH_TIMEOUT = 60.0
+
+
+async def _ticker(lags: list, stop: asyncio.Event, interval: float = 0.001):
+    loop = asyncio.get_event_loop()
+    while not stop.is_set():
+        start = loop.time()
+        await asyncio.sleep(interval)
+        lags.append((loop.time() - start - interval) * 1000.0)
+
+
+async def _run(hasher: PasswordHasher, password_hash: str, logins: int, inline: bool):
+    async def login():
+        if inline:
+            return hasher.check_pass_hash("password", password_hash)
+        return await hasher.check_pass_hash_async("password", password_hash)
+
+    lags = []
+    stop = asyncio.Event()
+    ticker = asyncio.ensure_future(_ticker(lags, stop))
+    await asyncio.sleep(0)
+    start = time.perf_counter()
+    results = await asyncio.gather(*[login() for _ in range(logins)])
+    elapsed = time.perf_counter() - start
+    stop.set()
+    await ticker
+    assert all(results)
+    return logins / elapsed, max(lags or [0.0])
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[0])
+    parser.add_argument("--logins", type=int, default=200)
+    parser.add_argument("--sizes", type=int, nargs="+", default=[1, 2, 4, 8])
+    parser.add_argument("--pools", nargs="+", default=["thread", "process"])
+    args = parser.parse_args(argv)
+
+    loop = asyncio.get_event_loop()
+    hasher = PasswordHasher(HasherConfig)
+    password_hash = hasher.generate_pass_hash("password")
+
+    rate, lag = loop.run_until_complete(_run(hasher, password_hash, args.logins, True))
+    print(f"{'inline':<8} {'-':>4} {rate:10.1f} logins/s   max loop lag {lag:9.2f} ms")
+
+    for pool in args.pools:
+        for size in args.sizes:
+            HasherConfig.PASSWORD_HASH_POOL = pool
+            HasherConfig.PASSWORD_HASH_WORKERS = size
+            hasher.init_app(HasherConfig)
+            # warm the pool up so worker start up isn't part of the measurement
+            loop.run_until_complete(_run(hasher, password_hash, size, False))
+            rate, lag = loop.run_until_complete(
+                _run(hasher, password_hash, args.logins, False)
+            )
+            print(
+                f"{pool:<8} {size:>4} {rate:10.1f} logins/s   max loop lag {lag:9.2f} ms"
+            )
+            hasher.shutdown()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,177 @@
+"""Measures clock punch latency under concurrent load. Every thread plays one user with
+its own session (like one request each) and punches in and out repeatedly, first the
+way punches used to be written (a commit for the record, the span and the user's clok
+pointer each) and then through User.clock_in_when / clock_out_when, which write the
+record, the journal entry and the pointer with a single commit.
+
+    python -m benchmarks.punch_latency --threads 1 4 16 --punches 50
+    python -m benchmarks.punch_latency --host 127.0.0.1 --user root --db-name clok_db
+"""
+import argparse
+import os
+import statistics
+import threading
+import time
+from datetime import timedelta
+
+from sqlalchemy import desc
+
+from benchmarks.seed import SEED_START, seed_database
+from web_server.database import DB, BaseModel
+from web_server.models import Clok, Job, User
+
+
+def legacy_clock_in(user: User, when):
+    c = Clok(user_id=user.id, job_id=user.job_id, time_in=when)
+    c.save()
+    user.set_clok(c)
+
+
+def legacy_clock_out(user: User, when, journal: str = None):
+    r = (
+        Clok.query()
+        .filter(Clok.user_id == user.id)
+        .filter(Clok.job_id == user.job_id)
+        .order_by(desc(Clok.time_in))
+        .first()
+    )
+    r.time_out = when
+    r.update_span()
+    r.save()
+    if journal is not None:
+        r.add_journal(journal)
+
+
+def atomic_clock_in(user: User, when):
+    user.clock_in_when(when)
+
+
+def atomic_clock_out(user: User, when, journal: str = None):
+    user.clock_out_when(when, journal=journal)
+
+
+MODES = {
+    "legacy": (legacy_clock_in, legacy_clock_out),
+    "atomic": (atomic_clock_in, atomic_clock_out),
+}
+
+
+def _worker(user_id, clock_in, clock_out, punches, start, timings, errors, barrier):
+    session = DB.begin_scope()
+    try:
+        user = User.get_by_id(user_id)
+        barrier.wait()
+        for n in range(punches):
+            when = start + timedelta(days=n)
+            for punch, args in (
+                (clock_in, (user, when)),
+                (clock_out, (user, when + timedelta(hours=8), "shift done")),
+            ):
+                begin = time.perf_counter()
+                try:
+                    punch(*args)
+                except Exception as e:
+                    session.rollback()
+                    errors.append(e)
+                    continue
+                timings.append((time.perf_counter() - begin) * 1000.0)
+    finally:
+        DB.end_scope(session)
+
+
+def _run(mode: str, threads: int, punches: int, start) -> dict:
+    clock_in, clock_out = MODES[mode]
+    timings, errors = [], []
+    barrier = threading.Barrier(threads + 1)
+    workers = [
+        threading.Thread(
+            target=_worker,
+            args=(
+                user_id,
+                clock_in,
+                clock_out,
+                punches,
+                start,
+                timings,
+                errors,
+                barrier,
+            ),
+        )
+        for user_id in range(1, threads + 1)
+    ]
+    for worker in workers:
+        worker.start()
+    barrier.wait()
+    begin = time.perf_counter()
+    for worker in workers:
+        worker.join()
+    elapsed = time.perf_counter() - begin
+
+    timings.sort()
+    return dict(
+        punches=len(timings),
+        errors=len(errors),
+        per_second=len(timings) / elapsed if elapsed else 0.0,
+        p50=statistics.median(timings) if timings else 0.0,
+        p95=timings[int(len(timings) * 0.95) - 1] if timings else 0.0,
+        max=timings[-1] if timings else 0.0,
+    )
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[0])
+    parser.add_argument("--threads", type=int, nargs="+", default=[1, 4, 16])
+    parser.add_argument("--punches", type=int, default=50, help="in/out pairs a user")
+    parser.add_argument("--history", type=int, default=100000, help="seeded records")
+    parser.add_argument("--sqlite", default="punch_latency_bench.db")
+    parser.add_argument("--host", help="benchmark against MySQL instead of SQLite")
+    parser.add_argument("--port", type=int, default=3306)
+    parser.add_argument("--user", default="root")
+    parser.add_argument("--password", default="")
+    parser.add_argument("--db-name", default="clok_db")
+    args = parser.parse_args(argv)
+
+    users = max(args.threads)
+    if args.host:
+        DB.init_app(
+            dict(
+                DATABASE_HOST=args.host,
+                DATABASE_PORT=args.port,
+                DATABASE_USERNAME=args.user,
+                DATABASE_PASSWORD=args.password,
+                DATABASE_NAME=args.db_name,
+                DATABASE_POOL_SIZE=users + 1,
+            )
+        )
+    else:
+        if os.path.exists(args.sqlite):
+            os.remove(args.sqlite)
+        DB.init_app(dict(USE_SQLITE_DATABASE=True, SQLITE_DATABASE_NAME=args.sqlite))
+
+    BaseModel.metadata.drop_all(DB.engine)
+    DB.create_tables(BaseModel)
+    seed_database(DB.session, users=users, jobs_per_user=1, cloks=args.history)
+    # every seeded user has a single job, make it their current one
+    for user in User.query():
+        user.job_id = Job.query().filter(Job.user_id == user.id).first().id
+    DB.session.commit()
+
+    # punches start after the seeded history and every run continues after the last
+    start = SEED_START + timedelta(days=args.history // users + 1)
+    print(
+        f"{'mode':<8} {'threads':>7} {'punches':>8} {'per sec':>9} {'p50 ms':>8} "
+        f"{'p95 ms':>8} {'max ms':>8} {'errors':>6}"
+    )
+    for threads in args.threads:
+        for mode in MODES:
+            result = _run(mode, threads, args.punches, start)
+            start += timedelta(days=args.punches)
+            print(
+                f"{mode:<8} {threads:>7} {result['punches']:>8} "
+                f"{result['per_second']:>9.1f} {result['p50']:>8.2f} "
+                f"{result['p95']:>8.2f} {result['max']:>8.2f} {result['errors']:>6}"
+            )
+
+
+if __name__ == "__main__":
+    main()
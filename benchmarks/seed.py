@@ -0,0 +1,68 @@
+"""This file contains helpers that seed a database with synthetic users, jobs and clock
+records for the benchmarks. Rows are written with chunked core inserts (executemany) so
+that tables with millions of records can be built in a reasonable amount of time. """
+import random
+from datetime import datetime, timedelta
+
+from core.date_utils import get_date_key, get_month, get_week
+from web_server.models import Clok, Job, User
+
+SEED_START = datetime(2018, 1, 1, 6, 0)
+
+
+def seed_database(
+    session,
+    users: int = 100,
+    jobs_per_user: int = 2,
+    cloks: int = 10000,
+    chunk_size: int = 50000,
+    start: datetime = SEED_START,
+    seed: int = 1,
+) -> dict:
+    """
+    Seeds `users` users, each with `jobs_per_user` jobs, and spreads `cloks` closed
+    clock records evenly between them (one shift per user per day starting at `start`).
+    Returns the number of rows written per table.
+    """
+    rand = random.Random(seed)
+    connection = session.connection()
+    user_ids = list(range(1, users + 1))
+
+    connection.execute(
+        User.__table__.insert(),
+        [dict(id=i, email=f"user{i}@bench.local", hash="x") for i in user_ids],
+    )
+    job_ids = {}
+    job_rows = []
+    for user_id in user_ids:
+        job_ids[user_id] = []
+        for n in range(jobs_per_user):
+            job_id = len(job_rows) + 1
+            job_ids[user_id].append(job_id)
+            job_rows.append(dict(id=job_id, user_id=user_id, name=f"job-{job_id}"))
+    connection.execute(Job.__table__.insert(), job_rows)
+
+    rows = []
+    for n in range(cloks):
+        user_id = user_ids[n % users]
+        time_in = start + timedelta(days=n // users, minutes=rand.randint(0, 180))
+        time_out = time_in + timedelta(minutes=rand.randint(30, 600))
+        rows.append(
+            dict(
+                user_id=user_id,
+                job_id=rand.choice(job_ids[user_id]),
+                date_key=get_date_key(time_in),
+                week_key=get_week(time_in),
+                month_key=get_month(time_in),
+                time_in=time_in,
+                time_out=time_out,
+                time_span=int((time_out - time_in).total_seconds()),
+            )
+        )
+        if len(rows) >= chunk_size:
+            connection.execute(Clok.__table__.insert(), rows)
+            rows = []
+    if rows:
+        connection.execute(Clok.__table__.insert(), rows)
+    session.commit()
+    return dict(users=users, jobs=len(job_rows), cloks=cloks)
@@ -0,0 +1,140 @@
+"""Compares the default and the tuned SQLITE_PROFILE on a database file. Writer threads
+(one user each, with its own session like one request each) punch in and out while
+reader threads run week reports over the users' whole history, and the punch and report
+throughput, punch latency and failed punches ("database is locked") are printed for
+each profile.
+
+    python -m benchmarks.sqlite_profile --writers 4 --readers 4 --punches 50
+"""
+import argparse
+import os
+import random
+import threading
+import time
+from datetime import timedelta
+
+from benchmarks.seed import SEED_START, seed_database
+from core.sqlite import SQLITE_PROFILES
+from web_server.aggregates import GROUP_BY_WEEK
+from web_server.database import DB, BaseModel
+from web_server.models import Job, User
+
+
+def _writer(user_id, punches, start, timings, errors, barrier):
+    session = DB.begin_scope()
+    try:
+        user = User.get_by_id(user_id)
+        barrier.wait()
+        for n in range(punches):
+            when = start + timedelta(days=n)
+            for punch, at in (
+                (user.clock_in_when, when),
+                (user.clock_out_when, when + timedelta(hours=8)),
+            ):
+                begin = time.perf_counter()
+                try:
+                    punch(at)
+                except Exception as e:
+                    session.rollback()
+                    errors.append(e)
+                    continue
+                timings.append((time.perf_counter() - begin) * 1000.0)
+    finally:
+        DB.end_scope(session)
+
+
+def _reader(user_ids, reports, done, barrier):
+    rand = random.Random(len(reports))
+    barrier.wait()
+    while not done.is_set():
+        session = DB.begin_scope()
+        try:
+            User.get_by_id(rand.choice(user_ids)).get_grouped_hours(GROUP_BY_WEEK)
+            reports.append(1)
+        finally:
+            DB.end_scope(session)
+
+
+def _run(args, profile: str) -> dict:
+    if os.path.exists(args.sqlite):
+        os.remove(args.sqlite)
+    DB.init_app(
+        dict(
+            USE_SQLITE_DATABASE=True,
+            SQLITE_DATABASE_NAME=args.sqlite,
+            SQLITE_PROFILE=profile,
+            DATABASE_POOL_SIZE=args.writers + args.readers,
+        )
+    )
+    DB.create_tables(BaseModel)
+    users = max(args.writers, args.readers)
+    seed_database(DB.session, users=users, jobs_per_user=1, cloks=args.history)
+    for user in User.query():
+        user.job_id = Job.query().filter(Job.user_id == user.id).first().id
+    DB.session.commit()
+    DB.session.close()
+    user_ids = list(range(1, users + 1))
+
+    start = SEED_START + timedelta(days=args.history // users + 1)
+    timings, errors, reports = [], [], []
+    done = threading.Event()
+    barrier = threading.Barrier(args.writers + args.readers + 1)
+    writers = [
+        threading.Thread(
+            target=_writer,
+            args=(user_id, args.punches, start, timings, errors, barrier),
+        )
+        for user_id in user_ids[: args.writers]
+    ]
+    readers = [
+        threading.Thread(target=_reader, args=(user_ids, reports, done, barrier))
+        for _ in range(args.readers)
+    ]
+    for thread in writers + readers:
+        thread.start()
+    barrier.wait()
+    begin = time.perf_counter()
+    for thread in writers:
+        thread.join()
+    elapsed = time.perf_counter() - begin
+    done.set()
+    for thread in readers:
+        thread.join()
+    DB.engine.dispose()
+
+    timings.sort()
+    return dict(
+        punches=len(timings),
+        errors=len(errors),
+        per_second=len(timings) / elapsed if elapsed else 0.0,
+        reports_per_second=len(reports) / elapsed if elapsed else 0.0,
+        p50=timings[len(timings) // 2] if timings else 0.0,
+        p95=timings[int(len(timings) * 0.95) - 1] if timings else 0.0,
+    )
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[0])
+    parser.add_argument("--writers", type=int, default=4)
+    parser.add_argument("--readers", type=int, default=4)
+    parser.add_argument("--punches", type=int, default=50, help="in/out pairs a user")
+    parser.add_argument("--history", type=int, default=50000, help="seeded records")
+    parser.add_argument("--sqlite", default="sqlite_profile_bench.db")
+    parser.add_argument("--profiles", nargs="+", default=list(SQLITE_PROFILES))
+    args = parser.parse_args(argv)
+
+    print(
+        f"{'profile':<8} {'punches':>8} {'per sec':>9} {'p50 ms':>8} {'p95 ms':>8} "
+        f"{'errors':>6} {'reports/s':>10}"
+    )
+    for profile in args.profiles:
+        result = _run(args, profile)
+        print(
+            f"{profile:<8} {result['punches']:>8} {result['per_second']:>9.1f} "
+            f"{result['p50']:>8.2f} {result['p95']:>8.2f} {result['errors']:>6} "
+            f"{result['reports_per_second']:>10.1f}"
+        )
+
+
+if __name__ == "__main__":
+    main()
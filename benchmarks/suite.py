@@ -0,0 +1,314 @@
+"""Load testing suite for the model layer and the HTTP API. It seeds a SQLite database
+(in memory unless --sqlite names a file, or a temporary file when the HTTP cases run
+with --concurrency above 1, since the single connection of an in memory database serves
+one request at a time) through the USE_SQLITE_DATABASE /
+SQLITE_DATABASE_NAME settings and measures clock in / out, the day, week and month
+hour reports, dump, token validation and password hashing one call at a time, then
+drives the API created by create_app with concurrent requests through an ASGI client.
+Every case reports p50 / p95 / p99 latency and throughput.
+
+Results can be saved with --output and compared against a saved run with --compare,
+which flags every case whose p95 or throughput got worse by more than --threshold
+percent and exits with status 1 if there is one.
+
+    python -m benchmarks.suite --users 50 --cloks 100000 --output baseline.json
+    python -m benchmarks.suite --users 50 --cloks 100000 --compare baseline.json
+"""
+import argparse
+import asyncio
+import json
+import os
+import random
+import sys
+import tempfile
+import time
+from datetime import timedelta
+
+from benchmarks.seed import SEED_START, seed_database
+from web_server.app import create_app
+from web_server.auth import issue_token
+from web_server.database import DB, BaseModel
+from web_server.extensions import password_hasher, report_cache, token_manager
+from web_server.models import Job, User
+from web_server.settings import BaseSettings
+
+try:
+    import httpx
+except ImportError:  # pragma: no cover
+    httpx = None
+
+PASSWORD = "benchmark-password"
+
+
+def _percentile(timings: list, q: float) -> float:
+    """Nearest rank percentile of sorted timings."""
+    if not timings:
+        return 0.0
+    return timings[min(int(len(timings) * q / 100.0 + 0.5), len(timings)) - 1]
+
+
+def _summary(timings: list, elapsed: float) -> dict:
+    timings = sorted(timings)
+    return dict(
+        n=len(timings),
+        per_second=len(timings) / elapsed if elapsed else 0.0,
+        p50=_percentile(timings, 50),
+        p95=_percentile(timings, 95),
+        p99=_percentile(timings, 99),
+    )
+
+
+def _measure(calls, before=None) -> dict:
+    """Times each call (in ms). `before` runs ahead of each call, outside the timing."""
+    timings = []
+    elapsed = 0.0
+    for call in calls:
+        if before is not None:
+            before()
+        start = time.perf_counter()
+        call()
+        took = time.perf_counter() - start
+        elapsed += took
+        timings.append(took * 1000.0)
+    return _summary(timings, elapsed)
+
+
+def _settings(args):
+    class SuiteSettings(BaseSettings):
+        USE_SQLITE_DATABASE = True
+        SQLITE_DATABASE_NAME = args.sqlite or ""
+        PASSWORD_HASH_MODE = args.hash_mode
+
+    return SuiteSettings
+
+
+def _seed(args) -> list:
+    BaseModel.metadata.drop_all(DB.engine)
+    DB.create_tables(BaseModel)
+    seed_database(
+        DB.session, users=args.users, jobs_per_user=args.jobs, cloks=args.cloks
+    )
+    password_hash = password_hasher.generate_pass_hash(PASSWORD)
+    jobs = {}
+    for job in Job.query().order_by(Job.id):
+        jobs.setdefault(job.user_id, job.id)
+    users = User.query().order_by(User.id).all()
+    for user in users:
+        user.hash = password_hash
+        user.job_id = jobs.get(user.id)
+    DB.session.commit()
+    return [user.id for user in users]
+
+
+def model_cases(args, user_ids: list) -> dict:
+    rand = random.Random(args.seed)
+    users = [User.get_by_id(user_id) for user_id in user_ids]
+    sample = [rand.choice(users) for _ in range(args.iterations)]
+    # punches start after the seeded history
+    start = SEED_START + timedelta(days=args.cloks // args.users + 1)
+    whens = [start + timedelta(days=n) for n in range(args.iterations)]
+    history = [SEED_START + timedelta(days=rand.randrange(30)) for _ in sample]
+
+    results = {}
+    results["clock_in"] = _measure(
+        lambda u=u, w=w: u.clock_in_when(w) for u, w in zip(sample, whens)
+    )
+    results["clock_out"] = _measure(
+        lambda u=u, w=w: u.clock_out_when(w + timedelta(hours=8))
+        for u, w in zip(sample, whens)
+    )
+    for name, method in (
+        ("day_hours", User.get_day_hours),
+        ("week_hours", User.get_week_hours),
+        ("month_hours", User.get_month_hours),
+    ):
+        calls = [lambda u=u, h=h, m=method: m(u, h) for u, h in zip(sample, history)]
+        results[name] = _measure(calls, before=report_cache.clear)
+        for call in calls:
+            call()
+        results[f"{name}_cached"] = _measure(calls)
+
+    dumps = sample[: max(args.iterations // 20, 1)]
+    results["dump"] = _measure(lambda u=u: u.dump() for u in dumps)
+
+    tokens = [token_manager.generate_token({"id": u.id}) for u in sample]
+    results["token_validate"] = _measure(
+        (lambda t=t: token_manager.validate_token(t) for t in tokens),
+        before=token_manager.clear_cache,
+    )
+    results["token_validate_cached"] = _measure(
+        lambda t=t: token_manager.validate_token(t) for t in tokens
+    )
+
+    hashes = sample[: max(args.iterations // 10, 1)]
+    results["password_check"] = _measure(
+        lambda u=u: u.verify_password(PASSWORD) for u in hashes
+    )
+    DB.session.rollback()
+    return results
+
+
+async def _drive(app, requests: list, concurrency: int) -> dict:
+    """
+    Sends the (method, url, json, headers) requests from `concurrency` concurrent
+    clients.
+    """
+    transport = httpx.ASGITransport(app=app)
+    queue = list(reversed(requests))
+    timings = []
+    failures = []
+
+    async with httpx.AsyncClient(transport=transport, base_url="http://bench") as c:
+
+        async def client():
+            while queue:
+                method, url, body, headers = queue.pop()
+                begin = time.perf_counter()
+                response = await c.request(method, url, json=body, headers=headers)
+                timings.append((time.perf_counter() - begin) * 1000.0)
+                if response.status_code >= 400:
+                    failures.append(response.status_code)
+
+        start = time.perf_counter()
+        await asyncio.gather(*[client() for _ in range(concurrency)])
+        elapsed = time.perf_counter() - start
+
+    return dict(_summary(timings, elapsed), failures=len(failures))
+
+
+def http_cases(app, args, user_ids: list) -> dict:
+    if httpx is None:
+        print("httpx is not installed, skipping the http cases")
+        return {}
+    rand = random.Random(args.seed)
+    sample = [rand.choice(user_ids) for _ in range(args.requests)]
+    start = SEED_START + timedelta(days=args.cloks // args.users + args.iterations + 2)
+
+    # every request is made as its user, with a token of their own
+    headers = {}
+    for user_id in sorted(set(sample) | set(user_ids[: args.concurrency])):
+        token = issue_token(User.get_by_id(user_id))
+        headers[user_id] = {"Authorization": f"Bearer {token}"}
+
+    # a few users punch in and out on the days after the model cases' punches
+    punches = []
+    for user_id in user_ids[: args.concurrency]:
+        for n in range(max(args.requests // args.concurrency // 2, 1)):
+            when = start + timedelta(days=n)
+            for kind, at in (("in", when), ("out", when + timedelta(hours=8))):
+                body = dict(type=kind, time=at.isoformat())
+                punches.append(("POST", "/api/v1/clok/punch", body, headers[user_id]))
+
+    cases = {
+        "http_latest": [
+            ("GET", f"/api/v1/user/{u}/latest", None, headers[u]) for u in sample
+        ],
+        "http_clok_list": [
+            ("GET", "/api/v1/clok/?limit=50", None, headers[u]) for u in sample
+        ],
+        "http_punch": punches,
+    }
+    results = {}
+    loop = asyncio.new_event_loop()
+    try:
+        for name, requests in cases.items():
+            if name == "http_punch":
+                # the punches of one user have to arrive in order
+                results[name] = loop.run_until_complete(_drive(app, requests, 1))
+            else:
+                results[name] = loop.run_until_complete(
+                    _drive(app, requests, args.concurrency)
+                )
+    finally:
+        loop.close()
+    return results
+
+
+def report(results: dict):
+    print(
+        f"{'case':<24} {'n':>6} {'per sec':>10} {'p50 ms':>9} {'p95 ms':>9} "
+        f"{'p99 ms':>9}"
+    )
+    for name, r in results.items():
+        print(
+            f"{name:<24} {r['n']:>6} {r['per_second']:>10.1f} {r['p50']:>9.3f} "
+            f"{r['p95']:>9.3f} {r['p99']:>9.3f}"
+        )
+        if r.get("failures"):
+            print(f"{'':<24} {r['failures']} requests failed")
+
+
+def compare(results: dict, baseline: dict, threshold: float) -> list:
+    """Prints the change against a saved run and returns the regressed cases."""
+    regressions = []
+    print(f"\n{'case':<24} {'p95 change':>11} {'per sec change':>15}")
+    for name, r in results.items():
+        before = baseline.get(name)
+        if before is None:
+            continue
+        p95 = (r["p95"] / before["p95"] - 1) * 100 if before["p95"] else 0.0
+        rate = (
+            (r["per_second"] / before["per_second"] - 1) * 100
+            if before["per_second"]
+            else 0.0
+        )
+        regressed = p95 > threshold or rate < -threshold
+        if regressed:
+            regressions.append(name)
+        flag = "  REGRESSION" if regressed else ""
+        print(f"{name:<24} {p95:>+10.1f}% {rate:>+14.1f}%{flag}")
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[0])
+    parser.add_argument(
+        "--sqlite", default="", help="database file (in memory or temporary)"
+    )
+    parser.add_argument("--users", type=int, default=50)
+    parser.add_argument("--jobs", type=int, default=2, help="jobs per user")
+    parser.add_argument("--cloks", type=int, default=50000)
+    parser.add_argument("--iterations", type=int, default=200, help="model calls")
+    parser.add_argument("--requests", type=int, default=500, help="http requests")
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--hash-mode", default="pbkdf2:sha256:50000")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--output", help="save the results as json")
+    parser.add_argument("--compare", help="results json of an earlier run")
+    parser.add_argument("--threshold", type=float, default=10.0, help="percent")
+    parser.add_argument("--skip-http", action="store_true")
+    args = parser.parse_args(argv)
+
+    temporary = None
+    if not args.sqlite and not args.skip_http and args.concurrency > 1:
+        fd, temporary = tempfile.mkstemp(prefix="suite-", suffix=".db")
+        os.close(fd)
+        args.sqlite = temporary
+    try:
+        app = create_app(_settings(args))
+        start = time.perf_counter()
+        user_ids = _seed(args)
+        print(f"seeded {args.cloks} records in {time.perf_counter() - start:.1f}s\n")
+
+        results = model_cases(args, user_ids)
+        if not args.skip_http:
+            results.update(http_cases(app, args, user_ids))
+    finally:
+        if temporary is not None:
+            DB.engine.dispose()
+            os.remove(temporary)
+    report(results)
+
+    if args.output:
+        with open(args.output, "w") as f:
+            pool = DB.pool_monitor.snapshot() if DB.pool_monitor else None
+            json.dump(dict(args=vars(args), results=results, pool=pool), f, indent=2)
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)["results"]
+        if compare(results, baseline, args.threshold):
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,43 +1,100 @@
 # -*- coding: utf-8 -*-
+from concurrent.futures import Executor, ProcessPoolExecutor, ThreadPoolExecutor
 from itsdangerous import TimedJSONWebSignatureSerializer as Serializer
 from werkzeug.security import check_password_hash, generate_password_hash
 
+from core.cache import TTLCache
+
+import asyncio
 import logging
 
 
 class TokenManager:
+    """
+    Generates and validates signed, expiring tokens. Serializers are built once per
+    timeout and reused, and tokens that passed validation are kept in a bounded cache
+    (never past their own expiry) so repeated requests with the same bearer token skip
+    the signature check. Call `invalidate_token` when a token is revoked.
+    """
+
     secret_key: str
     salt_length: int
     token_timeout: int
+    _serializers: dict = None
+    _verified: TTLCache = None
 
     def init_app(self, config):
         self.secret_key = config.SECRET_KEY
         self.salt_length = config.TOKEN_SALT_LENGTH or 32
         self.token_timeout = config.TOKEN_TIMEOUT or 60 * 60 * 24
+        self._serializers = {}
+        self._verified = TTLCache(
+            max_size=config.TOKEN_CACHE_SIZE or 1024,
+            ttl=config.TOKEN_CACHE_TTL or 60 * 5,
+        )
 
     def _serializer(self, timeout: int = None):
-        if timeout:
-            return Serializer(self.secret_key, expires_in=timeout)
-        else:
-            return Serializer(self.secret_key)
+        timeout = timeout or self.token_timeout
+        serializer = self._serializers.get(timeout)
+        if serializer is None:
+            serializer = Serializer(self.secret_key, expires_in=timeout)
+            self._serializers[timeout] = serializer
+        return serializer
 
-    def generate_token(self, timeout=None):
-        return self._serializer(timeout)
+    def generate_token(self, data: dict, timeout: int = None) -> str:
+        return self._serializer(timeout).dumps(data).decode("utf-8")
 
     def validate_token(self, token):
+        if isinstance(token, bytes):
+            token = token.decode("utf-8")
+        data = self._verified.get(token)
+        if data is not None:
+            return data
+
         s = self._serializer()
         # noinspection PyBroadException
         try:
-            data = s.loads(token)
-            return data
+            data, header = s.loads(token, return_header=True)
         except Exception:
             return False
+        self._verified.set(token, data, expires_at=header.get("exp"))
+        return data
+
+    def invalidate_token(self, token):
+        if token is None or self._verified is None:
+            return
+        if isinstance(token, bytes):
+            token = token.decode("utf-8")
+        self._verified.delete(token)
+
+    def clear_cache(self):
+        if self._verified is not None:
+            self._verified.clear()
+
+
+class PasswordHasherBusy(Exception):
+    """Raised when a hash could not be scheduled before PASSWORD_HASH_TIMEOUT."""
 
 
 class PasswordHasher:
+    """
+    Hashes and checks passwords. The *_async methods run the (deliberately slow)
+    PBKDF2 work on a bounded thread or process pool so it never blocks the event loop.
+    At most `max_pending` hashes are handed to the pool at once, later callers wait for
+    a free slot for up to `pending_timeout` seconds and then get PasswordHasherBusy, so
+    a burst of logins can't queue up unbounded work in front of other requests.
+    """
+
     logger: logging.Logger
     hash_mode: str
     salt_length: int
+    pool_type: str = "thread"
+    workers: int = 2
+    max_pending: int = 16
+    pending_timeout: float = 5.0
+    _executor: Executor = None
+    _slots: asyncio.Semaphore = None
+    _slots_loop: asyncio.AbstractEventLoop = None
 
     def __init__(self, config=None):
         if config is not None:
@@ -46,6 +103,11 @@ class PasswordHasher:
     def init_app(self, config):
         self.hash_mode = config.PASSWORD_HASH_MODE or "pbkdf2:sha256:100000"
         self.salt_length = config.PASSWORD_SALT_LENGTH or 16
+        self.pool_type = config.PASSWORD_HASH_POOL or "thread"
+        self.workers = config.PASSWORD_HASH_WORKERS or 2
+        self.max_pending = config.PASSWORD_HASH_MAX_PENDING or self.workers * 8
+        self.pending_timeout = config.PASSWORD_HASH_TIMEOUT or 5.0
+        self.shutdown()
 
     @staticmethod
     def check_pass_hash(password: str, password_hash: str) -> bool:
@@ -53,3 +115,50 @@ class PasswordHasher:
 
     def generate_pass_hash(self, password: str) -> str:
         return generate_password_hash(password, self.hash_mode, self.salt_length)
+
+    async def check_pass_hash_async(self, password: str, password_hash: str) -> bool:
+        return await self._run_in_pool(check_password_hash, password_hash, password)
+
+    async def generate_pass_hash_async(self, password: str) -> str:
+        return await self._run_in_pool(
+            generate_password_hash, password, self.hash_mode, self.salt_length
+        )
+
+    @property
+    def executor(self) -> Executor:
+        if self._executor is None:
+            if self.pool_type == "process":
+                self._executor = ProcessPoolExecutor(max_workers=self.workers)
+            elif self.pool_type == "thread":
+                # hashlib releases the GIL while it runs PBKDF2, so threads scale too
+                self._executor = ThreadPoolExecutor(
+                    max_workers=self.workers, thread_name_prefix="password-hasher"
+                )
+            else:
+                raise ValueError(f"Unknown PASSWORD_HASH_POOL {self.pool_type}")
+        return self._executor
+
+    def shutdown(self, wait: bool = True):
+        if self._executor is not None:
+            self._executor.shutdown(wait=wait)
+        self._executor = None
+        self._slots = None
+        self._slots_loop = None
+
+    async def _run_in_pool(self, func, *args):
+        loop = asyncio.get_event_loop()
+        if self._slots is None or self._slots_loop is not loop:
+            self._slots = asyncio.Semaphore(self.max_pending)
+            self._slots_loop = loop
+
+        slots = self._slots
+        try:
+            await asyncio.wait_for(slots.acquire(), self.pending_timeout)
+        except asyncio.TimeoutError:
+            raise PasswordHasherBusy(
+                f"{self.max_pending} password hashes are already pending"
+            )
+        try:
+            return await loop.run_in_executor(self.executor, func, *args)
+        finally:
+            slots.release()
@@ -0,0 +1,138 @@
+""" This file contains a small in process cache that bounds both its size (the least
+recently used entries are evicted first) and the age of its entries, and a per owner
+cache of computed values that can sit on top of it or on a shared backend. """
+import time
+import uuid
+from collections import OrderedDict
+from threading import Lock
+from typing import Any, Callable, Hashable
+
+_MISSING = object()
+# how long the in process backend keeps the values of closed periods, other workers
+# don't invalidate it, so their edits show up after this at the latest
+CLOSED_TTL = 3600.0
+
+
+class TTLCache:
+    """
+    A thread safe LRU cache whose entries also expire. Every entry gets the cache wide
+    `ttl` unless an earlier absolute `expires_at` (time.time() based) is given for it.
+    """
+
+    def __init__(self, max_size: int = 1024, ttl: float = 300.0):
+        self.max_size = max_size
+        self.ttl = ttl
+        self._entries = OrderedDict()
+        self._lock = Lock()
+
+    def get(self, key: Hashable, default: Any = None) -> Any:
+        with self._lock:
+            entry = self._entries.get(key, _MISSING)
+            if entry is _MISSING:
+                return default
+            value, expires_at = entry
+            if expires_at is not None and expires_at <= time.time():
+                del self._entries[key]
+                return default
+            self._entries.move_to_end(key)
+            return value
+
+    def set(self, key: Hashable, value: Any, expires_at: float = None):
+        if self.ttl is not None:
+            ttl_expires = time.time() + self.ttl
+            if expires_at is None or expires_at > ttl_expires:
+                expires_at = ttl_expires
+        with self._lock:
+            self._entries[key] = (value, expires_at)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+
+    def delete(self, key: Hashable):
+        with self._lock:
+            self._entries.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def __contains__(self, key: Hashable) -> bool:
+        return self.get(key, _MISSING) is not _MISSING
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+
+class ReportCache:
+    """
+    Caches computed values (like hour totals) per owner (a user). The values live in a
+    backend with the interface of TTLCache (get(key, default), set(key, value,
+    expires_at), delete(key), clear()), an in process TTLCache unless another backend,
+    e.g. one shared by every worker, is plugged in.
+
+    Every owner has a generation token that is part of the keys of its values, and
+    `invalidate` replaces it, which drops all of the owner's values at once without
+    having to know their keys. A generation that is missing (never set or evicted) is
+    replaced by a new one, so values of an older generation can never come back.
+
+    A `closed_ttl` of None keeps the values of closed periods until they are
+    invalidated, which is only allowed with a plugged in backend, the in process one
+    doesn't see the invalidations of other workers and falls back to CLOSED_TTL.
+    """
+
+    def __init__(
+        self,
+        backend=None,
+        ttl: float = 60.0,
+        closed_ttl: float = CLOSED_TTL,
+        max_size=4096,
+    ):
+        self.ttl = ttl
+        self._configure(backend, closed_ttl, max_size)
+
+    def init_app(self, config, backend=None):
+        self.ttl = config.REPORT_CACHE_TTL
+        self._configure(
+            backend, config.REPORT_CACHE_CLOSED_TTL, config.REPORT_CACHE_SIZE or 4096
+        )
+
+    def _configure(self, backend, closed_ttl: float, max_size: int):
+        if backend is None:
+            backend = TTLCache(max_size, ttl=None)
+            if closed_ttl is None:
+                closed_ttl = CLOSED_TTL
+        self.backend = backend
+        self.closed_ttl = closed_ttl
+
+    def _generation(self, owner: Hashable) -> str:
+        generation = self.backend.get(("generation", owner))
+        if generation is None:
+            generation = self.invalidate(owner)
+        return generation
+
+    def get_or_set(
+        self, owner: Hashable, key: Hashable, compute: Callable[[], Any], closed=False
+    ) -> Any:
+        """
+        Returns the cached value of the owner's key, or computes and caches it. Values
+        of closed periods, which only change when the owner's records are edited (and
+        then `invalidate` is called), are kept for `closed_ttl` seconds, until they are
+        invalidated when None.
+        """
+        full_key = ("value", owner, self._generation(owner), key)
+        value = self.backend.get(full_key, _MISSING)
+        if value is _MISSING:
+            value = compute()
+            ttl = self.closed_ttl if closed else self.ttl
+            expires_at = None if ttl is None else time.time() + ttl
+            self.backend.set(full_key, value, expires_at)
+        return value
+
+    def invalidate(self, owner: Hashable) -> str:
+        """Drops every cached value of the owner and returns its new generation."""
+        generation = uuid.uuid4().hex
+        self.backend.set(("generation", owner), generation)
+        return generation
+
+    def clear(self):
+        self.backend.clear()
@@ -1,3 +1,4 @@
+import re
 from typing import Union
 from datetime import datetime, timedelta
 from core.defines import DATE_FORMAT, DATE_TIME_FORMATS
@@ -17,15 +18,44 @@ def get_date_key(key: Union[datetime, int, str] = None) -> Union[None, int]:
 
 
 def get_week(date: datetime = None) -> int:
+    """Returns the year qualified week key of a date, 2026-03-22 -> 202612"""
     if date is None:
         date = datetime.now()
-    return int(date.strftime("%U"))
+    return int(date.strftime("%Y%U"))
 
 
 def get_month(date: datetime = None) -> int:
+    """Returns the year qualified month key of a date, 2026-03-22 -> 202603"""
     if date is None:
         date = datetime.now()
-    return date.month
+    return date.year * 100 + date.month
+
+
+def get_week_key(key: Union[datetime, int, str] = None) -> int:
+    """Normalizes a week key. Bare week numbers (0-53) are qualified with this year."""
+    if key is None or isinstance(key, datetime):
+        return get_week(key)
+    key = int(key)
+    if key < 100:
+        key += datetime.now().year * 100
+    return key
+
+
+def get_month_key(key: Union[datetime, int, str] = None) -> int:
+    """Normalizes a month key. Bare months (1-12) are qualified with this year."""
+    if key is None or isinstance(key, datetime):
+        return get_month(key)
+    key = int(key)
+    if key < 100:
+        key += datetime.now().year * 100
+    return key
+
+
+def to_local(when: Union[datetime, None]) -> Union[datetime, None]:
+    """Converts an aware datetime to the naive local time the records are stored in."""
+    if when is None or when.tzinfo is None:
+        return when
+    return when.astimezone().replace(tzinfo=None)
 
 
 def get_date() -> str:
@@ -38,35 +68,111 @@ def parse_date(date: Union[str, int, float, datetime]):
     if isinstance(date, (float, int)):
         return datetime.fromtimestamp(date)
     elif isinstance(date, str):
-        return datetime.strptime(date, "%Y-%m-%d %H:%M:%S")
+        try:
+            return datetime.strptime(date, "%Y-%m-%d %H:%M:%S")
+        except ValueError:
+            # isoformat strings, which is how datetimes come back from our json api
+            return datetime.fromisoformat(date)
     elif isinstance(date, datetime):
         return date
     else:
         raise ValueError(f"This format is not supported: ({date}) type({type(date)})")
 
 
-def parse_date_time_junction(junction: str) -> (datetime, datetime):
+# one pass regexes for everything the DATE_TIME_FORMATS accept, hours and minutes may
+# have one digit like strptime allows and AM/PM is case insensitive
+_TIME_PATTERN = r"(\d{1,2}):(\d{1,2})(?::(\d{1,2}))?([AP]M)?"
+_TIME_RE = re.compile(_TIME_PATTERN, re.IGNORECASE)
+_DATE_TIME_RE = re.compile(
+    r"(\d{4})-(\d{1,2})-(\d{1,2})\s+" + _TIME_PATTERN, re.IGNORECASE
+)
+
+
+class DateTimeParser:
+    """
+    Parses dates and times in the DATE_TIME_FORMATS. Every supported format is matched
+    by one precompiled regex instead of trying strptime with each format in turn.
+    Strings the regex rejects go through strptime, starting with the format that last
+    worked, so keep one parser per batch (e.g. per imported timesheet).
+    """
+
+    def __init__(self, formats=None):
+        self.formats = list(DATE_TIME_FORMATS if formats is None else formats)
+        self.last_format = None
+
+    def parse(self, date_time_str: str) -> datetime:
+        """Parses a full "date time" string."""
+        match = _DATE_TIME_RE.fullmatch(date_time_str.strip())
+        if match is not None:
+            year, month, day = (int(i) for i in match.group(1, 2, 3))
+            when = self._build(year, month, day, *match.group(4, 5, 6, 7))
+            if when is not None:
+                return when
+        return self._parse_strptime(date_time_str)
+
+    def parse_time(self, time: str, date: datetime) -> datetime:
+        """Parses a time string on the given date."""
+        match = _TIME_RE.fullmatch(time.strip())
+        if match is not None:
+            when = self._build(date.year, date.month, date.day, *match.groups())
+            if when is not None:
+                return when
+        return self._parse_strptime(f"{date.strftime(DATE_FORMAT)} {time.upper()}")
+
+    @staticmethod
+    def _build(year, month, day, hour, minute, second, meridiem):
+        hour = int(hour)
+        if meridiem is not None:
+            if not 1 <= hour <= 12:
+                return None
+            hour = hour % 12 + (12 if meridiem.upper() == "PM" else 0)
+        try:
+            return datetime(year, month, day, hour, int(minute), int(second or 0))
+        except ValueError:
+            return None
+
+    def _parse_strptime(self, date_time_str: str) -> datetime:
+        formats = self.formats
+        if self.last_format is not None:
+            formats = [self.last_format] + formats
+        for fmt in formats:
+            try:
+                when = datetime.strptime(date_time_str, fmt)
+            except ValueError:
+                continue
+            self.last_format = fmt
+            return when
+        raise ValueError(f"Could not parse time string {date_time_str}")
+
+
+_default_parser = DateTimeParser()
+
+
+def parse_date_time_junction(
+    junction: str, parser: DateTimeParser = None
+) -> (datetime, datetime):
     date_str, time_junc = junction.split(" ")
-    date = datetime.strptime(date_str, DATE_FORMAT)
+    try:
+        date = datetime.fromisoformat(date_str)
+    except ValueError:
+        date = datetime.strptime(date_str, DATE_FORMAT)
     time_str1, time_str2 = time_junc.split("-")
-    print(time_str1, time_str2)
-    return parse_date_and_time(time_str1, date), parse_date_and_time(time_str2, date)
-
+    return (
+        parse_date_and_time(time_str1, date, parser),
+        parse_date_and_time(time_str2, date, parser),
+    )
 
-def parse_date_and_time(time: str, date: datetime = None):
-    if date is not None:
-        date_str = date.strftime(DATE_FORMAT)
-    else:
-        date_str = datetime.now().strftime(DATE_FORMAT)
 
-    if len(time) <= 11:
-        date_time_str = f"{date_str} {time.upper()}"
-    else:
-        date_time_str = time
-    for fmt in DATE_TIME_FORMATS:
-        try:
-            return datetime.strptime(date_time_str, fmt)
-        except ValueError:
-            pass
+def parse_date_and_time(
+    time: str, date: datetime = None, parser: DateTimeParser = None
+) -> datetime:
+    parser = parser or _default_parser
+    if date is None:
+        date = datetime.now()
 
-    raise ValueError(f"Could not parse time string {time}")
+    try:
+        if len(time) <= 11:
+            return parser.parse_time(time, date)
+        return parser.parse(time)
+    except ValueError:
+        raise ValueError(f"Could not parse time string {time}")
@@ -0,0 +1,253 @@
+""" This file contains the instrumentation of our database connection pools. A
+PoolMonitor listens to the pool events of an engine and keeps counts of checkouts,
+connections opened and closed (churn), how many connections are checked out and in
+overflow at most, and the time callers waited for a connection, so pool sizes can be
+picked from what a worker actually uses. """
+import time
+from collections import deque
+from threading import Lock
+
+from sqlalchemy import event, exc
+from sqlalchemy.engine import Engine
+from sqlalchemy.pool import QueuePool, StaticPool
+
+# connection_record.info key the wait of the last checkout is stored under
+CHECKOUT_WAIT = "checkout_wait"
+
+
+class TimedQueuePool(QueuePool):
+    """
+    A QueuePool that stores how long each checkout took (waiting for a free connection
+    or opening a new one) in the connection record's info, for PoolMonitor to pick up
+    in its checkout listener. It behaves like a QueuePool otherwise.
+    """
+
+    def _do_get(self):
+        start = time.perf_counter()
+        record = super()._do_get()
+        record.info[CHECKOUT_WAIT] = time.perf_counter() - start
+        return record
+
+
+class SingleConnectionPool(StaticPool):
+    """
+    A StaticPool that hands its one connection to one checkout at a time, for in memory
+    SQLite databases (every new connection would open another, empty database). Later
+    checkouts wait until the connection is checked in again, so the statements of
+    concurrent sessions never share a transaction that one of them commits or rolls
+    back, and like a QueuePool they give up with a TimeoutError after `timeout`
+    seconds. The waits are stored like TimedQueuePool's.
+    """
+
+    def __init__(self, creator, timeout: float = 30.0, **kwargs):
+        super().__init__(creator, **kwargs)
+        self._timeout = timeout
+        self._checked_out = Lock()
+
+    def recreate(self):
+        pool = super().recreate()
+        pool._timeout = self._timeout
+        return pool
+
+    def _do_get(self):
+        start = time.perf_counter()
+        if not self._checked_out.acquire(timeout=self._timeout):
+            raise exc.TimeoutError(
+                f"The single connection of the pool is still checked out after "
+                f"{self._timeout}s"
+            )
+        try:
+            record = super()._do_get()
+        except Exception:
+            self._checked_out.release()
+            raise
+        record.info[CHECKOUT_WAIT] = time.perf_counter() - start
+        return record
+
+    def _do_return_conn(self, conn):
+        self._checked_out.release()
+
+
+class PoolMonitor:
+    """
+    Collects pool statistics of the engines it is attached to. The wait percentiles
+    cover the last `window` checkouts, the counters, peaks and the longest wait
+    everything since the last `reset`, summed over all engines (the primary and its
+    read replicas). The snapshot describes the pool of the first attached engine, and
+    the current state of every engine's pool under "pools". Waits are only measured for
+    TimedQueuePool and SingleConnectionPool pools.
+    """
+
+    def __init__(self, window: int = 10000):
+        self.window = window
+        self._lock = Lock()
+        self._engines = []
+        self.reset()
+
+    def init_app(self, config):
+        self.window = config.DATABASE_POOL_STATS_WINDOW or self.window
+        # engines of an earlier app (tests, reloads) no longer count
+        self.detach_all()
+        self.reset()
+
+    def reset(self):
+        with self._lock:
+            self._waits = deque(maxlen=self.window)
+            self._wait_max = 0.0
+            self._counts = dict(
+                checkouts=0,
+                checkins=0,
+                overflow_checkouts=0,
+                connects=0,
+                closes=0,
+                invalidations=0,
+            )
+            self._peak_checked_out = 0
+            self._peak_overflow = 0
+
+    def attach(self, engine: Engine):
+        """Registers the pool listeners on the engine (and pools it recreates)."""
+
+        def on_checkout(dbapi_connection, connection_record, connection_proxy):
+            # engine.pool is replaced when the engine is disposed
+            self._on_checkout(engine.pool, connection_record.info)
+
+        listeners = [
+            ("connect", self._on_connect),
+            ("checkout", on_checkout),
+            ("checkin", self._on_checkin),
+            ("close", self._on_close),
+            ("close_detached", self._on_close),
+            ("invalidate", self._on_invalidate),
+        ]
+        for name, listener in listeners:
+            event.listen(engine, name, listener)
+        self._engines.append((engine, listeners))
+
+    def detach_all(self):
+        """Removes the listeners from every engine the monitor was attached to."""
+        for engine, listeners in self._engines:
+            for name, listener in listeners:
+                event.remove(engine, name, listener)
+        self._engines = []
+
+    def _on_connect(self, dbapi_connection, connection_record):
+        with self._lock:
+            self._counts["connects"] += 1
+
+    def _on_checkout(self, pool, info: dict):
+        wait = info.pop(CHECKOUT_WAIT, None)
+        checked_out = _call(pool, "checkedout")
+        overflow = _overflow(pool)
+        size = _call(pool, "size")
+        with self._lock:
+            self._counts["checkouts"] += 1
+            if wait is not None:
+                self._waits.append(wait)
+                self._wait_max = max(self._wait_max, wait)
+            if checked_out is not None:
+                self._peak_checked_out = max(self._peak_checked_out, checked_out)
+                if size is not None and checked_out > size:
+                    self._counts["overflow_checkouts"] += 1
+            if overflow is not None:
+                self._peak_overflow = max(self._peak_overflow, overflow)
+
+    def _on_checkin(self, dbapi_connection, connection_record):
+        with self._lock:
+            self._counts["checkins"] += 1
+
+    def _on_close(self, dbapi_connection, *args):
+        with self._lock:
+            self._counts["closes"] += 1
+
+    def _on_invalidate(self, dbapi_connection, connection_record, exception):
+        with self._lock:
+            self._counts["invalidations"] += 1
+
+    def snapshot(self) -> dict:
+        """
+        The counters, the current and peak checked out / overflow connections, the
+        saturation (checked out connections over the pool's size plus max overflow)
+        and the checkout waits (count, mean, p50, p95, p99 and max in milliseconds).
+        """
+        pools = [_pool_state(engine) for engine, _ in self._engines]
+        primary = pools[0] if pools else _pool_state(None)
+        capacity = _capacity(self._engines[0][0].pool if self._engines else None)
+
+        with self._lock:
+            waits = sorted(self._waits)
+            stats = dict(self._counts)
+            stats.update(
+                pool=primary["pool"],
+                pool_size=primary["pool_size"],
+                max_overflow=primary["max_overflow"],
+                checked_out=primary["checked_out"],
+                overflow=primary["overflow"],
+                peak_checked_out=self._peak_checked_out,
+                peak_overflow=self._peak_overflow,
+                saturation=primary["saturation"],
+                peak_saturation=_ratio(self._peak_checked_out, capacity),
+                checkout_wait_ms=dict(
+                    count=len(waits),
+                    mean=_ms(sum(waits) / len(waits)) if waits else 0.0,
+                    p50=_ms(_percentile(waits, 50)),
+                    p95=_ms(_percentile(waits, 95)),
+                    p99=_ms(_percentile(waits, 99)),
+                    max=_ms(self._wait_max),
+                ),
+                pools=pools,
+            )
+        return stats
+
+
+def _pool_state(engine) -> dict:
+    """The current size and use of an engine's pool."""
+    pool = engine.pool if engine is not None else None
+    checked_out = _call(pool, "checkedout")
+    return dict(
+        # repr masks the password
+        url=repr(engine.url) if engine is not None else None,
+        pool=type(pool).__name__ if pool is not None else None,
+        pool_size=_call(pool, "size"),
+        max_overflow=getattr(pool, "_max_overflow", None),
+        checked_out=checked_out,
+        overflow=_overflow(pool),
+        saturation=_ratio(checked_out, _capacity(pool)),
+    )
+
+
+def _capacity(pool):
+    # the pool's size plus max overflow, unknown without a limit
+    size = _call(pool, "size")
+    max_overflow = getattr(pool, "_max_overflow", None)
+    if size is None or max_overflow is None or max_overflow < 0:
+        return None
+    return size + max_overflow
+
+
+def _call(pool, name: str):
+    # size() / checkedout() / overflow() only exist on QueuePool style pools
+    method = getattr(pool, name, None)
+    return method() if method is not None else None
+
+
+def _overflow(pool):
+    # QueuePool.overflow() counts up from -pool_size, only the part above 0 is overflow
+    overflow = _call(pool, "overflow")
+    return None if overflow is None else max(overflow, 0)
+
+
+def _ratio(value, capacity):
+    if value is None or not capacity:
+        return None
+    return round(value / capacity, 3)
+
+
+def _percentile(values: list, q: float) -> float:
+    if not values:
+        return 0.0
+    return values[min(int(len(values) * q / 100.0 + 0.5), len(values)) - 1]
+
+
+def _ms(seconds: float) -> float:
+    return round(seconds * 1000.0, 3)
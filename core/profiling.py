@@ -0,0 +1,168 @@
+""" This file contains a per request SQL profiler. It listens to the cursor events of an
+engine and, while a profile is active in the current context, counts the statements
+and their time, groups them by statement text to find the same query running once per
+row (N+1 loads) and keeps the slowest ones. Finished profiles are kept in a ring
+buffer. """
+import heapq
+import logging
+import time
+from collections import deque
+from contextvars import ContextVar
+from threading import Lock
+
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+# longest statement text kept in a report
+_MAX_TEXT = 500
+
+
+class RequestProfile:
+    """
+    The statements run while handling one request. Parameters are never kept, they
+    carry password hashes, tokens and emails, only a hash of each parameter set so the
+    distinct ones can be counted.
+    """
+
+    def __init__(self, name: str, slowest: int = 5):
+        self.name = name
+        self.started = time.time()
+        self.statements = 0
+        self.db_time = 0.0
+        self.elapsed = None
+        self._slowest = slowest
+        # statement text -> [executions, seconds, hashes of the parameter sets]
+        self._by_text = {}
+        self._slow = []
+        self._lock = Lock()
+
+    def record(self, statement: str, parameters, seconds: float):
+        params = hash(repr(parameters))
+        with self._lock:
+            self.statements += 1
+            self.db_time += seconds
+            entry = self._by_text.get(statement)
+            if entry is None:
+                entry = self._by_text[statement] = [0, 0.0, set()]
+            entry[0] += 1
+            entry[1] += seconds
+            entry[2].add(params)
+            item = (seconds, self.statements, statement)
+            if len(self._slow) < self._slowest:
+                heapq.heappush(self._slow, item)
+            elif seconds > self._slow[0][0]:
+                heapq.heapreplace(self._slow, item)
+
+    def repeated(self, threshold: int) -> list:
+        """
+        The statements that ran at least `threshold` times, most frequent first. The
+        same text with different parameters each time is the N+1 pattern of lazy loads
+        made per row, the same parameters every time is a query that should be reused.
+        """
+        with self._lock:
+            found = [
+                dict(
+                    statement=_truncate(statement),
+                    count=count,
+                    distinct_parameters=len(params),
+                    ms=_ms(seconds),
+                )
+                for statement, (count, seconds, params) in self._by_text.items()
+                if count >= threshold
+            ]
+        return sorted(found, key=lambda r: r["count"], reverse=True)
+
+    def slowest(self) -> list:
+        with self._lock:
+            slow = sorted(self._slow, reverse=True)
+        return [dict(statement=_truncate(s), ms=_ms(seconds)) for seconds, _, s in slow]
+
+
+class SQLProfiler:
+    """
+    Profiles the SQL of the requests wrapped in `start` / `finish`. The statements are
+    attributed through a ContextVar, so the threadpool running a sync endpoint (which
+    gets a copy of the request's context) records into the request's profile and
+    statements run outside of a request cost a single lookup.
+    """
+
+    logger = logging.getLogger(__name__)
+
+    def __init__(self, history: int = 200, slowest: int = 5, repeat_threshold=5):
+        self.enabled = False
+        self.slowest = slowest
+        self.repeat_threshold = repeat_threshold
+        self._history = deque(maxlen=history)
+        self._current = ContextVar(f"sql_profile_{id(self)}", default=None)
+        self._engines = []
+
+    def init_app(self, config):
+        self.enabled = config.SQL_PROFILING
+        self.slowest = config.SQL_PROFILE_SLOWEST
+        self.repeat_threshold = config.SQL_PROFILE_REPEAT_THRESHOLD
+        self._history = deque(maxlen=config.SQL_PROFILE_HISTORY)
+
+    def attach(self, engine: Engine):
+        """Registers the cursor listeners on the engine, once per engine."""
+        if any(e is engine for e in self._engines):
+            return
+        self._engines.append(engine)
+        event.listen(engine, "before_cursor_execute", self._before_execute)
+        event.listen(engine, "after_cursor_execute", self._after_execute)
+
+    def _before_execute(self, conn, cursor, statement, parameters, context, many):
+        if self._current.get() is not None:
+            conn.info.setdefault("profile_start", []).append(time.perf_counter())
+
+    def _after_execute(self, conn, cursor, statement, parameters, context, many):
+        profile = self._current.get()
+        if profile is None:
+            return
+        starts = conn.info.get("profile_start")
+        if starts:
+            profile.record(statement, parameters, time.perf_counter() - starts.pop())
+
+    def start(self, name: str) -> RequestProfile:
+        profile = RequestProfile(name, self.slowest)
+        self._current.set(profile)
+        return profile
+
+    def finish(self, profile: RequestProfile) -> dict:
+        """Ends the profile, adds its report to the history and returns it."""
+        if self._current.get() is profile:
+            self._current.set(None)
+        profile.elapsed = time.time() - profile.started
+        report = dict(
+            request=profile.name,
+            started=profile.started,
+            ms=_ms(profile.elapsed),
+            statements=profile.statements,
+            db_ms=_ms(profile.db_time),
+            repeated=profile.repeated(self.repeat_threshold),
+            slowest=profile.slowest(),
+        )
+        self._history.append(report)
+        for repeated in report["repeated"]:
+            self.logger.warning(
+                "%s ran the same statement %s times: %s",
+                profile.name,
+                repeated["count"],
+                repeated["statement"],
+            )
+        return report
+
+    def history(self, limit: int = None) -> list:
+        """The reports of the last finished requests, newest first."""
+        reports = list(self._history)[::-1]
+        return reports[:limit] if limit is not None else reports
+
+    def clear(self):
+        self._history.clear()
+
+
+def _truncate(text: str) -> str:
+    return text if len(text) <= _MAX_TEXT else text[:_MAX_TEXT] + "..."
+
+
+def _ms(seconds: float) -> float:
+    return round(seconds * 1000.0, 3)
@@ -0,0 +1,97 @@
+""" This file contains the read replica set of a connection generator. Read only work is
+handed sessions on one of the replica engines, picked round robin or by the fewest
+checked out connections, while writes stay on the primary. """
+from itertools import count
+from threading import Lock
+from typing import Callable, List, Sequence
+
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+from sqlalchemy.orm import Session, sessionmaker
+
+ROUND_ROBIN = "round_robin"
+LEAST_CONNECTIONS = "least_connections"
+REPLICA_SELECTIONS = (ROUND_ROBIN, LEAST_CONNECTIONS)
+
+
+class ReplicaSet:
+    """
+    The engines and session makers of the replicas at `uris`, created on first use by
+    `engine_factory(uri)`. The checked out connections of every replica are counted
+    with pool events, which works for any pool class.
+    """
+
+    def __init__(
+        self,
+        uris: Sequence[str],
+        engine_factory: Callable[[str], Engine],
+        selection: str = ROUND_ROBIN,
+    ):
+        if selection not in REPLICA_SELECTIONS:
+            raise ValueError(
+                f"Unknown replica selection {selection}, use one of "
+                f"{REPLICA_SELECTIONS}"
+            )
+        self.uris = list(uris)
+        self.selection = selection
+        self._engine_factory = engine_factory
+        self._engines = None
+        self._makers = None
+        self._active = [0] * len(self.uris)
+        self._turns = count()
+        self._lock = Lock()
+
+    def __len__(self):
+        return len(self.uris)
+
+    @property
+    def engines(self) -> List[Engine]:
+        if self._engines is None:
+            with self._lock:
+                if self._engines is None:
+                    engines = [self._engine_factory(uri) for uri in self.uris]
+                    for index, engine in enumerate(engines):
+                        self._track(index, engine)
+                    self._makers = [
+                        sessionmaker(bind=e, autocommit=False, autoflush=False)
+                        for e in engines
+                    ]
+                    self._engines = engines
+        return self._engines
+
+    def _track(self, index: int, engine: Engine):
+        def checkout(dbapi_connection, connection_record, connection_proxy):
+            with self._lock:
+                self._active[index] += 1
+
+        def checkin(dbapi_connection, connection_record):
+            with self._lock:
+                self._active[index] -= 1
+
+        event.listen(engine, "checkout", checkout)
+        event.listen(engine, "checkin", checkin)
+
+    @property
+    def active(self) -> List[int]:
+        """The checked out connections of every replica."""
+        with self._lock:
+            return list(self._active)
+
+    def select(self) -> int:
+        """The index of the replica the next read session goes to."""
+        if self.selection == LEAST_CONNECTIONS:
+            with self._lock:
+                # ties go round robin so idle replicas share the load
+                turn = next(self._turns)
+                order = [(turn + i) % len(self.uris) for i in range(len(self.uris))]
+                return min(order, key=lambda i: self._active[i])
+        return next(self._turns) % len(self.uris)
+
+    def session(self, **kwargs) -> Session:
+        """A new session on the selected replica, `kwargs` override the maker's."""
+        self.engines  # creates the engines and their makers on first use
+        return self._makers[self.select()](**kwargs)
+
+    def dispose(self):
+        for engine in self._engines or ():
+            engine.dispose()
@@ -0,0 +1,116 @@
+""" This file contains the tuned SQLite profile for single node deployments (the web
+server on one machine, or the desktop client's DATABASE_FILE). Every new connection
+gets WAL journaling and performance pragmas, and writes are serialized through a single
+writer lock per process, so writers queue up in Python instead of failing with
+"database is locked" while readers keep reading the last committed state. """
+import logging
+import time
+from threading import Lock
+
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+SQLITE_PROFILE_DEFAULT = "default"
+SQLITE_PROFILE_TUNED = "tuned"
+SQLITE_PROFILES = (SQLITE_PROFILE_DEFAULT, SQLITE_PROFILE_TUNED)
+
+# statements that only read, everything else takes the writer lock. WITH is missing on
+# purpose, a common table expression can lead into an INSERT, UPDATE or DELETE
+_READ_PREFIXES = ("SELECT", "PRAGMA", "EXPLAIN")
+# connection info key marking the connections that hold the writer lock
+_HOLDS_WRITE_LOCK = "sqlite_write_lock"
+
+
+def tuned_pragmas(
+    synchronous: str = "NORMAL",
+    cache_size: int = -64000,
+    mmap_size: int = 256 * 1024 * 1024,
+    busy_timeout: float = 5.0,
+    wal: bool = True,
+) -> list:
+    """
+    The pragmas run on every new connection of the tuned profile. WAL lets readers run
+    next to the writer, and with WAL synchronous=NORMAL only syncs at checkpoints (a
+    power loss can drop the last commits, but never corrupts the database). A negative
+    cache_size is in KiB.
+    """
+    pragmas = []
+    if wal:
+        pragmas.append(("journal_mode", "WAL"))
+    pragmas += [
+        ("synchronous", synchronous),
+        ("cache_size", int(cache_size)),
+        ("mmap_size", int(mmap_size)),
+        ("busy_timeout", int(busy_timeout * 1000)),
+        ("temp_store", "MEMORY"),
+    ]
+    return pragmas
+
+
+class SQLiteWriter:
+    """
+    The writer lock of one SQLite database. A connection takes it on its first
+    statement that isn't a read and gives it back when it returns to the pool, after
+    its transaction was committed or rolled back (sessions release their connection at
+    the end of every transaction). Waiting is bounded by `timeout`, after which the
+    write goes ahead and SQLite's own busy timeout applies, so a thread that writes on
+    two connections at once can't deadlock itself.
+    """
+
+    logger = logging.getLogger(__name__)
+
+    def __init__(self, timeout: float = 5.0):
+        self.timeout = timeout
+        self._lock = Lock()
+        # transactions that took the lock and the time they waited for it
+        self.writes = 0
+        self.wait_time = 0.0
+
+    def attach(self, engine: Engine):
+        event.listen(engine, "before_cursor_execute", self._before_execute)
+        # not on reset, which fires before the rollback on return, while an uncommitted
+        # connection still holds SQLite's write lock; checkin comes after it
+        event.listen(engine, "checkin", self._release)
+        event.listen(engine, "invalidate", self._release_invalidated)
+
+    def _before_execute(self, conn, cursor, statement, parameters, context, many):
+        info = conn.info
+        if info.get(_HOLDS_WRITE_LOCK):
+            return
+        if statement.lstrip()[:7].upper().startswith(_READ_PREFIXES):
+            return
+        start = time.perf_counter()
+        if self._lock.acquire(timeout=self.timeout):
+            info[_HOLDS_WRITE_LOCK] = True
+        else:
+            self.logger.warning(
+                "waited %ss for the sqlite writer lock, writing without it",
+                self.timeout,
+            )
+        self.writes += 1
+        self.wait_time += time.perf_counter() - start
+
+    def _release(self, dbapi_connection, connection_record):
+        if connection_record is None:
+            return
+        if connection_record.info.pop(_HOLDS_WRITE_LOCK, False):
+            self._lock.release()
+
+    def _release_invalidated(self, dbapi_connection, connection_record, exception):
+        self._release(dbapi_connection, connection_record)
+
+
+def configure_engine(engine: Engine, pragmas: list, writer: SQLiteWriter = None):
+    """Runs the pragmas on every new connection and attaches the writer lock."""
+
+    @event.listens_for(engine, "connect")
+    def set_pragmas(dbapi_connection, connection_record):
+        cursor = dbapi_connection.cursor()
+        try:
+            for name, value in pragmas:
+                cursor.execute(f"PRAGMA {name}={value}")
+        finally:
+            cursor.close()
+
+    if writer is not None:
+        writer.attach(engine)
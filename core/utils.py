@@ -1,24 +1,61 @@
 """ This file contains our SqlAlchemy connection generator function which generates
 session factories for our databases. It also has a few utility functions that get used
 throughout the application. """
+import time
+from contextvars import ContextVar
 from datetime import datetime
 from multiprocessing import Lock
-from typing import Union
+from typing import Tuple, Union
 
-from sqlalchemy import create_engine
+from sqlalchemy import create_engine, event, inspect
 from sqlalchemy.engine import Engine
-from sqlalchemy.orm import sessionmaker
+from sqlalchemy.orm import Session, sessionmaker
 from sqlalchemy.pool import QueuePool
 
+from core.cache import TTLCache
 from core.defines import DATE_FORMAT, DATE_TIME_FORMATS
+from core.pool import SingleConnectionPool, TimedQueuePool
+from core.replicas import ROUND_ROBIN, ReplicaSet
+from core.sqlite import (
+    SQLITE_PROFILE_DEFAULT,
+    SQLITE_PROFILE_TUNED,
+    SQLITE_PROFILES,
+    SQLiteWriter,
+    configure_engine,
+    tuned_pragmas,
+)
 import asyncio
 
+# session.info keys: the session wrote (flushed or ran a bulk update / delete), and the
+# replica session that serves the reads of a scope
+_SESSION_WROTE = "wrote"
+_READ_SESSION = "read_session"
+
+
+def _mark_written(session, *args):
+    session.info[_SESSION_WROTE] = True
+
+
+def _mark_bulk_written(context):
+    # the bulk update / delete events get the query context instead of the session
+    context.session.info[_SESSION_WROTE] = True
+
 
 class SqlAlchemyConnGenerator:
     """
     Stores configuration information for sql database connection and implements helper
     methods for the generation of a session maker, sessions and engines.
-    Defaults to using the SingletonThreadPool for use in multi-threaded applications.
+    Defaults to a QueuePool (TimedQueuePool) for server databases, with the size,
+    overflow, timeout, recycle and pre ping options taken from the configuration. When
+    a `pool_monitor` (core.pool.PoolMonitor) is set it is attached to every engine
+    this creates. SQLite databases use the "default" or the "tuned" (WAL, pragmas, one
+    writer at a time, see core.sqlite) `sqlite_profile`.
+
+    With `replica_uris` the read only work that asks for `read_session` goes to read
+    replicas (see core.replicas), unless its scope already wrote or its owner wrote in
+    the last `sticky_seconds` (see `pin_to_primary`), so it reads its own writes. The
+    pins live in `pin_backend` (the interface of core.cache.TTLCache), an in process
+    TTLCache unless one shared by every worker is plugged in.
     """
 
     _lock: Lock
@@ -45,35 +82,105 @@ class SqlAlchemyConnGenerator:
         self._lock = Lock()
 
         self._pool_size = pool_size
+        self._max_overflow = kwargs.get("max_overflow", None)
+        self._pool_timeout = kwargs.get("pool_timeout", None)
+        self._pool_recycle = kwargs.get("pool_recycle", None)
+        self._pool_pre_ping = kwargs.get("pool_pre_ping", False)
+        self.pool_monitor = kwargs.get("pool_monitor", None)
 
         self._sqlite_db = sqlite_db
-        self._pool_type = kwargs.get("pool_type", QueuePool)
+        self._sqlite_profile = kwargs.get("sqlite_profile", SQLITE_PROFILE_DEFAULT)
+        self._sqlite_pragmas = kwargs.get("sqlite_pragmas", {})
+        self.sqlite_writer = None
+        self._pool_type = kwargs.get("pool_type", TimedQueuePool)
         self._echo = kwargs.get("echo", False)
 
+        self._replica_uris = list(kwargs.get("replica_uris", ()))
+        self._replica_selection = kwargs.get("replica_selection", ROUND_ROBIN)
+        self._sticky_seconds = kwargs.get("sticky_seconds", 5.0)
+        self._pinned = kwargs.get("pin_backend", None) or TTLCache(
+            10000, self._sticky_seconds
+        )
+
         self._engine = None
         self._maker = None
         self._current_session = None
+        self._replicas = None
+        self._scoped_session = ContextVar(f"scoped_session_{id(self)}", default=None)
 
-    def init_app(self, config: dict):
+    def init_app(self, config: dict, pool_monitor=None, pin_backend=None):
+        if not isinstance(config, dict):
+            # pydantic settings objects
+            config = config.dict()
         self._username = config.get("DATABASE_USERNAME", None)
         self._password = config.get("DATABASE_PASSWORD", None)
         self._db_name = config.get("DATABASE_NAME", None)
         self._hostname = config.get("DATABASE_HOST", None)
         self._host_port = config.get("DATABASE_PORT", 3306)
-        self._database_type = config.get("DATABASE_CONNECTOR", "mysql+mysqlconnector")
+        self._database_type = (
+            config.get("DATABASE_CONNECTOR", None) or "mysql+mysqlconnector"
+        )
         self._uri_string = "{0}://{1}:{2}@{3}:{4}/{5}"
         self._lock = Lock()
 
         self._pool_size = config.get("DATABASE_POOL_SIZE", None)
+        self._max_overflow = config.get("DATABASE_MAX_OVERFLOW", None)
+        self._pool_timeout = config.get("DATABASE_POOL_TIMEOUT", None)
+        self._pool_recycle = config.get("DATABASE_POOL_RECYCLE", None)
+        self._pool_pre_ping = config.get("DATABASE_POOL_PRE_PING", False)
+        self.pool_monitor = pool_monitor
+        self._sqlite_db = False
         if config.get("USE_SQLITE_DATABASE", False):
-            self._sqlite_db = config.get
-        self._sqlite_db = config.get("SQLITE_DATABASE_NAME", False) or False
-        self._pool_type = config.get("DATABASE_POOL_TYPE", QueuePool)
+            # a blank SQLITE_DATABASE_NAME means an in memory database
+            self._sqlite_db = config.get("SQLITE_DATABASE_NAME", None) or True
+        self._sqlite_profile = (
+            config.get("SQLITE_PROFILE", None) or SQLITE_PROFILE_DEFAULT
+        )
+        if self._sqlite_profile not in SQLITE_PROFILES:
+            raise ValueError(
+                f"Unknown SQLITE_PROFILE {self._sqlite_profile}, use one of "
+                f"{SQLITE_PROFILES}"
+            )
+        self._sqlite_pragmas = {
+            name: config[key]
+            for name, key in (
+                ("synchronous", "SQLITE_SYNCHRONOUS"),
+                ("cache_size", "SQLITE_CACHE_SIZE"),
+                ("mmap_size", "SQLITE_MMAP_SIZE"),
+                ("busy_timeout", "SQLITE_BUSY_TIMEOUT"),
+            )
+            if config.get(key, None) is not None
+        }
+        self.sqlite_writer = None
+        self._pool_type = config.get("DATABASE_POOL_TYPE", None) or TimedQueuePool
         self._echo = config.get("DATABASE_ECHO", False)
 
+        if self._sqlite_db:
+            self._replica_uris = [
+                f"sqlite:///{name}" for name in config.get("SQLITE_REPLICA_NAMES") or ()
+            ]
+        else:
+            self._replica_uris = []
+            for replica in config.get("DATABASE_REPLICA_HOSTS") or ():
+                # "host" or "host:port", the port defaults to the primary's
+                host, _, port = replica.partition(":")
+                self._replica_uris.append(
+                    self._server_uri(host, port or self._host_port)
+                )
+        self._replica_selection = (
+            config.get("DATABASE_REPLICA_SELECTION", None) or ROUND_ROBIN
+        )
+        self._sticky_seconds = (
+            config.get("DATABASE_REPLICA_STICKY_SECONDS", None) or 5.0
+        )
+        self._pinned = pin_backend or TTLCache(10000, self._sticky_seconds)
+
         self._engine = None
         self._maker = None
         self._current_session = None
+        if self._replicas is not None:
+            self._replicas.dispose()
+        self._replicas = None
 
     @property
     def sqlite_db(self):
@@ -87,16 +194,76 @@ class SqlAlchemyConnGenerator:
     def engine(self) -> Engine:
         if self._engine is None:
             if self._sqlite_db:
-                self._engine = create_engine(self.db_uri, echo=self._echo)
+                self._engine, self.sqlite_writer = self._create_sqlite_engine(
+                    self.db_uri
+                )
             else:
                 self._engine = create_engine(
                     self.db_uri,
                     poolclass=self._pool_type,
                     echo=self._echo,
-                    pool_size=self._pool_size or 0,
+                    **self.pool_options(self._pool_type),
                 )
+            if self.pool_monitor is not None:
+                self.pool_monitor.attach(self._engine)
         return self._engine
 
+    def _create_sqlite_engine(self, uri: str) -> Tuple[Engine, SQLiteWriter]:
+        """
+        The engine of a SQLite database (the primary or a replica file) in the
+        configured profile, and its writer lock in the tuned profile.
+        """
+        in_memory = uri == "sqlite://"
+        tuned = self._sqlite_profile == SQLITE_PROFILE_TUNED
+        kwargs = {}
+        # request sessions are used from the threadpool that runs the endpoint and
+        # closed from the event loop thread
+        connect_args = {"check_same_thread": False}
+        if in_memory:
+            # every connection to sqlite:// opens a new, empty database, so an in
+            # memory database is shared through a single connection, which one
+            # session at a time may use
+            kwargs["poolclass"] = SingleConnectionPool
+            if self._pool_timeout is not None:
+                kwargs["pool_timeout"] = self._pool_timeout
+        elif tuned:
+            # keep the connections (and their page caches) open instead of a new
+            # connection, with its pragmas, per checkout
+            kwargs["poolclass"] = self._pool_type
+            kwargs.update(self.pool_options(self._pool_type))
+        if tuned:
+            connect_args["timeout"] = self._sqlite_pragmas.get("busy_timeout", 5.0)
+
+        engine = create_engine(
+            uri, echo=self._echo, connect_args=connect_args, **kwargs
+        )
+        writer = None
+        if tuned:
+            # an in memory database has no journal to switch and a single connection
+            writer = None if in_memory else SQLiteWriter(connect_args["timeout"])
+            pragmas = tuned_pragmas(wal=not in_memory, **self._sqlite_pragmas)
+            configure_engine(engine, pragmas, writer)
+        return engine, writer
+
+    def pool_options(self, pool_type=QueuePool) -> dict:
+        """
+        The create_engine pool arguments that are configured. Options left as None get
+        SqlAlchemy's defaults (5 connections, 10 overflow, 30 second timeout, no
+        recycling), the size, overflow and timeout only apply to QueuePool pools.
+        """
+        options = dict(pool_pre_ping=bool(self._pool_pre_ping))
+        if self._pool_recycle is not None:
+            options["pool_recycle"] = self._pool_recycle
+        if issubclass(pool_type, QueuePool):
+            for name, value in (
+                ("pool_size", self._pool_size),
+                ("max_overflow", self._max_overflow),
+                ("pool_timeout", self._pool_timeout),
+            ):
+                if value is not None:
+                    options[name] = value
+        return options
+
     @property
     def port(self):
         return self._host_port
@@ -109,20 +276,25 @@ class SqlAlchemyConnGenerator:
             else:
                 return "sqlite://"
         else:
-            return self._uri_string.format(
-                self._database_type,
-                self._username,
-                self._password,
-                self._hostname,
-                self._host_port,
-                self._db_name,
-            )
+            return self._server_uri(self._hostname, self._host_port)
+
+    def _server_uri(self, host, port) -> str:
+        return self._uri_string.format(
+            self._database_type,
+            self._username,
+            self._password,
+            host,
+            port,
+            self._db_name,
+        )
 
     def maker(self):
         if self._maker is None:
-            self._maker = sessionmaker(
-                bind=self.engine, autocommit=False, autoflush=False
-            )
+            maker = sessionmaker(bind=self.engine, autocommit=False, autoflush=False)
+            event.listen(maker, "after_flush", _mark_written)
+            event.listen(maker, "after_bulk_update", _mark_bulk_written)
+            event.listen(maker, "after_bulk_delete", _mark_bulk_written)
+            self._maker = maker
         return self._maker()
 
     def make_new_session(self):
@@ -130,16 +302,157 @@ class SqlAlchemyConnGenerator:
 
     @property
     def session(self):
+        """
+        The session of the current scope (see `begin_scope`), which is one request in
+        the web server. Outside of a scope (scripts, commands) a single process wide
+        session is used.
+        """
+        scoped = self._scoped_session.get()
+        if scoped is not None:
+            return scoped
         if self._current_session is None:
             self.make_new_session()
         return self._current_session
 
+    def begin_scope(self) -> Session:
+        """
+        Starts a new session scope in the current context. Until `end_scope` is called
+        every `session` lookup made from this context (or contexts copied from it, like
+        the threadpool that runs sync endpoints) gets this session.
+        """
+        session = self.maker()
+        self._scoped_session.set(session)
+        return session
+
+    def end_scope(self, session: Session, close: bool = True):
+        """
+        Ends the scope started by `begin_scope`. Callers on an event loop can pass
+        close=False and run `close_session` in a worker thread instead.
+        """
+        if self._scoped_session.get() is session:
+            self._scoped_session.set(None)
+        if close:
+            self.close_session(session)
+
+    @staticmethod
+    def close_session(session: Session):
+        """
+        Rolls back anything left uncommitted and returns the connection, the same for
+        the replica session of the scope.
+        """
+        read_session = session.info.pop(_READ_SESSION, None)
+        if read_session is not None:
+            read_session.rollback()
+            read_session.close()
+        session.rollback()
+        session.close()
+
+    @property
+    def replicas(self) -> Union[ReplicaSet, None]:
+        if self._replicas is None and self._replica_uris:
+            self._replicas = ReplicaSet(
+                self._replica_uris, self._create_replica_engine, self._replica_selection
+            )
+        return self._replicas
+
+    def _create_replica_engine(self, uri: str) -> Engine:
+        if uri.startswith("sqlite"):
+            engine, _ = self._create_sqlite_engine(uri)
+        else:
+            engine = create_engine(
+                uri,
+                poolclass=self._pool_type,
+                echo=self._echo,
+                **self.pool_options(self._pool_type),
+            )
+        if self.pool_monitor is not None:
+            self.pool_monitor.attach(engine)
+        return engine
+
+    def read_session(self, owner=None) -> Session:
+        """
+        The session for read only work. Without replicas, in a scope (or process) whose
+        session wrote, or for an owner pinned by `pin_to_primary` this is `session`.
+        Otherwise it is a replica session kept for the rest of the scope and closed with
+        it, so every read of a request sees the same replica. Outside a scope nothing
+        would close it, so every call gets its own autocommit replica session, which
+        gives its connection back once a query's rows are read; relationships its
+        instances didn't load can't be loaded later.
+        """
+        if not self._replica_uris:
+            return self.session
+        primary = self.session
+        if primary.info.get(_SESSION_WROTE):
+            return primary
+        if owner is not None and self._pinned.get(owner, False):
+            return primary
+
+        if self._scoped_session.get() is None:
+            return self.replicas.session(autocommit=True)
+        # kept on the scope's session, the scope may run in a copy of the context
+        read_session = primary.info.get(_READ_SESSION)
+        if read_session is None:
+            read_session = primary.info[_READ_SESSION] = self.replicas.session()
+        return read_session
+
+    def pin_to_primary(self, owner):
+        """
+        Sends the reads of an owner (a user) to the primary for the next sticky seconds,
+        longer than the replicas lag behind, after it wrote.
+        """
+        if self._replica_uris:
+            self._pinned.set(owner, True, time.time() + self._sticky_seconds)
+
     def create_tables(self, base):
         base.metadata.create_all(self.engine)
 
+    def create_missing_indexes(self, base) -> list:
+        """
+        create_all skips tables that already exist, so databases created before an index
+        was declared on a model never receive it. This creates every declared index the
+        database is missing and returns the names of the ones it created.
+        """
+        inspector = inspect(self.engine)
+        existing_tables = set(inspector.get_table_names())
+        created = []
+        for table in base.metadata.tables.values():
+            if table.name not in existing_tables:
+                continue
+            existing = {i["name"] for i in inspector.get_indexes(table.name)}
+            for index in sorted(table.indexes, key=lambda i: i.name):
+                if index.name not in existing:
+                    index.create(self.engine)
+                    created.append(index.name)
+        return created
+
+    def create_missing_columns(self, base) -> list:
+        """
+        Adds the declared columns that existing tables are missing (nullable and without
+        server defaults, existing rows get NULL) and returns them as "table.column".
+        Like create_missing_indexes this only covers what create_all would skip.
+        """
+        inspector = inspect(self.engine)
+        existing_tables = set(inspector.get_table_names())
+        created = []
+        for table in base.metadata.tables.values():
+            if table.name not in existing_tables:
+                continue
+            existing = {c["name"] for c in inspector.get_columns(table.name)}
+            for column in table.columns:
+                if column.name in existing:
+                    continue
+                column_type = column.type.compile(dialect=self.engine.dialect)
+                with self.engine.begin() as connection:
+                    connection.execute(
+                        f"ALTER TABLE {table.name} ADD COLUMN {column.name} "
+                        f"{column_type}"
+                    )
+                created.append(f"{table.name}.{column.name}")
+        return created
+
     @property
     def locked_session(self):
-        # with self._lock:
+        # sessions are scoped per request, so there is no shared session to lock here
         return self.session
 
     @property
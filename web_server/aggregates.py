@@ -0,0 +1,98 @@
+"""This file contains the aggregation layer used by the hour reports. Instead of loading
+every Clok row (and its joined job and journals) into python just to add up the spans,
+the SUM and GROUP BY are pushed down to the database and only plain scalars and small
+tuples come back. """
+from datetime import datetime
+from typing import List, Tuple
+
+from sqlalchemy import func
+from sqlalchemy.orm import Query
+
+GROUP_BY_DAY = "day"
+GROUP_BY_WEEK = "week"
+GROUP_BY_MONTH = "month"
+GROUP_BY_JOB = "job"
+GROUP_BY_OPTIONS = (GROUP_BY_DAY, GROUP_BY_WEEK, GROUP_BY_MONTH, GROUP_BY_JOB)
+
+
+class HoursAggregator:
+    """
+    Builds column only SUM(time_span) queries against a Clok style model. Because the
+    queries select columns instead of entities none of the relationship loaders run and
+    the result rows are plain tuples.
+    """
+
+    def __init__(self, model=None):
+        self.model = None
+        self._group_columns = {}
+        if model is not None:
+            self.init_model(model)
+
+    def init_model(self, model):
+        self.model = model
+        self._group_columns = {
+            GROUP_BY_DAY: model.date_key,
+            GROUP_BY_WEEK: model.week_key,
+            GROUP_BY_MONTH: model.month_key,
+            GROUP_BY_JOB: model.job_id,
+        }
+
+    def _query(self, user_id: int, *columns) -> Query:
+        # reports are read only, they can run on a replica
+        return self.model.read_db(user_id).query(*columns)
+
+    def _filter(
+        self,
+        query: Query,
+        user_id: int,
+        job_id: int = None,
+        date_key: int = None,
+        week_key: int = None,
+        month_key: int = None,
+        start: datetime = None,
+        end: datetime = None,
+    ) -> Query:
+        model = self.model
+        query = query.filter(model.user_id == user_id)
+        if job_id is not None:
+            query = query.filter(model.job_id == job_id)
+        if date_key is not None:
+            query = query.filter(model.date_key == int(date_key))
+        if week_key is not None:
+            query = query.filter(model.week_key == int(week_key))
+        if month_key is not None:
+            query = query.filter(model.month_key == int(month_key))
+        if start is not None:
+            query = query.filter(model.time_in > start)
+        if end is not None:
+            query = query.filter(model.time_in < end)
+        return query
+
+    def total_query(self, user_id: int, **filters) -> Query:
+        """
+        The query `total` runs, one row with the summed time_span of every record
+        matching the filters. The accepted filters are the keyword arguments of
+        `_filter`.
+        """
+        query = self._query(user_id, func.coalesce(func.sum(self.model.time_span), 0))
+        return self._filter(query, user_id, **filters)
+
+    def total(self, user_id: int, **filters) -> int:
+        """Returns the summed time_span (in seconds) of the matching records."""
+        return int(self.total_query(user_id, **filters).scalar() or 0)
+
+    def grouped(self, group_by: str, user_id: int, **filters) -> List[Tuple[int, int]]:
+        """
+        Returns a list of (group key, summed time_span) tuples ordered by the group key.
+        `group_by` is one of GROUP_BY_OPTIONS.
+        """
+        if group_by not in self._group_columns:
+            raise ValueError(
+                f"Can not group hours by {group_by}, use one of {GROUP_BY_OPTIONS}"
+            )
+        column = self._group_columns[group_by]
+        query = self._query(
+            user_id, column, func.coalesce(func.sum(self.model.time_span), 0)
+        )
+        query = self._filter(query, user_id, **filters).group_by(column)
+        return [(key, int(total or 0)) for key, total in query.order_by(column)]
@@ -0,0 +1,216 @@
+"""This file contains the vectorized analytics used by payroll style reports that cover
+many users at once. The clock spans are pulled from a cursor a chunk at a time into
+NumPy column arrays, and the grouped sums, overtime and shift length histograms are
+computed over the whole batch instead of calling the per user `get_*_hours` methods in
+a loop. The results have the same (key, seconds) shape as those methods, keyed by
+user. """
+from datetime import datetime
+from typing import Dict, List, Sequence, Tuple
+
+import numpy as np
+from sqlalchemy import select
+
+from web_server.aggregates import (
+    GROUP_BY_DAY,
+    GROUP_BY_JOB,
+    GROUP_BY_MONTH,
+    GROUP_BY_OPTIONS,
+    GROUP_BY_WEEK,
+)
+from web_server.models import Clok
+
+# job_id and the keys are nullable, missing values are stored as this in the arrays
+MISSING = -1
+SPAN_COLUMNS = ("user_id", "job_id", "date_key", "week_key", "month_key", "time_span")
+# one bin per hour from 0 to 16 hours, anything longer lands in the last bin
+DEFAULT_SHIFT_BINS = np.arange(0, 17 * 3600, 3600)
+
+
+class ClokSpans:
+    """
+    Column arrays of clock records: user_id, job_id, date_key, week_key, month_key and
+    time_span as int64 (MISSING / 0 for NULLs) and time_in, time_out as datetime64[s]
+    (NaT for open records). Every array has one element per record.
+    """
+
+    def __init__(self, columns: Dict[str, np.ndarray]):
+        self.columns = columns
+
+    def __len__(self):
+        return len(self.columns["user_id"])
+
+    def __getitem__(self, name: str) -> np.ndarray:
+        return self.columns[name]
+
+    @classmethod
+    def from_rows(cls, rows: Sequence[tuple]) -> "ClokSpans":
+        """
+        Builds the arrays from (user_id, job_id, date_key, week_key, month_key,
+        time_span, time_in, time_out) tuples, the column order of `load`.
+        """
+        rows = list(rows)
+        columns = list(zip(*rows)) if rows else [()] * (len(SPAN_COLUMNS) + 2)
+        arrays = {
+            name: _int_array(values, 0 if name == "time_span" else MISSING)
+            for name, values in zip(SPAN_COLUMNS, columns)
+        }
+        arrays["time_in"] = np.array(columns[-2], dtype="datetime64[s]")
+        arrays["time_out"] = np.array(columns[-1], dtype="datetime64[s]")
+        return cls(arrays)
+
+    @classmethod
+    def concatenate(cls, chunks: List["ClokSpans"]) -> "ClokSpans":
+        if not chunks:
+            return cls.from_rows([])
+        return cls(
+            {
+                name: np.concatenate([chunk[name] for chunk in chunks])
+                for name in chunks[0].columns
+            }
+        )
+
+    @classmethod
+    def load(
+        cls,
+        user_ids: Sequence[int] = None,
+        job_id: int = None,
+        start: datetime = None,
+        end: datetime = None,
+        chunk_size: int = 10000,
+        session=None,
+        user_range: Tuple[int, int] = None,
+    ) -> "ClokSpans":
+        """
+        Reads the spans of the given users (every user without user_ids) with time_in
+        between start and end straight from a core cursor, `chunk_size` rows at a
+        time, so no ORM objects are built. `session` defaults to Clok.read_db().
+        `user_range` (first, last) selects a range of user ids with BETWEEN instead of
+        listing them.
+        """
+        table = Clok.__table__
+        columns = [table.c[name] for name in SPAN_COLUMNS]
+        query = select(columns + [table.c.time_in, table.c.time_out])
+        if user_ids is not None:
+            query = query.where(table.c.user_id.in_(list(user_ids)))
+        if user_range is not None:
+            query = query.where(table.c.user_id.between(*user_range))
+        if job_id is not None:
+            query = query.where(table.c.job_id == job_id)
+        if start is not None:
+            query = query.where(table.c.time_in > start)
+        if end is not None:
+            query = query.where(table.c.time_in < end)
+
+        result = (session or Clok.read_db()).execute(query)
+        chunks = []
+        while True:
+            rows = result.fetchmany(chunk_size)
+            if not rows:
+                break
+            chunks.append(cls.from_rows(rows))
+        return cls.concatenate(chunks)
+
+    def mask(self, selected: np.ndarray) -> "ClokSpans":
+        """Returns the records where the boolean array `selected` is true."""
+        return ClokSpans({name: a[selected] for name, a in self.columns.items()})
+
+    def _group_column(self, group_by: str) -> np.ndarray:
+        columns = {
+            GROUP_BY_DAY: "date_key",
+            GROUP_BY_WEEK: "week_key",
+            GROUP_BY_MONTH: "month_key",
+            GROUP_BY_JOB: "job_id",
+        }
+        if group_by not in columns:
+            raise ValueError(
+                f"Can not group hours by {group_by}, use one of {GROUP_BY_OPTIONS}"
+            )
+        return self.columns[columns[group_by]]
+
+    def _sum_by(self, *keys: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+        """Returns the unique key rows (sorted) and the summed time_span of each."""
+        if not len(self):
+            return np.empty((0, len(keys)), dtype=np.int64), np.empty(0, np.int64)
+        stacked = np.stack(keys, axis=1)
+        groups, inverse = np.unique(stacked, axis=0, return_inverse=True)
+        sums = np.bincount(inverse.ravel(), weights=self.columns["time_span"])
+        return groups, sums.astype(np.int64)
+
+    def totals(self, group_by: str, by_job=False) -> Dict[int, List[Tuple[int, int]]]:
+        """
+        Returns {user_id: [(key, seconds), ...]} like User.get_grouped_hours for every
+        user in the arrays. With `by_job` the dict is keyed by (user_id, job_id).
+        """
+        keys = [self.columns["user_id"]]
+        if by_job:
+            keys.append(self.columns["job_id"])
+        groups, sums = self._sum_by(*keys, self._group_column(group_by))
+        return _nest(groups, sums, by_job)
+
+    def user_totals(self) -> Dict[int, int]:
+        """Returns {user_id: seconds} summed over every record in the arrays."""
+        groups, sums = self._sum_by(self.columns["user_id"])
+        return {int(g[0]): int(s) for g, s in zip(groups, sums)}
+
+    def overtime(
+        self, threshold: int, group_by: str = GROUP_BY_WEEK, by_job=False
+    ) -> Dict[int, List[Tuple[int, int]]]:
+        """
+        Returns {user_id: [(key, seconds over threshold), ...]} for the periods where a
+        user worked more than `threshold` seconds, e.g. 40 * SECONDS_PER_HOUR per week.
+        """
+        keys = [self.columns["user_id"]]
+        if by_job:
+            keys.append(self.columns["job_id"])
+        groups, sums = self._sum_by(*keys, self._group_column(group_by))
+        over = sums - threshold
+        selected = over > 0
+        return _nest(groups[selected], over[selected], by_job)
+
+    def overtime_by_job(
+        self, threshold: int, group_by: str = GROUP_BY_WEEK
+    ) -> Dict[Tuple[int, int], int]:
+        """
+        Returns {(user_id, job_id): seconds} of overtime, where the time a user worked
+        beyond `threshold` seconds in a period counts over all of their jobs and is
+        split over the jobs in proportion to the time worked on each in that period
+        (rounded down to the second). Jobs without overtime are left out.
+        """
+        user_id, period = self.columns["user_id"], self._group_column(group_by)
+        job_groups, job_sums = self._sum_by(user_id, period, self.columns["job_id"])
+        # the (user, period) pair of every job group and the user's total of it
+        _, inverse = np.unique(job_groups[:, :2], axis=0, return_inverse=True)
+        totals = np.bincount(inverse.ravel(), weights=job_sums).astype(np.int64)
+        over = np.maximum(totals - threshold, 0)[inverse.ravel()]
+        shares = over * job_sums // np.maximum(totals[inverse.ravel()], 1)
+        result = {}
+        for (user, _, job), seconds in zip(job_groups.tolist(), shares.tolist()):
+            if seconds > 0:
+                result[(user, job)] = result.get((user, job), 0) + seconds
+        return result
+
+    def shift_histogram(
+        self, bins: Sequence[int] = DEFAULT_SHIFT_BINS
+    ) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Returns the numpy.histogram (counts, bin edges in seconds) of the closed shift
+        lengths. Shifts longer than the last edge are counted in the last bin.
+        """
+        bins = np.asarray(bins)
+        spans = self.columns["time_span"][~np.isnat(self.columns["time_out"])]
+        return np.histogram(np.minimum(spans, bins[-1]), bins=bins)
+
+
+def _int_array(values, missing: int) -> np.ndarray:
+    return np.fromiter(
+        (missing if v is None else v for v in values), dtype=np.int64, count=len(values)
+    )
+
+
+def _nest(groups: np.ndarray, sums: np.ndarray, by_job: bool) -> dict:
+    """Turns sorted (owner..., key) rows into {owner: [(key, seconds), ...]}."""
+    nested = {}
+    for row, seconds in zip(groups.tolist(), sums.tolist()):
+        owner = tuple(row[:2]) if by_job else row[0]
+        nested.setdefault(owner, []).append((row[-1], seconds))
+    return nested
@@ -1,14 +1,27 @@
-from fastapi import FastAPI
-from web_server.extensions import token_manager, password_hasher, login_manager
-from web_server.database import DB
-from web_server.routes import auth, clok, job, user
+from fastapi import Depends, FastAPI
+from web_server.extensions import (
+    login_manager,
+    password_hasher,
+    pool_monitor,
+    report_cache,
+    sql_profiler,
+    token_manager,
+)
+from web_server.auth import current_user
+from web_server.database import DB, get_session
+from web_server.profiling import SQLProfilingMiddleware
+from web_server.routes import auth, clok, job, status, user
+from web_server.serialization import FastJSONResponse
 
 
 def create_app(config) -> FastAPI:
     cfg = config()
-    DB.init_app(cfg)
+    pool_monitor.init_app(cfg)
+    DB.init_app(cfg, pool_monitor=pool_monitor if cfg.DATABASE_POOL_STATS else None)
     token_manager.init_app(cfg)
     password_hasher.init_app(cfg)
+    report_cache.init_app(cfg)
+    sql_profiler.init_app(cfg)
 
     tags_metadata = [
         {"name": "Users", "description": "API endpoints that manage user",},
@@ -24,6 +37,10 @@ def create_app(config) -> FastAPI:
             "name": "Auth",
             "description": "API endpoints that manage authentication and tokens",
         },
+        {
+            "name": "Status",
+            "description": "API endpoints that report the state of the server",
+        },
     ]
 
     app = FastAPI(
@@ -31,11 +48,36 @@ def create_app(config) -> FastAPI:
         title="Time Clok Server",
         description="This is an api server for the python timeclok app",
         version="0.2.0",
+        default_response_class=FastJSONResponse,
+    )
+
+    app.add_event_handler("shutdown", password_hasher.shutdown)
+    if cfg.SQL_PROFILING:
+        sql_profiler.attach(DB.engine)
+        for engine in DB.replicas.engines if DB.replicas is not None else ():
+            sql_profiler.attach(engine)
+        app.add_middleware(SQLProfilingMiddleware)
+
+    # every request gets its own database session, see database.get_session
+    session = [Depends(get_session)]
+    app.include_router(auth.api, prefix="/auth", tags=["Auth"], dependencies=session)
+    app.include_router(
+        clok.api, prefix="/api/v1/clok", tags=["Clock"], dependencies=session
+    )
+    app.include_router(
+        job.api, prefix="/api/v1/job", tags=["Jobs"], dependencies=session
+    )
+    app.include_router(
+        user.api, prefix="/api/v1/user", tags=["Users"], dependencies=session
     )
 
-    app.include_router(auth.api, prefix="/auth", tags=["Auth"])
-    app.include_router(clok.api, prefix="/api/v1/clok", tags=["Clock"])
-    app.include_router(job.api, prefix="/api/v1/job", tags=["Jobs"])
-    app.include_router(user.api, prefix="/api/v1/user", tags=["Users"])
+    # the statistics describe the server and the statements it ran, so they are only
+    # served to authenticated users (loading the user takes a pooled connection)
+    app.include_router(
+        status.api,
+        prefix="/api/v1/status",
+        tags=["Status"],
+        dependencies=session + [Depends(current_user)],
+    )
 
     return app
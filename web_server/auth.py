@@ -0,0 +1,42 @@
+"""This file contains the FastAPI dependency that authenticates requests. Clients log in
+at /auth/token and send the token they get back as a bearer token, which has to be a
+valid token_manager token that is still the user's current one, so logging in again (or
+clearing User.token) revokes the previous token. """
+from datetime import datetime, timedelta
+
+from fastapi import Depends, HTTPException
+from fastapi.security import HTTPAuthorizationCredentials, HTTPBearer
+
+from web_server.extensions import token_manager
+from web_server.models import User
+
+bearer = HTTPBearer(auto_error=False)
+
+
+def issue_token(user: User) -> str:
+    """Generates a new token for the user and makes it their current one."""
+    token = token_manager.generate_token({"id": user.id})
+    user.token = token
+    user.token_expire = datetime.now() + timedelta(seconds=token_manager.token_timeout)
+    user.save()
+    return token
+
+
+def current_user(
+    credentials: HTTPAuthorizationCredentials = Depends(bearer),
+) -> User:
+    """
+    FastAPI dependency returning the User whose bearer token the request carries, it
+    answers 401 for requests without a valid, current token.
+    """
+    data = False
+    if credentials is not None:
+        data = token_manager.validate_token(credentials.credentials)
+    user = User.get_by_id(data.get("id")) if isinstance(data, dict) else None
+    if user is None or user.token != credentials.credentials:
+        raise HTTPException(
+            status_code=401,
+            detail="Not authenticated",
+            headers={"WWW-Authenticate": "Bearer"},
+        )
+    return user
@@ -0,0 +1,149 @@
+"""This file contains maintenance commands that are run against the database outside of
+the web server. They use the same settings as the server, for example:
+
+    python -m web_server.commands backfill-keys --batch-size 5000
+"""
+import argparse
+
+from sqlalchemy import or_
+
+from core.date_utils import get_date_key, get_month, get_week, parse_date
+from core.defines import SECONDS_PER_HOUR
+from web_server.database import DB, BaseModel
+from web_server.extensions import report_cache
+from web_server.models import Clok, HoursSummary, journal_search
+from web_server.payroll import REPORT_FORMATS, run_payroll_report, write_report
+from web_server.settings import settings
+
+
+def backfill_date_keys(batch_size: int = 1000) -> int:
+    """
+    Rewrites the date, week and month keys of every Clok row from its time_in, walking
+    the table in id order one batch (and one commit) at a time. Rows that already have
+    the right keys are skipped so the command can be stopped and re-run safely.
+
+    :return: the number of rows that were updated
+    """
+    session = DB.session
+    updated = 0
+    last_id = 0
+    while True:
+        rows = (
+            session.query(
+                Clok.id, Clok.time_in, Clok.date_key, Clok.week_key, Clok.month_key
+            )
+            .filter(Clok.id > last_id)
+            .order_by(Clok.id)
+            .limit(batch_size)
+            .all()
+        )
+        if not rows:
+            break
+
+        changes = []
+        for clok_id, time_in, date_key, week_key, month_key in rows:
+            if time_in is None:
+                continue
+            keys = dict(
+                date_key=get_date_key(time_in),
+                week_key=get_week(time_in),
+                month_key=get_month(time_in),
+            )
+            if keys != dict(date_key=date_key, week_key=week_key, month_key=month_key):
+                changes.append(dict(id=clok_id, **keys))
+
+        if changes:
+            session.bulk_update_mappings(Clok, changes)
+            session.commit()
+            updated += len(changes)
+        last_id = rows[-1][0]
+
+    if updated:
+        # bulk updates skip the listeners that keep the hours summary in sync
+        HoursSummary.rebuild()
+        report_cache.clear()
+    return updated
+
+
+def backfill_open_shifts() -> int:
+    """
+    Adds the is_open column and its index to databases created before them and marks
+    every record without a time_out as open.
+
+    :return: the number of rows that were updated
+    """
+    for created in DB.create_missing_columns(BaseModel):
+        print(f"added column {created}")
+    for created in DB.create_missing_indexes(BaseModel):
+        print(f"added index {created}")
+    table = Clok.__table__
+    is_open = table.c.time_out.is_(None)
+    result = DB.session.execute(
+        table.update()
+        .where(or_(table.c.is_open.is_(None), table.c.is_open != is_open))
+        .values(is_open=is_open)
+    )
+    DB.session.commit()
+    return result.rowcount
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Time Clok maintenance commands")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    backfill = commands.add_parser(
+        "backfill-keys", help="rewrite date/week/month keys from time_in"
+    )
+    backfill.add_argument("--batch-size", type=int, default=1000)
+
+    commands.add_parser(
+        "backfill-open-shifts", help="add and fill the is_open column of the records"
+    )
+
+    commands.add_parser(
+        "build-search-index", help="create and fill the journal full text index"
+    )
+
+    rebuild = commands.add_parser(
+        "rebuild-summary", help="recompute the hours summary from the clock records"
+    )
+    rebuild.add_argument("--user-id", type=int, action="append", dest="user_ids")
+
+    payroll = commands.add_parser(
+        "payroll-report", help="write the hours of every user between two dates"
+    )
+    payroll.add_argument("start", help="first day of the period, e.g. 2020-03-01")
+    payroll.add_argument("end", help="day after the period, e.g. 2020-04-01")
+    payroll.add_argument("output", help="path of the report file")
+    payroll.add_argument("--format", choices=REPORT_FORMATS, default="csv")
+    payroll.add_argument("--workers", type=int, help="worker processes (cpu count)")
+    payroll.add_argument("--shards", type=int, help="user shards (one per worker)")
+    payroll.add_argument("--overtime-hours", type=float, default=40)
+
+    args = parser.parse_args(argv)
+    DB.init_app(settings.dict())
+
+    if args.command == "backfill-keys":
+        print(f"updated {backfill_date_keys(args.batch_size)} records")
+    elif args.command == "backfill-open-shifts":
+        print(f"updated {backfill_open_shifts()} records")
+    elif args.command == "build-search-index":
+        if journal_search.create_index(DB.engine):
+            print("built the journal search index")
+        else:
+            print("this database can't have a journal search index")
+    elif args.command == "rebuild-summary":
+        print(f"wrote {HoursSummary.rebuild(args.user_ids)} summary rows")
+    elif args.command == "payroll-report":
+        rows = run_payroll_report(
+            parse_date(args.start),
+            parse_date(args.end),
+            workers=args.workers,
+            shards=args.shards,
+            overtime_threshold=int(args.overtime_hours * SECONDS_PER_HOUR),
+        )
+        print(f"wrote {write_report(rows, args.output, args.format)} report rows")
+
+
+if __name__ == "__main__":
+    main()
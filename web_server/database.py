@@ -2,16 +2,19 @@
 and cloud databases that can be uses throughout the application. """
 import json
 from datetime import datetime
-from typing import Union
+from operator import attrgetter
+from typing import Tuple, Union
 
 from sqlalchemy import Column, DateTime, ForeignKey, Integer, JSON
 from sqlalchemy.ext.declarative import declarative_base
-from sqlalchemy.orm import Query
+from sqlalchemy.orm import Query, lazyload, selectinload
 from sqlalchemy.orm.exc import NoResultFound
 from sqlalchemy.exc import IntegrityError
+from starlette.concurrency import run_in_threadpool
 
 from core.utils import SqlAlchemyConnGenerator
 from core.defines import DATABASE_FILE
+from web_server.serialization import dumps_str
 
 # if this is not set to a filename then it will default to an in memory db by passing
 # true to the sqlite_db keyword.
@@ -20,17 +23,103 @@ DB = SqlAlchemyConnGenerator()
 BaseModel = declarative_base()
 
 
-def add_items_to_database(items):
-    for item in items:
-        _add_item(item)
+async def get_session():
+    """
+    FastAPI dependency that gives each request its own session for its whole lifetime.
+    The Model helpers (query, save, delete) made while handling the request all use it,
+    and it is closed (returning its connection to the pool) once the response is sent.
+    """
+    session = DB.begin_scope()
+    try:
+        yield session
+    finally:
+        DB.end_scope(session, close=False)
+        await run_in_threadpool(DB.close_session, session)
 
 
-def _add_item(item):
-    try:
-        DB.session.add(item)
-        DB.session.commit()
-    except IntegrityError:
-        DB.session.rollback()
+class BatchWriter:
+    """
+    Inserts plain row dicts into a table in batches, one multi row (executemany)
+    statement and one commit per batch. Rows that collide with a unique constraint are
+    skipped by the database itself (INSERT IGNORE / INSERT OR IGNORE) so one duplicate
+    doesn't roll back the rest of its batch. Other databases fall back to inserting the
+    rows of a batch one by one inside savepoints.
+    """
+
+    ignore_prefixes = {"mysql": "IGNORE", "sqlite": "OR IGNORE"}
+
+    def __init__(self, db_instance: SqlAlchemyConnGenerator = None, batch_size=1000):
+        self._db_instance = db_instance or DB
+        self.batch_size = batch_size
+
+    def insert(self, table, rows) -> int:
+        """Inserts the rows into the table and returns how many were written."""
+        session = self._db_instance.session
+        prefix = self.ignore_prefixes.get(session.bind.dialect.name)
+        inserted = 0
+        batch = []
+        for row in rows:
+            batch.append(row)
+            if len(batch) >= self.batch_size:
+                inserted += self._write(session, table, batch, prefix)
+                batch = []
+        if batch:
+            inserted += self._write(session, table, batch, prefix)
+        return inserted
+
+    def _write(self, session, table, batch, prefix) -> int:
+        groups = _uniform_groups(batch)
+        inserted = 0
+        try:
+            if prefix is not None:
+                statement = table.insert().prefix_with(prefix)
+                for rows in groups:
+                    inserted += session.execute(statement, rows).rowcount
+            else:
+                for row in (row for rows in groups for row in rows):
+                    try:
+                        with session.begin_nested():
+                            session.execute(table.insert(), row)
+                        inserted += 1
+                    except IntegrityError:
+                        pass
+            session.commit()
+        except Exception:
+            session.rollback()
+            raise
+        return inserted
+
+
+def _uniform_groups(rows) -> list:
+    """
+    executemany needs every row to have the same keys, so the rows are grouped by the
+    columns they set. Columns a row leaves out or sets to None are left out of its
+    group's statement, so their column defaults apply to it.
+    """
+    groups = {}
+    for row in rows:
+        row = {k: v for k, v in row.items() if v is not None}
+        groups.setdefault(frozenset(row), []).append(row)
+    return list(groups.values())
+
+
+def add_items_to_database(items, batch_size=1000):
+    """
+    Writes model instances with a BatchWriter, grouped per table in the order the
+    tables first appear (so parents listed before their children are written first).
+    """
+    tables = {}
+    for item in items:
+        mapper = item.__mapper__
+        row = {
+            prop.columns[0].key: getattr(item, prop.key) for prop in mapper.column_attrs
+        }
+        tables.setdefault(mapper.local_table, []).append(row)
+
+    writer = BatchWriter(batch_size=batch_size)
+    return {
+        table.name: writer.insert(table, rows) for table, rows in tables.items()
+    }
 
 
 class CRUDMixin(object):
@@ -73,32 +162,102 @@ class CRUDMixin(object):
         return f"<{self.__class__.__name__} {s}>"
 
 
+# loading profiles, from cheapest to most complete
+LOAD_SUMMARY = "summary"
+LOAD_LIST = "list"
+LOAD_DETAIL = "detail"
+
+
 class Model(CRUDMixin, BaseModel):
     """Base model class that includes CRUD convenience methods."""
 
     __abstract__ = True
     _db_instance = DB
+    # loading profile -> names of the relationships that profile loads up front (with
+    # a SELECT ... IN per relationship), every other relationship loads lazily
+    _load_profiles = {}
+
+    @classmethod
+    def query(cls, profile: str = None) -> Query:
+        query = cls._db_instance.locked_session.query(cls)
+        if profile is not None:
+            query = query.options(*cls.load_options(profile))
+        return query
 
     @classmethod
-    def query(cls) -> Query:
-        return cls._db_instance.locked_session.query(cls)
+    def load_options(cls, profile: str) -> list:
+        if profile != LOAD_SUMMARY and profile not in cls._load_profiles:
+            raise ValueError(f"{cls.__name__} has no {profile} loading profile")
+        names = cls._load_profiles.get(profile, ())
+        return [selectinload(getattr(cls, name)) for name in names] + [lazyload("*")]
 
     @classmethod
     def db(cls):
         return cls._db_instance.locked_session
 
+    @classmethod
+    def read_db(cls, owner=None):
+        """
+        The session for read only work on the owner's (a user id) records, a read
+        replica when they are configured, see SqlAlchemyConnGenerator.read_session.
+        Instances loaded from it must not be changed.
+        """
+        return cls._db_instance.read_session(owner)
+
+    @classmethod
+    def read_query(cls, profile: str = None, owner=None) -> Query:
+        query = cls.read_db(owner).query(cls)
+        if profile is not None:
+            query = query.options(*cls.load_options(profile))
+        return query
+
     @classmethod
     def count(self):
         return self.query().count()
 
+    @classmethod
+    def column_names(cls) -> Tuple[str, ...]:
+        """
+        The names of the table's columns, worked out once per class together with the
+        attrgetter that `to_dict` reads them with.
+        """
+        names = cls.__dict__.get("_column_names")
+        if names is None:
+            names = tuple(cls.__table__.columns.keys())
+            getter = attrgetter(*names)
+            cls._column_names = names
+            # attrgetter returns a bare value instead of a tuple for a single name
+            cls._column_getter = getter if len(names) > 1 else lambda o: (getter(o),)
+        return names
+
+    @classmethod
+    def query_rows(cls, *names: str) -> Query:
+        """
+        A query of plain row tuples (named like the columns) instead of model instances,
+        for list endpoints that only serialize the values. Defaults to every column.
+        """
+        names = names or cls.column_names()
+        return cls.db().query(*[getattr(cls, name) for name in names])
+
+    @classmethod
+    def read_rows(cls, *names: str, owner=None) -> Query:
+        """`query_rows` on the read session of the owner, see `read_db`."""
+        names = names or cls.column_names()
+        return cls.read_db(owner).query(*[getattr(cls, name) for name in names])
+
     @property
     def columns(self):
-        return [column for column in dict(self.__table__.columns).keys()]
+        return list(self.column_names())
 
     @property
     def to_dict(self):
+        names = self.column_names()
+        try:
+            return dict(zip(names, self._column_getter(self)))
+        except AttributeError:
+            pass
         d = {}
-        for name in self.columns:
+        for name in names:
             try:
                 value = self.__getattribute__(name)
             except AttributeError:
@@ -107,7 +266,7 @@ class Model(CRUDMixin, BaseModel):
         return d
 
     def to_json(self):
-        return json.dumps(self.to_dict)
+        return dumps_str(self.to_dict)
 
 
 class Tracked(object):
@@ -148,7 +307,7 @@ class SurrogatePK(object):
     id = Column(Integer, primary_key=True, autoincrement=True)
 
     @classmethod
-    def get_by_id(cls, record_id):
+    def get_by_id(cls, record_id, profile: str = None):
         """Get record by ID."""
         if any(
             (
@@ -157,7 +316,7 @@ class SurrogatePK(object):
             )
         ):
             try:
-                return cls.query().filter(cls.id == int(record_id)).one()
+                return cls.query(profile).filter(cls.id == int(record_id)).one()
             except NoResultFound:
                 pass
         return None
@@ -0,0 +1,58 @@
+"""This file contains the streaming encoders for user exports. They consume
+User.iter_dump() and emit the export a chunk at a time, either as NDJSON (one record per
+line) or as a chunked JSON document shaped like User.dump(). """
+from typing import Iterator
+
+from web_server.serialization import dumps_str as _dumps
+
+EXPORT_MEDIA_TYPES = {"ndjson": "application/x-ndjson", "json": "application/json"}
+
+
+def stream_ndjson(records, lines_per_chunk: int = 500) -> Iterator[str]:
+    """Yields lines of {"type": ..., "data": ...} objects, a few hundred per chunk."""
+    lines = []
+    for record_type, data in records:
+        lines.append(_dumps({"type": record_type, "data": data}))
+        if len(lines) >= lines_per_chunk:
+            yield "\n".join(lines) + "\n"
+            lines = []
+    if lines:
+        yield "\n".join(lines) + "\n"
+
+
+def stream_json(records, items_per_chunk: int = 500) -> Iterator[str]:
+    """
+    Yields a JSON document with the same shape as User.dump(). The records must arrive
+    grouped like iter_dump produces them (the user, then every job, then every clok).
+    """
+    keys = {"job": "jobs", "clok": "cloks"}
+    parts = ["{"]
+    current = None
+    seen = set()
+    count = 0
+    for record_type, data in records:
+        if record_type == "user":
+            parts.append(f'"user":{_dumps(data)}')
+            continue
+        if record_type != current:
+            if current is not None:
+                parts.append("]")
+            parts.append(f',"{keys[record_type]}":[')
+            current = record_type
+            seen.add(record_type)
+        else:
+            parts.append(",")
+        parts.append(_dumps(data))
+        count += 1
+        if count >= items_per_chunk:
+            yield "".join(parts)
+            parts = []
+            count = 0
+    if current is not None:
+        parts.append("]")
+    # a user without jobs or cloks still gets the empty lists dump() would return
+    for record_type in keys:
+        if record_type not in seen:
+            parts.append(f',"{keys[record_type]}":[]')
+    parts.append("}")
+    yield "".join(parts)
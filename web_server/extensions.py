@@ -1,7 +1,22 @@
 from core.auth import TokenManager, PasswordHasher
+from core.cache import ReportCache, TTLCache
+from core.pool import PoolMonitor
+from core.profiling import SQLProfiler
 from fastapi_login import LoginManager
 from web_server.settings import settings
 
 token_manager = TokenManager()
 password_hasher = PasswordHasher()
+# (user id, job id) -> id of the open Clok, see User.get_open_record
+open_shifts = TTLCache(settings.OPEN_SHIFT_CACHE_SIZE, settings.OPEN_SHIFT_CACHE_TTL)
+# (user id, job id or None) -> Clok.summary_dict, see Clok.get_latest_summary
+latest_records = TTLCache(
+    settings.LATEST_RECORD_CACHE_SIZE, settings.LATEST_RECORD_CACHE_TTL
+)
+# per user hour totals, configured by init_app, see User.get_day_hours
+report_cache = ReportCache()
+# database pool statistics, attached to the engine by create_app
+pool_monitor = PoolMonitor(settings.DATABASE_POOL_STATS_WINDOW)
+# per request SQL statistics, enabled by SQL_PROFILING, see web_server.profiling
+sql_profiler = SQLProfiler()
 login_manager = LoginManager(settings.SECRET_KEY, tokenUrl="/auth/token")
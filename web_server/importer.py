@@ -0,0 +1,177 @@
+"""This file contains the bulk importer that loads User.dump() shaped payloads, like the
+offline history of a desktop client, with batched multi row inserts instead of one
+commit per record. """
+from core.date_utils import get_date_key, get_month, get_week, parse_date
+from web_server.database import BatchWriter
+from web_server.models import (
+    Clok,
+    HoursSummary,
+    Job,
+    Journal,
+    User,
+    _truncate_seconds,
+    forget_cached_reads,
+)
+
+
+def import_dump(payload: dict, batch_size: int = 1000, user_id: int = None) -> dict:
+    """
+    Imports the users, jobs, cloks and journals of a payload. Both a single User.dump()
+    ("user", "jobs" and "cloks" with their "journals") and flat "users" / "journals"
+    lists are accepted. Records that already exist (same id or natural key) are skipped.
+
+    Users are only created when the payload carries their password hash, and nested
+    journals need the id of their clok.
+
+    With `user_id` (an API import) everything is imported for that existing user only:
+    no users are created, jobs and cloks get the user's id, and cloks of other users'
+    jobs and journals of other users' cloks are skipped.
+
+    :return: the number of written and skipped records per record type
+    """
+    users = list(payload.get("users") or [])
+    if payload.get("user"):
+        users.append(payload["user"])
+    default_user_id = users[0].get("id") if len(users) == 1 else None
+    if user_id is not None:
+        users = []
+        default_user_id = user_id
+
+    jobs = [_job_row(job, default_user_id) for job in payload.get("jobs") or []]
+    journals = [
+        _journal_row(j, j.get("clok_id")) for j in payload.get("journals") or []
+    ]
+    cloks = []
+    for clok in payload.get("cloks") or []:
+        cloks.append(_clok_row(clok, default_user_id))
+        for entry in clok.get("journals") or []:
+            journals.append(_journal_row(entry, clok.get("id")))
+    if user_id is not None:
+        for row in jobs + cloks:
+            if row is not None:
+                row["user_id"] = user_id
+
+    writer = BatchWriter(batch_size=batch_size)
+    result = {}
+
+    def write(name, model, rows):
+        valid = [row for row in rows if row is not None]
+        written = writer.insert(model.__table__, valid) if valid else 0
+        result[name] = dict(written=written, skipped=len(rows) - written)
+
+    write("users", User, [_user_row(u) for u in users])
+    write("jobs", Job, jobs)
+    if user_id is not None:
+        # checked after the jobs are written, so new jobs of the user count as owned
+        owned = _owned_ids(Job, user_id, {c["job_id"] for c in cloks}, batch_size)
+        cloks = [c if c["job_id"] in owned else None for c in cloks]
+    write("cloks", Clok, cloks)
+    if user_id is not None:
+        # a clok id of the payload may belong to a record of another user that made
+        # the import of the clok itself a skipped duplicate
+        clok_ids = {j["clok_id"] for j in journals if j}
+        owned = _owned_ids(Clok, user_id, clok_ids, batch_size)
+        journals = [j if j and j["clok_id"] in owned else None for j in journals]
+
+    # journals have no natural key of their own, so entries already stored for their
+    # clok are dropped here to keep re-importing the same history idempotent
+    existing = _existing_journals({j["clok_id"] for j in journals if j}, batch_size)
+    journals = [
+        None if j and (j["clok_id"], j["entry"]) in existing else j for j in journals
+    ]
+    write("journals", Journal, journals)
+
+    cloks = [c for c in cloks if c is not None]
+    if result["cloks"]["written"]:
+        # the batched inserts bypass the flush listeners that maintain the summary and
+        # drop the cached reads
+        HoursSummary.rebuild(sorted({c["user_id"] for c in cloks if c["user_id"]}))
+        forget_cached_reads({(c["user_id"], c["job_id"]) for c in cloks})
+    return result
+
+
+def _owned_ids(model, user_id: int, ids: set, batch_size: int) -> set:
+    """The ones of `ids` that are records of `model` belonging to the user."""
+    ids = sorted(i for i in ids if i is not None)
+    owned = set()
+    for i in range(0, len(ids), batch_size):
+        owned.update(
+            row.id
+            for row in model.db()
+            .query(model.id)
+            .filter(model.user_id == user_id)
+            .filter(model.id.in_(ids[i : i + batch_size]))
+        )
+    return owned
+
+
+def _existing_journals(clok_ids: set, batch_size: int) -> set:
+    clok_ids = sorted(clok_ids)
+    existing = set()
+    for i in range(0, len(clok_ids), batch_size):
+        existing.update(
+            Journal.db()
+            .query(Journal.clok_id, Journal.entry)
+            .filter(Journal.clok_id.in_(clok_ids[i : i + batch_size]))
+        )
+    return existing
+
+
+def _user_row(user: dict):
+    if not user.get("email") or not user.get("hash"):
+        return None
+    return dict(
+        id=user.get("id"),
+        email=user["email"],
+        hash=user["hash"],
+        last_login=parse_date(user.get("last_login")),
+    )
+
+
+def _job_row(job: dict, user_id: int = None):
+    if not job.get("name"):
+        return None
+    user_id = job.get("user_id") or user_id
+    return dict(id=job.get("id"), user_id=user_id, name=job["name"].lower())
+
+
+def _clok_row(clok: dict, user_id: int = None):
+    time_in = _truncate_seconds(parse_date(clok.get("time_in")))
+    time_out = _truncate_seconds(parse_date(clok.get("time_out")))
+    time_span = clok.get("time_span")
+    if time_span is None and time_in and time_out:
+        time_span = int((time_out - time_in).total_seconds())
+
+    row = dict(
+        id=clok.get("id"),
+        user_id=clok.get("user_id") or user_id,
+        job_id=clok.get("job_id"),
+        date_key=clok.get("date_key"),
+        week_key=clok.get("week_key"),
+        month_key=clok.get("month_key"),
+        time_in=time_in,
+        time_out=time_out,
+        time_span=time_span,
+        is_open=time_out is None,
+    )
+    if time_in is not None:
+        # dumps from older clients carry week/month keys without the year
+        row.update(
+            date_key=get_date_key(time_in),
+            week_key=get_week(time_in),
+            month_key=get_month(time_in),
+        )
+    return row
+
+
+def _journal_row(journal, clok_id: int = None):
+    if clok_id is None:
+        return None
+    if isinstance(journal, str):
+        return dict(clok_id=clok_id, entry=journal)
+    return dict(
+        id=journal.get("id"),
+        clok_id=clok_id,
+        time=parse_date(journal.get("time")),
+        entry=journal.get("entry"),
+    )
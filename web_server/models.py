@@ -5,15 +5,58 @@ without having to play with sql directly unless we want to. """
 from datetime import datetime
 from typing import Union
 
-from sqlalchemy import Column, DateTime, Integer, TEXT, UniqueConstraint, desc, String
-from sqlalchemy.orm import relationship
+from sqlalchemy import (
+    Boolean,
+    Column,
+    DateTime,
+    Index,
+    Integer,
+    TEXT,
+    UniqueConstraint,
+    desc,
+    String,
+)
+from sqlalchemy import event, func, inspect, literal
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.ext.hybrid import hybrid_property
+from sqlalchemy.orm import Session, column_property, object_session, relationship
 from sqlalchemy.orm.exc import NoResultFound
 
 
-from web_server.database import Model, SurrogatePK, Tracked, reference_col
+from web_server.aggregates import (
+    GROUP_BY_DAY,
+    GROUP_BY_MONTH,
+    GROUP_BY_WEEK,
+    HoursAggregator,
+)
+from web_server.database import (
+    DB,
+    LOAD_DETAIL,
+    LOAD_LIST,
+    LOAD_SUMMARY,
+    Model,
+    SurrogatePK,
+    Tracked,
+    reference_col,
+)
 from core.defines import SECONDS_PER_HOUR
-from core.date_utils import get_date_key, get_month, get_week, parse_date
-from web_server.extensions import token_manager, password_hasher
+from core.date_utils import (
+    get_date_key,
+    get_month,
+    get_month_key,
+    get_week,
+    get_week_key,
+    parse_date,
+    to_local,
+)
+from web_server.extensions import (
+    latest_records,
+    open_shifts,
+    password_hasher,
+    report_cache,
+    token_manager,
+)
+from web_server.search import JournalSearch
 
 
 class User(Model, SurrogatePK, Tracked):
@@ -22,8 +65,9 @@ class User(Model, SurrogatePK, Tracked):
     hash = Column(String(128), nullable=False)
     job_id = reference_col("time_clok_jobs", default=None, nullable=True)
     clok_id = reference_col("time_clok", default=None, nullable=True)
-    clok = relationship("Clok", lazy="joined")
-    job = relationship("Job", lazy="joined")
+    clok = relationship("Clok", foreign_keys=[clok_id])
+    job = relationship("Job", foreign_keys=[job_id])
+    _load_profiles = {LOAD_DETAIL: ("clok", "job")}
     last_login = Column(DateTime, onupdate=datetime.now)
     token = Column(String(256), nullable=True)
     token_expire = Column(DateTime, nullable=True)
@@ -44,7 +88,10 @@ class User(Model, SurrogatePK, Tracked):
         self.hash = password_hasher.generate_pass_hash(password)
 
     def verify_password(self, password):
-        return password_hasher.check_pass_hash(self.hash, password)
+        return password_hasher.check_pass_hash(password, self.hash)
+
+    async def verify_password_async(self, password):
+        return await password_hasher.check_pass_hash_async(password, self.hash)
 
     def set_clok(self, clok: "Clok"):
         self.clok = clok
@@ -68,13 +115,18 @@ class User(Model, SurrogatePK, Tracked):
             last_login=self.last_login,
         )
 
-    def get_by_month_key(self, key: Union[datetime, int, str] = None, all_jobs=False):
-        key = get_month() if key is None else key
+    def get_by_month_key(
+        self,
+        key: Union[datetime, int, str] = None,
+        all_jobs=False,
+        profile: str = LOAD_LIST,
+    ):
+        key = get_month_key(key)
         if all_jobs:
             return [
                 i
                 for i in (
-                    Clok.query()
+                    Clok.query(profile)
                     .filter(Clok.user_id == self.id)
                     .filter(Clok.month_key == int(key))
                     .all()
@@ -84,7 +136,7 @@ class User(Model, SurrogatePK, Tracked):
             return [
                 i
                 for i in (
-                    Clok.query()
+                    Clok.query(profile)
                     .filter(Clok.user_id == self.id)
                     .filter(Clok.month_key == int(key))
                     .filter(Clok.job_id == self.job_id)
@@ -92,13 +144,18 @@ class User(Model, SurrogatePK, Tracked):
                 )
             ]
 
-    def get_by_week_key(self, key: Union[datetime, int, str] = None, all_jobs=False):
-        key = get_week() if key is None else key
+    def get_by_week_key(
+        self,
+        key: Union[datetime, int, str] = None,
+        all_jobs=False,
+        profile: str = LOAD_LIST,
+    ):
+        key = get_week_key(key)
         if all_jobs:
             return [
                 i
                 for i in (
-                    Clok.query()
+                    Clok.query(profile)
                     .filter(Clok.user_id == self.id)
                     .filter(Clok.week_key == int(key))
                     .all()
@@ -108,7 +165,7 @@ class User(Model, SurrogatePK, Tracked):
             return [
                 i
                 for i in (
-                    self.query()
+                    Clok.query(profile)
                     .filter(Clok.user_id == self.id)
                     .filter(Clok.week_key == int(key))
                     .filter(Clok.job_id == self.job_id)
@@ -116,13 +173,18 @@ class User(Model, SurrogatePK, Tracked):
                 )
             ]
 
-    def get_by_date_key(self, key: Union[datetime, int, str] = None, all_jobs=False):
+    def get_by_date_key(
+        self,
+        key: Union[datetime, int, str] = None,
+        all_jobs=False,
+        profile: str = LOAD_LIST,
+    ):
         key = get_date_key(key)
         if all_jobs:
             return [
                 i
                 for i in (
-                    Clok.query()
+                    Clok.query(profile)
                     .filter(Clok.user_id == self.id)
                     .filter(Clok.date_key == key)
                     .all()
@@ -132,7 +194,7 @@ class User(Model, SurrogatePK, Tracked):
             return [
                 i
                 for i in (
-                    Clok.query()
+                    Clok.query(profile)
                     .filter(Clok.user_id == self.id)
                     .filter(Clok.job_id == self.job_id)
                     .filter(Clok.date_key == key)
@@ -140,10 +202,46 @@ class User(Model, SurrogatePK, Tracked):
                 )
             ]
 
+    def get_open_record(self):
+        """
+        Returns the open (not yet clocked out) record of the current job, or None. The
+        id of the open record is remembered per user and job in `open_shifts`, and a
+        miss falls back to the is_open index, so the lookup doesn't depend on how many
+        records the user has.
+        """
+        key = (self.id, self.job_id)
+        clok_id = open_shifts.get(key)
+        if clok_id is not None:
+            clok = Clok.get_by_id(clok_id, LOAD_SUMMARY)
+            # the shift may have been closed or deleted by another process
+            if (
+                clok is not None
+                and clok.is_open
+                and clok.user_id == self.id
+                and clok.job_id == self.job_id
+            ):
+                return clok
+            open_shifts.delete(key)
+
+        clok = (
+            Clok.query(LOAD_SUMMARY)
+            .filter(Clok.user_id == self.id)
+            .filter(Clok.job_id == self.job_id)
+            .filter(Clok.is_open.is_(True))
+            .order_by(desc(Clok.time_in))
+            .first()
+        )
+        if clok is not None:
+            open_shifts.set(key, clok.id)
+        return clok
+
     def get_last_record(self):
         if self.clok is None:
+            open_record = self.get_open_record()
+            if open_record is not None:
+                return open_record
             return (
-                Clok.query()
+                Clok.query(LOAD_SUMMARY)
                 .filter(Clok.user_id == self.id)
                 .filter(Clok.job_id == self.job_id)
                 .order_by(desc(Clok.time_in))
@@ -152,50 +250,158 @@ class User(Model, SurrogatePK, Tracked):
         else:
             return self.clok
 
-    def get_most_recent_record(self):
-        return Clok.query().order_by(desc(Clok.id)).first()
+    def get_most_recent_record(self, all_jobs=False, profile: str = LOAD_SUMMARY):
+        return Clok.get_latest(
+            self.id, None if all_jobs else self.job_id, profile=profile
+        )
 
-    def clock_in_when(self, when: datetime = None, out: datetime = None):
+    def clock_in_when(
+        self,
+        when: datetime = None,
+        out: datetime = None,
+        journal: str = None,
+        commit=True,
+    ):
+        """
+        Clocks in to the current job (and out again with `out`). The record, its journal
+        entry and the user's clok pointer are written in one transaction with a single
+        commit. With commit=False they are only flushed so that several punches can
+        share one transaction.
+        """
         when = when if when is not None else datetime.now()
         c = Clok(
             user_id=self.id,
             job_id=self.job_id,
             time_in=when,
-            date_key=get_date_key(when),
-            month_key=get_month(when),
-            week_key=get_week(when),
+            time_out=out,
+            journal_msg=journal,
         )
-        if out is not None:
-            c.time_out = out
-            c.update_span()
-
-        c.save()
-        self.set_clok(c)
+        c.update_span(commit=False)
+        self.clok = c
+        session = self.db()
+        session.add(self)
+        # flushed first so the id is known without reloading the record after commit
+        session.flush()
+        if c.is_open:
+            # remembered once the transaction commits, a rolled back id may be reused
+            session.info.setdefault(_OPEN_SHIFTS, {})[(self.id, self.job_id)] = c.id
+        if commit:
+            session.commit()
         return c
 
-    def clock_out_when(self, when: datetime = None):
+    def clock_out_when(self, when: datetime = None, journal: str = None, commit=True):
+        """Clocks out of the open record of the current job, with a single commit."""
         when = when if when is not None else datetime.now()
-        r = self.get_last_record()
+        r = self.get_open_record() or self.get_last_record()
+        if r is None:
+            raise ValueError(f"User {self.id} has no record to clock out of")
         r.time_out = when
-        r.update_span()
-        r.save()
+        r.update_span(commit=False)
+        if journal is not None:
+            r.add_journal(journal, commit=False)
+        key = (self.id, r.job_id)
+        session = self.db()
+        session.flush()
+        session.info.get(_OPEN_SHIFTS, {}).pop(key, None)
+        if commit:
+            session.commit()
+        open_shifts.delete(key)
+        return r
+
+    def punch(self, punches: list) -> list:
+        """
+        Applies clock in / out punches, like the ones an offline client recorded, in
+        time order inside one transaction with one commit. A punch is a dict with a
+        "type" (PUNCH_IN or PUNCH_OUT), a "time" and optionally a "journal" message.
+        If any punch fails none of them are written.
+
+        :return: the records that were clocked in or out, one per punch
+        """
+        records = []
+        session = self.db()
+        try:
+            for punch in sorted(punches, key=lambda p: p["time"]):
+                if punch["type"] == PUNCH_IN:
+                    punched = self.clock_in_when
+                elif punch["type"] == PUNCH_OUT:
+                    punched = self.clock_out_when
+                else:
+                    raise ValueError(
+                        f"Unknown punch type {punch['type']}, use one of {PUNCH_TYPES}"
+                    )
+                records.append(
+                    punched(punch["time"], journal=punch.get("journal"), commit=False)
+                )
+            session.commit()
+        except Exception:
+            session.rollback()
+            raise
+        return records
+
+    def _hours_filters(self, all_jobs=False, **filters):
+        if not all_jobs:
+            filters["job_id"] = self.job_id
+        return filters
+
+    def _cached_total(self, period_type: str, key: int, all_jobs=False):
+        """
+        The summed seconds of one day, week or month, cached in `report_cache` until a
+        record of the user is written. Periods before the current one are closed.
+        """
+        key = int(key)
+        column = _summary_key_columns()[period_type].key
+        filters = self._hours_filters(all_jobs, **{column: key})
+        return report_cache.get_or_set(
+            self.id,
+            (filters.get("job_id"), period_type, key, all_jobs),
+            lambda: clok_hours.total(self.id, **filters),
+            closed=key < _PERIOD_KEYS[period_type](datetime.now()),
+        )
 
     def get_day_hours(self, key: int = None, all_jobs=False):
-        records = self.get_by_date_key(key, all_jobs=all_jobs)
-        return sum([i.time_span for i in records])
+        key = get_date_key(datetime.now() if key is None else key)
+        return self._cached_total(GROUP_BY_DAY, key, all_jobs)
 
     def get_week_hours(self, key: int = None, all_jobs=False):
-        records = self.get_by_week_key(key, all_jobs=all_jobs)
-        return sum([i.time_span for i in records])
+        return self._cached_total(GROUP_BY_WEEK, get_week_key(key), all_jobs)
 
     def get_month_hours(self, key: int = None, all_jobs=False):
-        records = self.get_by_month_key(key, all_jobs=all_jobs)
-        return sum([i.time_span for i in records])
+        return self._cached_total(GROUP_BY_MONTH, get_month_key(key), all_jobs)
 
-    def get_time_span(self, start: datetime, end: datetime, all_jobs=False):
+    def get_grouped_hours(
+        self,
+        group_by: str,
+        start: datetime = None,
+        end: datetime = None,
+        all_jobs=False,
+    ):
+        """Returns (key, seconds) tuples grouped by day, week, month or job."""
+        return clok_hours.grouped(
+            group_by, self.id, **self._hours_filters(all_jobs, start=start, end=end)
+        )
+
+    def get_hours_summary(
+        self,
+        period_type: str,
+        start_key: int = None,
+        end_key: int = None,
+        all_jobs=False,
+    ):
+        """Returns (period key, seconds) tuples for day, week or month periods."""
+        return HoursSummary.totals(
+            self.id,
+            period_type,
+            job_id=None if all_jobs else self.job_id,
+            start_key=start_key,
+            end_key=end_key,
+        )
+
+    def get_time_span(
+        self, start: datetime, end: datetime, all_jobs=False, profile: str = LOAD_LIST
+    ):
         if all_jobs:
             return (
-                Clok.query()
+                Clok.query(profile)
                 .filter(Clok.user_id == self.id)
                 .filter(Clok.time_in > start)
                 .filter(Clok.time_in < end)
@@ -203,7 +409,7 @@ class User(Model, SurrogatePK, Tracked):
 
         else:
             return (
-                Clok.query()
+                Clok.query(profile)
                 .filter(Clok.user_id == self.id)
                 .filter(Clok.job_id == self.job_id)
                 .filter(Clok.time_in > start)
@@ -211,15 +417,45 @@ class User(Model, SurrogatePK, Tracked):
             )
 
     def get_span_hours(self, start: datetime, end: datetime, all_jobs=False):
-        return sum([i.time_span for i in self.get_time_span(start, end, all_jobs)])
+        return clok_hours.total(
+            self.id, **self._hours_filters(all_jobs, start=start, end=end)
+        )
 
     def dump(self):
         return {
             "user": self.to_dict,
-            "jobs": [i.to_dict for i in Job.query().filter(Job.user_id == self.id)],
-            "cloks": [i.to_dict for i in Clok.query().filter(Clok.user_id == self.id)],
+            "jobs": [
+                i.to_dict
+                for i in Job.read_query(owner=self.id).filter(Job.user_id == self.id)
+            ],
+            "cloks": [
+                i.to_dict
+                for i in Clok.read_query(LOAD_DETAIL, owner=self.id).filter(
+                    Clok.user_id == self.id
+                )
+            ],
         }
 
+    def iter_dump(self, chunk_size: int = 1000):
+        """
+        Streaming version of `dump`, yields ("user" | "job" | "clok", dict) pairs with
+        the same dicts. Jobs and cloks are read in keyset batches of `chunk_size` (id
+        after the last one of the previous batch), with the journals of a clok batch
+        fetched in one query, so no cursor stays open between batches and memory
+        stays flat however long the history is.
+        """
+        yield "user", self.to_dict
+        jobs = Job.read_query(owner=self.id).filter(Job.user_id == self.id)
+        for batch in _id_batches(jobs, Job.id, chunk_size):
+            for job in batch:
+                yield "job", job.to_dict
+
+        rows = Clok.read_rows(*Clok.dict_columns, owner=self.id).filter(
+            Clok.user_id == self.id
+        )
+        for batch in _id_batches(rows, Clok.id, chunk_size):
+            yield from _dump_clok_rows(batch, self.id)
+
 
 class Job(Model, SurrogatePK):
     __tablename__ = "time_clok_jobs"
@@ -250,39 +486,79 @@ class Clok(Model, SurrogatePK):
     __tablename__ = "time_clok"
     __table_args__ = (
         UniqueConstraint("job_id", "user_id", "time_in", "time_out", name="natural"),
+        # last record / time span lookups for a single job
+        Index("ix_time_clok_user_job_time_in", "user_id", "job_id", "time_in"),
+        # time span lookups across all jobs
+        Index("ix_time_clok_user_time_in", "user_id", "time_in"),
+        # open shift lookups for clocking out
+        Index("ix_time_clok_user_open", "user_id", "is_open", "job_id"),
+        # the key indexes carry job_id and time_span so the hour sums are covered
+        Index(
+            "ix_time_clok_user_date_key", "user_id", "date_key", "job_id", "time_span"
+        ),
+        Index(
+            "ix_time_clok_user_week_key", "user_id", "week_key", "job_id", "time_span"
+        ),
+        Index(
+            "ix_time_clok_user_month_key", "user_id", "month_key", "job_id", "time_span"
+        ),
     )
     id = Column(Integer, primary_key=True, autoincrement=True)
-    job_id = reference_col("time_clok_jobs")
-    user_id = reference_col("time_clok_users")
-    date_key = Column(Integer, default=get_date_key)
-    week_key = Column(Integer, default=get_week)
-    month_key = Column(Integer, default=get_month)
+    # the columns of the HoursSummary and cache keys load their old value before they
+    # are changed, so the after_update listeners see it even on expired records
+    job_id = column_property(reference_col("time_clok_jobs"), active_history=True)
+    user_id = column_property(reference_col("time_clok_users"), active_history=True)
+    date_key = column_property(
+        Column(Integer, default=lambda ctx: get_date_key(_default_time_in(ctx))),
+        active_history=True,
+    )
+    week_key = column_property(
+        Column(Integer, default=lambda ctx: get_week(_default_time_in(ctx))),
+        active_history=True,
+    )
+    month_key = column_property(
+        Column(Integer, default=lambda ctx: get_month(_default_time_in(ctx))),
+        active_history=True,
+    )
     _time_in = Column("time_in", DateTime, default=datetime.now)
     _time_out = Column("time_out", DateTime, default=None)
-    time_span = Column(Integer, default=0)
-
-    journal_entries = relationship("Journal", lazy="joined")
-    job = relationship("Job", lazy="joined")
+    time_span = column_property(Column(Integer, default=0), active_history=True)
+    # true until time_out is set, kept in sync by the time_out setter
+    is_open = Column(Boolean, default=lambda ctx: _default_is_open(ctx))
+
+    # nothing is joined by default, pick a loading profile for what will be read:
+    # summary (no relationships), list (job, e.g. for __repr__) or detail (to_dict)
+    journal_entries = relationship("Journal")
+    job = relationship("Job")
+    _load_profiles = {LOAD_LIST: ("job",), LOAD_DETAIL: ("journal_entries",)}
+    # the columns of to_dict, see row_dicts
+    dict_columns = (
+        "id",
+        "job_id",
+        "date_key",
+        "week_key",
+        "month_key",
+        "time_in",
+        "time_out",
+        "time_span",
+    )
 
-    @property
+    @hybrid_property
     def time_in(self):
         return self._time_in
 
     @time_in.setter
     def time_in(self, time_in: datetime):
-        self._time_in = datetime(
-            time_in.year, time_in.month, time_in.day, time_in.hour, time_in.minute
-        )
+        self._time_in = _truncate_seconds(time_in)
 
-    @property
+    @hybrid_property
     def time_out(self):
-        return self._time_in
+        return self._time_out
 
     @time_out.setter
     def time_out(self, time_out: datetime):
-        self._time_in = datetime(
-            time_out.year, time_out.month, time_out.day, time_out.hour, time_out.minute
-        )
+        self._time_out = _truncate_seconds(time_out)
+        self.is_open = self._time_out is None
 
     def __init__(
         self,
@@ -301,15 +577,21 @@ class Clok(Model, SurrogatePK):
         self.id = id
         self.user_id = user_id
         self.job_id = job_id
+        self.time_in = parse_date(time_in)
+        self.time_out = parse_date(time_out)
+        # keys that are not given explicitly are derived from time_in, and without a
+        # time_in they are left to the column defaults
+        if self.time_in is not None:
+            date_key = get_date_key(self.time_in) if date_key is None else date_key
+            week_key = get_week(self.time_in) if week_key is None else week_key
+            month_key = get_month(self.time_in) if month_key is None else month_key
         self.date_key = date_key
         self.week_key = week_key
         self.month_key = month_key
-        self.time_in = parse_date(time_in)
-        self.time_out = parse_date(time_out)
         if time_span is not None:
             self.time_span = time_span
         if journal_msg is not None:
-            self.add_journal(journal_msg)
+            self.add_journal(journal_msg, commit=False)
 
     @property
     def to_dict(self):
@@ -325,10 +607,69 @@ class Clok(Model, SurrogatePK):
             journals=self.get_journals,
         )
 
-    def update_span(self):
+    @classmethod
+    def row_dicts(cls, rows, owner=None) -> list:
+        """
+        Turns `query_rows(*dict_columns)` rows into dicts shaped like to_dict, with the
+        journals of every row fetched in one query instead of a lazy load per record.
+        Rows from `read_rows` should pass the same owner, so both come from one session.
+        """
+        journals = {}
+        entries = (
+            Journal.read_db(owner)
+            .query(Journal.clok_id, Journal.entry)
+            .filter(Journal.clok_id.in_([row.id for row in rows]))
+            .order_by(Journal.id)
+        )
+        for clok_id, entry in entries:
+            journals.setdefault(clok_id, []).append(entry)
+        return [dict(row._asdict(), journals=journals.get(row.id, [])) for row in rows]
+
+    @property
+    def summary_dict(self):
+        """to_dict without the journals, so no relationship has to be loaded."""
+        return dict(
+            id=self.id,
+            job_id=self.job_id,
+            time_in=self.time_in,
+            time_out=self.time_out,
+            time_span=self.time_span,
+            is_open=self.is_open,
+        )
+
+    @classmethod
+    def get_latest(cls, user_id: int, job_id: int = None, profile: str = LOAD_SUMMARY):
+        """The record of a user (and job) with the latest time_in, or None."""
+        query = cls.query(profile).filter(cls.user_id == user_id)
+        if job_id is not None:
+            query = query.filter(cls.job_id == job_id)
+        return query.order_by(desc(cls.time_in), desc(cls.id)).first()
+
+    @classmethod
+    def get_latest_summary(cls, user_id: int, job_id: int = None):
+        """
+        summary_dict of `get_latest`, cached per user and job in `latest_records` until
+        a record of the user is written or the entry expires, so it can be polled.
+        """
+        key = (user_id, job_id)
+        summary = latest_records.get(key, _NOT_CACHED)
+        if summary is _NOT_CACHED:
+            latest = cls.get_latest(user_id, job_id)
+            summary = latest.summary_dict if latest is not None else None
+            latest_records.set(key, summary)
+        return summary
+
+    @classmethod
+    def delete_by_id(cls, record_id: int):
+        # deleted through the session (not a bulk delete) so the summary listeners run
+        clok = cls.get_by_id(record_id)
+        if clok is not None:
+            clok.delete()
+
+    def update_span(self, commit=True):
         if self.time_in and self.time_out:
             self.time_span = (self.time_out - self.time_in).total_seconds()
-            self.save()
+            self.save(commit)
 
     @property
     def span(self):
@@ -336,7 +677,7 @@ class Clok(Model, SurrogatePK):
 
     def __repr__(self):
         span = 0
-        if self.time_out is None:
+        if self.is_open:
             to = datetime.now()
             span = round((to - self.time_in).total_seconds() / SECONDS_PER_HOUR, 2)
             time_out = f"(~{to:%H:%M:%S})"
@@ -360,7 +701,7 @@ class Clok(Model, SurrogatePK):
     def print(self, journal=False):
         h = 0
         clok_info = self.__repr__()
-        if self.time_out is None:
+        if self.is_open:
             to = datetime.now()
             h = (to - self.time_in).total_seconds() / SECONDS_PER_HOUR
         if journal:
@@ -370,9 +711,12 @@ class Clok(Model, SurrogatePK):
                 clok_info += f"{j_info}"
         return clok_info, h
 
-    def add_journal(self, msg: str):
-        j = Journal(clock=self, entry=msg)
-        j.save()
+    def add_journal(self, msg: str, commit=True):
+        # through the relationship, so records that aren't flushed yet get the entry
+        j = Journal(entry=msg)
+        self.journal_entries.append(j)
+        if commit:
+            j.save()
 
     @property
     def get_journals(self):
@@ -423,6 +767,313 @@ class Journal(Model, SurrogatePK, Tracked):
         return f"    - ID: {journal_id:<6} {journal_entry:<64}"  # 80 - ( 6 + 10)
 
 
+class HoursSummary(Model, SurrogatePK):
+    """
+    Summed time_span per user, job and day / week / month. The rows are kept up to date
+    by the Clok flush listeners below whenever a record's span, keys or job change or
+    a record is deleted, so reports over many periods read one row per period instead
+    of one per punch. Writes that bypass the ORM (bulk imports, key backfills) have to
+    call `rebuild` for the users they touched.
+    """
+
+    __tablename__ = "time_clok_hours_summary"
+    __table_args__ = (
+        UniqueConstraint(
+            "user_id", "job_id", "period_type", "period_key", name="natural"
+        ),
+    )
+    user_id = reference_col("time_clok_users")
+    job_id = reference_col("time_clok_jobs")
+    period_type = Column(String(8), nullable=False)
+    period_key = Column(Integer, nullable=False)
+    seconds = Column(Integer, nullable=False, default=0)
+
+    @property
+    def to_dict(self):
+        return dict(
+            user_id=self.user_id,
+            job_id=self.job_id,
+            period_type=self.period_type,
+            period_key=self.period_key,
+            seconds=self.seconds,
+        )
+
+    @classmethod
+    def totals(
+        cls,
+        user_id: int,
+        period_type: str,
+        job_id: int = None,
+        start_key: int = None,
+        end_key: int = None,
+    ):
+        """Returns (period key, seconds) tuples, summed over all jobs without job_id."""
+        query = (
+            cls.read_db(user_id)
+            .query(cls.period_key, func.sum(cls.seconds))
+            .filter(cls.user_id == user_id)
+            .filter(cls.period_type == period_type)
+        )
+        if job_id is not None:
+            query = query.filter(cls.job_id == job_id)
+        if start_key is not None:
+            query = query.filter(cls.period_key >= start_key)
+        if end_key is not None:
+            query = query.filter(cls.period_key <= end_key)
+        query = query.group_by(cls.period_key).order_by(cls.period_key)
+        return [(key, int(seconds or 0)) for key, seconds in query]
+
+    @classmethod
+    def apply(cls, connection, user_id: int, job_id: int, keys: dict, seconds: int):
+        """Adds `seconds` (which may be negative) to the summary row of every period."""
+        table = cls.__table__
+        seconds = int(seconds or 0)
+        if not seconds:
+            return
+        for period_type, period_key in keys.items():
+            if period_key is None:
+                continue
+            update = (
+                table.update()
+                .where(table.c.user_id == user_id)
+                .where(table.c.job_id == job_id)
+                .where(table.c.period_type == period_type)
+                .where(table.c.period_key == period_key)
+                .values(seconds=table.c.seconds + seconds)
+            )
+            if connection.execute(update).rowcount:
+                if seconds < 0:
+                    # periods without any time left have no row, same as a rebuild
+                    connection.execute(
+                        table.delete()
+                        .where(table.c.user_id == user_id)
+                        .where(table.c.job_id == job_id)
+                        .where(table.c.period_type == period_type)
+                        .where(table.c.period_key == period_key)
+                        .where(table.c.seconds == 0)
+                    )
+                continue
+            try:
+                with connection.begin_nested():
+                    connection.execute(
+                        table.insert().values(
+                            user_id=user_id,
+                            job_id=job_id,
+                            period_type=period_type,
+                            period_key=period_key,
+                            seconds=seconds,
+                        )
+                    )
+            except IntegrityError:
+                # another transaction created the row first
+                connection.execute(update)
+
+    @classmethod
+    def rebuild(cls, user_ids: list = None) -> int:
+        """
+        Recomputes the summary rows (of the given users, or of everyone) from the Clok
+        table and returns the number of rows written.
+        """
+        session = cls.db()
+        table = cls.__table__
+        delete = table.delete()
+        if user_ids is not None:
+            delete = delete.where(table.c.user_id.in_(user_ids))
+        session.execute(delete)
+
+        columns = ["user_id", "job_id", "period_type", "period_key", "seconds"]
+        for period_type, key_column in _summary_key_columns().items():
+            select = (
+                session.query(
+                    Clok.user_id,
+                    Clok.job_id,
+                    literal(period_type, type_=String(8)),
+                    key_column,
+                    func.sum(Clok.time_span),
+                )
+                .filter(key_column.isnot(None))
+                .group_by(Clok.user_id, Clok.job_id, key_column)
+                .having(func.sum(Clok.time_span) != 0)
+            )
+            if user_ids is not None:
+                select = select.filter(Clok.user_id.in_(user_ids))
+            session.execute(table.insert().from_select(columns, select.statement))
+        session.commit()
+
+        count = session.query(func.count(cls.id))
+        if user_ids is not None:
+            count = count.filter(cls.user_id.in_(user_ids))
+        return count.scalar()
+
+
+# session.info key of the open shifts clocked in during the session's transaction
+_OPEN_SHIFTS = "open_shifts"
+
+PUNCH_IN = "in"
+PUNCH_OUT = "out"
+PUNCH_TYPES = (PUNCH_IN, PUNCH_OUT)
+
+clok_hours = HoursAggregator(Clok)
+journal_search = JournalSearch(Journal, Clok)
+_PERIOD_KEYS = {
+    GROUP_BY_DAY: get_date_key,
+    GROUP_BY_WEEK: get_week,
+    GROUP_BY_MONTH: get_month,
+}
+_NOT_CACHED = object()
+
+
+def _summary_key_columns() -> dict:
+    return {
+        GROUP_BY_DAY: Clok.date_key,
+        GROUP_BY_WEEK: Clok.week_key,
+        GROUP_BY_MONTH: Clok.month_key,
+    }
+
+
+def _summary_keys(clok: Clok) -> dict:
+    return {
+        GROUP_BY_DAY: clok.date_key,
+        GROUP_BY_WEEK: clok.week_key,
+        GROUP_BY_MONTH: clok.month_key,
+    }
+
+
+@event.listens_for(Clok, "after_insert")
+def _summary_after_insert(mapper, connection, clok: Clok):
+    HoursSummary.apply(
+        connection, clok.user_id, clok.job_id, _summary_keys(clok), clok.time_span
+    )
+
+
+@event.listens_for(Clok, "after_update")
+def _summary_after_update(mapper, connection, clok: Clok):
+    attrs = inspect(clok).attrs
+    names = ("user_id", "job_id", "date_key", "week_key", "month_key", "time_span")
+    old = {}
+    for name in names:
+        history = attrs[name].history
+        old[name] = history.deleted[0] if history.deleted else getattr(clok, name)
+    if all(old[name] == getattr(clok, name) for name in names):
+        return
+
+    old_keys = {
+        GROUP_BY_DAY: old["date_key"],
+        GROUP_BY_WEEK: old["week_key"],
+        GROUP_BY_MONTH: old["month_key"],
+    }
+    HoursSummary.apply(
+        connection, old["user_id"], old["job_id"], old_keys, -(old["time_span"] or 0)
+    )
+    HoursSummary.apply(
+        connection, clok.user_id, clok.job_id, _summary_keys(clok), clok.time_span
+    )
+
+
+@event.listens_for(Clok, "after_delete")
+def _summary_after_delete(mapper, connection, clok: Clok):
+    HoursSummary.apply(
+        connection,
+        clok.user_id,
+        clok.job_id,
+        _summary_keys(clok),
+        -(clok.time_span or 0),
+    )
+
+
+def forget_cached_reads(written):
+    """
+    Drops the cached latest records and report totals of the (user id, job id) pairs
+    whose records were written. Writes that bypass the ORM have to call this.
+    """
+    users = set()
+    for user_id, job_id in written:
+        latest_records.delete((user_id, None))
+        latest_records.delete((user_id, job_id))
+        users.add(user_id)
+    for user_id in users:
+        report_cache.invalidate(user_id)
+        # the user's next reads must not hit a replica that hasn't seen this yet
+        DB.pin_to_primary(user_id)
+
+
+@event.listens_for(Clok, "after_insert")
+@event.listens_for(Clok, "after_update")
+@event.listens_for(Clok, "after_delete")
+def _forget_written_reads(mapper, connection, clok: Clok):
+    attrs = inspect(clok).attrs
+    written = {
+        (user_id, job_id)
+        for user_id in set(attrs.user_id.history.sum()) | {clok.user_id}
+        for job_id in set(attrs.job_id.history.sum()) | {clok.job_id}
+    }
+    forget_cached_reads(written)
+    session = object_session(clok)
+    if session is not None:
+        # reads made between the flush and the end of the transaction may have cached
+        # values the commit (or rollback) changes again
+        session.info.setdefault("clok_writes", set()).update(written)
+
+
+@event.listens_for(Session, "after_commit")
+@event.listens_for(Session, "after_rollback")
+def _forget_transaction_reads(session):
+    forget_cached_reads(session.info.pop("clok_writes", ()))
+
+
+@event.listens_for(Session, "after_commit")
+def _remember_open_shifts(session):
+    for key, clok_id in session.info.pop(_OPEN_SHIFTS, {}).items():
+        open_shifts.set(key, clok_id)
+
+
+@event.listens_for(Session, "after_rollback")
+def _drop_open_shifts(session):
+    session.info.pop(_OPEN_SHIFTS, None)
+
+
+@event.listens_for(User.token, "set")
+def _invalidate_replaced_token(user, value, old_value, initiator):
+    if old_value is not value:
+        token_manager.invalidate_token(old_value)
+
+
+def _id_batches(query, id_column, size: int):
+    """Yields the rows of the query in id order, `size` per separate keyset query."""
+    last_id = None
+    while True:
+        batch_query = query if last_id is None else query.filter(id_column > last_id)
+        batch = batch_query.order_by(id_column).limit(size).all()
+        if batch:
+            yield batch
+        if len(batch) < size:
+            return
+        last_id = batch[-1].id
+
+
+def _dump_clok_rows(rows, owner=None):
+    for clok in Clok.row_dicts(rows, owner):
+        yield "clok", clok
+
+
+def _default_time_in(context) -> datetime:
+    """Column default helper, keys inserted without a time_in are based on now."""
+    time_in = context.get_current_parameters().get("time_in")
+    return time_in if isinstance(time_in, datetime) else datetime.now()
+
+
+def _default_is_open(context) -> bool:
+    """Column default helper, rows inserted without a time_out are open."""
+    return context.get_current_parameters().get("time_out") is None
+
+
+def _truncate_seconds(when: Union[datetime, None]) -> Union[datetime, None]:
+    if when is None:
+        return None
+    when = to_local(when)
+    return datetime(when.year, when.month, when.day, when.hour, when.minute)
+
+
 def clock_row_header():
     return _clock_format_row(
         "ID", "Job", "Date Key", "Month", "Week", "Clock In", "Clock Out", "Hours "
@@ -0,0 +1,86 @@
+"""This file contains the keyset (cursor) pagination used by the list endpoints. Instead
+of an OFFSET, which makes the database walk every skipped row, each page continues
+from the sort key of the last row of the previous page, so deep pages of a long history
+cost the same as the first one. """
+import base64
+import json
+import math
+from datetime import datetime
+from typing import List, Tuple
+
+from sqlalchemy import DateTime, Float, Integer, and_, desc, or_
+from sqlalchemy.orm import Query
+
+from core.date_utils import parse_date
+from web_server.settings import settings
+
+
+def page_size(limit: int = None) -> int:
+    """Applies the default and the maximum page size to a requested page size."""
+    return min(limit or settings.API_PAGE_SIZE, settings.API_MAX_PAGE_SIZE)
+
+
+def encode_cursor(values: list) -> str:
+    values = [v.isoformat() if isinstance(v, datetime) else v for v in values]
+    return base64.urlsafe_b64encode(json.dumps(values).encode("utf-8")).decode("ascii")
+
+
+def decode_cursor(cursor: str, columns: list) -> list:
+    """Decodes a cursor made by encode_cursor, raises ValueError if it isn't valid."""
+    try:
+        values = json.loads(base64.urlsafe_b64decode(cursor.encode("ascii")))
+    except Exception:
+        raise ValueError(f"Invalid cursor {cursor}")
+    if not isinstance(values, list) or len(values) != len(columns):
+        raise ValueError(f"Invalid cursor {cursor}")
+    try:
+        return [_cursor_value(c.type, v) for c, v in zip(columns, values)]
+    except (TypeError, ValueError, OverflowError, OSError):
+        raise ValueError(f"Invalid cursor {cursor}")
+
+
+def _cursor_value(type_, value):
+    """Checks a decoded cursor value against the type of its column."""
+    if isinstance(type_, DateTime):
+        if not isinstance(value, str):
+            raise TypeError(value)
+        return parse_date(value)
+    # bool is an int too, but json true is no sort key of ours
+    if isinstance(type_, Integer) and (
+        isinstance(value, bool) or not isinstance(value, int)
+    ):
+        raise TypeError(value)
+    if isinstance(type_, Float) and (
+        isinstance(value, bool)
+        or not isinstance(value, (int, float))
+        or not math.isfinite(value)
+    ):
+        raise TypeError(value)
+    return value
+
+
+def _after(columns: list, values: list):
+    """(a, b) < (x, y) spelled out as a < x OR (a = x AND b < y) for the index."""
+    column, value = columns[0], values[0]
+    if len(columns) == 1:
+        return column < value
+    return or_(column < value, and_(column == value, _after(columns[1:], values[1:])))
+
+
+def keyset_page(
+    query: Query, columns: list, cursor: str = None, limit: int = 50
+) -> Tuple[List, str]:
+    """
+    Returns one page of `query` ordered by `columns` (newest / highest first) and the
+    cursor of the next page, which is None on the last page. The last column has to be
+    unique (the primary key) so that no row is skipped or repeated between pages.
+    """
+    if cursor:
+        query = query.filter(_after(columns, decode_cursor(cursor, columns)))
+    rows = query.order_by(*[desc(c) for c in columns]).limit(limit + 1).all()
+
+    next_cursor = None
+    if len(rows) > limit:
+        rows = rows[:limit]
+        next_cursor = encode_cursor([getattr(rows[-1], c.key) for c in columns])
+    return rows, next_cursor
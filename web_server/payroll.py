@@ -0,0 +1,170 @@
+"""This file contains the end of period payroll report that covers every user. The user
+ids are split into contiguous ranges (shards) and each shard is computed in its own
+worker process, with its own engine and session, from the vectorized span arrays of
+web_server.analytics. The rows of the shards are merged in user order and written as
+CSV or Parquet. """
+import csv
+import multiprocessing
+import os
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime
+from typing import Iterable, List, Sequence, Tuple
+
+from core.defines import SECONDS_PER_HOUR
+from web_server.aggregates import GROUP_BY_JOB, GROUP_BY_WEEK
+from web_server.analytics import ClokSpans
+from web_server.database import DB
+from web_server.models import Job, User
+
+REPORT_COLUMNS = (
+    "user_id",
+    "email",
+    "job_id",
+    "job",
+    "seconds",
+    "hours",
+    "overtime_seconds",
+)
+REPORT_FORMATS = ("csv", "parquet")
+# the time a user works beyond this many seconds in a week, over all of their jobs, is
+# reported as overtime, split over the jobs in proportion to the week's time on each
+WEEKLY_OVERTIME = int(40 * SECONDS_PER_HOUR)
+
+
+def shard_user_ranges(user_ids: Sequence[int], shards: int) -> List[Tuple[int, int]]:
+    """
+    Splits the sorted user ids into at most `shards` contiguous shards of similar size,
+    returned as (first, last) user id ranges.
+    """
+    shards = max(min(shards, len(user_ids)), 1)
+    size, extra = divmod(len(user_ids), shards)
+    result, start = [], 0
+    for i in range(shards):
+        end = start + size + (1 if i < extra else 0)
+        if end > start:
+            result.append((user_ids[start], user_ids[end - 1]))
+        start = end
+    return result
+
+
+def report_shard(
+    user_range: Tuple[int, int],
+    start: datetime,
+    end: datetime,
+    overtime_threshold: int = WEEKLY_OVERTIME,
+    session=None,
+) -> List[tuple]:
+    """
+    Computes the report rows of one shard, the users with ids in the (first, last)
+    `user_range`: one row per user and job that has records with time_in between
+    start and end, in REPORT_COLUMNS order. Overtime is the user's time beyond
+    `overtime_threshold` seconds in a week, see ClokSpans.overtime_by_job.
+    """
+    own_session = session is None
+    if own_session:
+        session = DB.spawn_unique_session.session
+    try:
+        spans = ClokSpans.load(
+            start=start, end=end, session=session, user_range=user_range
+        )
+        emails = dict(
+            session.query(User.id, User.email).filter(User.id.between(*user_range))
+        )
+        jobs = dict(
+            session.query(Job.id, Job.name).filter(Job.user_id.between(*user_range))
+        )
+    finally:
+        if own_session:
+            session.close()
+
+    overtime = spans.overtime_by_job(overtime_threshold, GROUP_BY_WEEK)
+    rows = []
+    for user_id, totals in sorted(spans.totals(GROUP_BY_JOB).items()):
+        for job_id, seconds in totals:
+            rows.append(
+                (
+                    user_id,
+                    emails.get(user_id),
+                    None if job_id < 0 else job_id,
+                    jobs.get(job_id),
+                    seconds,
+                    round(seconds / SECONDS_PER_HOUR, 2),
+                    overtime.get((user_id, job_id), 0),
+                )
+            )
+    return rows
+
+
+def _init_worker(config: dict):
+    # a spawned worker starts with an unconfigured DB, give it its own engine
+    DB.init_app(config)
+
+
+def run_payroll_report(
+    start: datetime,
+    end: datetime,
+    workers: int = None,
+    shards: int = None,
+    overtime_threshold: int = WEEKLY_OVERTIME,
+    config: dict = None,
+) -> List[tuple]:
+    """
+    Computes the report rows of every user, sorted by user and job. The users are split
+    into `shards` shards (default: one per worker) that run on `workers` processes
+    (default: one per cpu). With a single worker, or an in memory sqlite database that
+    other processes can't open, the shards run in this process instead.
+
+    :param config: the DB.init_app configuration of the workers, defaults to settings
+    """
+    workers = workers or os.cpu_count() or 1
+    user_ids = [user_id for user_id, in DB.session.query(User.id).order_by(User.id)]
+    parts = shard_user_ranges(user_ids, shards or workers)
+    if not parts:
+        return []
+
+    if workers == 1 or len(parts) == 1 or DB.db_uri == "sqlite://":
+        results = [report_shard(p, start, end, overtime_threshold) for p in parts]
+    else:
+        if config is None:
+            from web_server.settings import settings
+
+            config = settings.dict()
+        # spawn instead of fork so no worker inherits the connections of this process
+        with ProcessPoolExecutor(
+            max_workers=min(workers, len(parts)),
+            mp_context=multiprocessing.get_context("spawn"),
+            initializer=_init_worker,
+            initargs=(config,),
+        ) as executor:
+            futures = [
+                executor.submit(report_shard, p, start, end, overtime_threshold)
+                for p in parts
+            ]
+            results = [future.result() for future in futures]
+
+    # the shards are contiguous ranges of the sorted user ids
+    return [row for rows in results for row in rows]
+
+
+def write_report(rows: Iterable[tuple], path: str, fmt: str = "csv") -> int:
+    """Writes the report rows to `path` as csv or parquet and returns the row count."""
+    if fmt not in REPORT_FORMATS:
+        raise ValueError(f"Unknown report format {fmt}, use one of {REPORT_FORMATS}")
+    rows = list(rows)
+    if fmt == "csv":
+        with open(path, "w", newline="") as f:
+            writer = csv.writer(f)
+            writer.writerow(REPORT_COLUMNS)
+            writer.writerows(rows)
+        return len(rows)
+
+    try:
+        import pyarrow
+        import pyarrow.parquet
+    except ImportError:
+        raise RuntimeError("Writing parquet reports requires pyarrow")
+    table = pyarrow.Table.from_pydict(
+        {name: [row[i] for row in rows] for i, name in enumerate(REPORT_COLUMNS)}
+    )
+    pyarrow.parquet.write_table(table, path)
+    return len(rows)
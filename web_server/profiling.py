@@ -0,0 +1,53 @@
+"""This file contains the opt in (SQL_PROFILING) middleware that profiles the SQL of
+every request with the SQLProfiler of web_server.extensions. The statement count and
+database time of the request go into its response headers and the full report, with
+the repeated and the slowest statements, into the history served by
+/api/v1/status/sql. Statements a streaming response runs after its headers were sent
+are not part of its report. """
+from starlette.datastructures import MutableHeaders
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+
+from core.profiling import SQLProfiler
+from web_server.extensions import sql_profiler
+
+
+class SQLProfilingMiddleware:
+    """
+    A plain ASGI middleware rather than a BaseHTTPMiddleware, so the response isn't
+    re-streamed through an extra task, and the endpoint runs in the context the
+    profile was started in.
+    """
+
+    def __init__(self, app: ASGIApp, profiler: SQLProfiler = sql_profiler):
+        self.app = app
+        self.profiler = profiler
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        profile = self.profiler.start(f"{scope['method']} {scope['path']}")
+        finished = False
+
+        async def send_with_headers(message: Message):
+            nonlocal finished
+            if message["type"] == "http.response.start" and not finished:
+                finished = True
+                report = self.profiler.finish(profile)
+                headers = MutableHeaders(scope=message)
+                headers.append("X-DB-Statements", str(report["statements"]))
+                headers.append("X-DB-Time", f"{report['db_ms']:.3f}")
+                headers.append("X-DB-Repeated", str(len(report["repeated"])))
+                headers.append(
+                    "Server-Timing",
+                    f'db;dur={report["db_ms"]:.3f};desc="{report["statements"]} '
+                    f'statements"',
+                )
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_headers)
+        finally:
+            if not finished:
+                self.profiler.finish(profile)
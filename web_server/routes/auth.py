@@ -1,42 +1,32 @@
-from fastapi import APIRouter, Body, Header, Depends
-from fastapi.security import OAuth2PasswordBearer
+from fastapi import APIRouter, Body, HTTPException
 from pydantic import BaseModel
-from web_server.extensions import password_hasher, token_manager
+from starlette.concurrency import run_in_threadpool
+
+from core.auth import PasswordHasherBusy
+from web_server.auth import issue_token
 from web_server.models import User
-from typing import Optional
 
 api = APIRouter()
-# oauth2_scheme = OAuth2PasswordBearer(tokenUrl="token")
-#
-#
-# class LoginBody(BaseModel):
-#     email: str
-#     password: Optional[str]
-#     token: Optional[str]
-#
-#
-# @api.get("/")
-# def get_test(token: str = Depends(oauth2_scheme)):
-#     return {"token": token}
-#
-#
-# @api.post("/login")
-# def login_post(data: LoginBody = Body(None, help="The login information")):
-#     user = User.get_by_email(data.email)
-#     if user is not None:
-#         if user.password is not None:
-#             if user.verify_password(data.password):
-#                 # login user and return a JsonWebToken to use for auth and session storage
-#                 pass
-#             else:
-#                 pass
-#                 # return message stating that the password is wrong
-#
-#         elif user.token is not None:
-#             token = token_manager.validate_token(user.token)
-#             if token:
-#                 pass
-#
-#     else:
-#         pass
-#         # return a message stating that the user does not exist
+
+
+class LoginBody(BaseModel):
+    email: str
+    password: str
+
+
+@api.post("/token")
+async def login(data: LoginBody = Body(..., description="The login information")):
+    """
+    Checks the user's password and returns a bearer token for the authenticated
+    endpoints. A new login revokes the user's previous token.
+    """
+    # the queries run on the threadpool, the password check on the hashing pool
+    user = await run_in_threadpool(User.get_by_email, data.email)
+    try:
+        valid = user is not None and await user.verify_password_async(data.password)
+    except PasswordHasherBusy:
+        raise HTTPException(status_code=503, detail="Too many logins, try again")
+    if not valid:
+        raise HTTPException(status_code=401, detail="Wrong email or password")
+    token = await run_in_threadpool(issue_token, user)
+    return dict(access_token=token, token_type="bearer")
@@ -1,6 +1,153 @@
-from fastapi import APIRouter
+from datetime import datetime
+from typing import List
 
+from fastapi import APIRouter, Body, Depends, HTTPException, Query
+from pydantic import BaseModel, validator
+from sqlalchemy.exc import IntegrityError
+
+from core.date_utils import to_local
+from web_server.auth import current_user
+from web_server.database import LOAD_DETAIL
+from web_server.models import PUNCH_IN, PUNCH_TYPES, Clok, Journal, User, journal_search
+from web_server.pagination import keyset_page, page_size
+from web_server.serialization import FastJSONResponse
 
 api = APIRouter()
 
 
+class PunchItem(BaseModel):
+    type: str = PUNCH_IN
+    # defaults to the time the punch is received
+    time: datetime = None
+    journal: str = None
+
+    @validator("type")
+    def known_type(cls, value):
+        if value not in PUNCH_TYPES:
+            raise ValueError(f"use one of {PUNCH_TYPES}")
+        return value
+
+    @validator("time")
+    def local_time(cls, value):
+        # times with an offset ("...Z") become the naive local times of the records,
+        # so they can be sorted together with naive ones
+        return to_local(value)
+
+
+class PunchBatchBody(BaseModel):
+    punches: List[PunchItem]
+
+
+def _apply_punches(user: User, punches: List[PunchItem]) -> list:
+    """
+    Runs User.punch and answers the punches that can't be applied with a 409 instead
+    of a server error.
+    """
+    now = datetime.now()
+    punches = [dict(p.dict(), time=p.time or now) for p in punches]
+    if user.job_id is None and any(p["type"] == PUNCH_IN for p in punches):
+        raise HTTPException(status_code=409, detail="The user has no current job")
+    try:
+        return user.punch(punches)
+    except ValueError as e:
+        # clocking out without a record to clock out of
+        raise HTTPException(status_code=409, detail=str(e))
+    except IntegrityError:
+        raise HTTPException(
+            status_code=409, detail="A record with the same times already exists"
+        )
+
+
+@api.get("/")
+def list_cloks(
+    job_id: int = None,
+    start: datetime = None,
+    end: datetime = None,
+    limit: int = Query(None, ge=1),
+    cursor: str = None,
+    user: User = Depends(current_user),
+):
+    """
+    Lists the authenticated user's clock records, newest first. Pass the returned
+    next_cursor to get the following page, it is null on the last page.
+    """
+    # plain rows in the shape of Clok.to_dict, no Clok instances are built
+    query = Clok.read_rows(*Clok.dict_columns, owner=user.id).filter(
+        Clok.user_id == user.id
+    )
+    if job_id is not None:
+        query = query.filter(Clok.job_id == job_id)
+    if start is not None:
+        query = query.filter(Clok.time_in >= start)
+    if end is not None:
+        query = query.filter(Clok.time_in < end)
+
+    try:
+        rows, next_cursor = keyset_page(
+            query, [Clok.time_in, Clok.id], cursor, page_size(limit)
+        )
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    items = Clok.row_dicts(rows, owner=user.id)
+    return FastJSONResponse(dict(items=items, next_cursor=next_cursor))
+
+
+@api.post("/punch")
+def punch(data: PunchItem = Body(...), user: User = Depends(current_user)):
+    """
+    Clocks the authenticated user in to or out of their current job ("in" / "out")
+    with an optional journal message, in a single transaction.
+    """
+    (clok,) = _apply_punches(user, [data])
+    return clok.summary_dict
+
+
+@api.post("/punch/batch")
+def punch_batch(data: PunchBatchBody = Body(...), user: User = Depends(current_user)):
+    """
+    Applies the punches an offline client of the authenticated user recorded, in time
+    order and all or nothing, in a single transaction.
+    """
+    cloks = _apply_punches(user, data.punches)
+    return dict(items=[c.summary_dict for c in cloks])
+
+
+@api.get("/journal/search")
+def search_journals(
+    q: str,
+    job_id: int = None,
+    start: datetime = None,
+    end: datetime = None,
+    limit: int = Query(None, ge=1),
+    cursor: str = None,
+    user: User = Depends(current_user),
+):
+    """
+    Searches the authenticated user's journal entries, best match first, optionally
+    only those of a job or of records clocked in between start and end. Every word of
+    q has to match, a trailing * matches words starting with it. Pass the returned
+    next_cursor to get the following page, it is null on the last.
+    """
+    try:
+        items, next_cursor = journal_search.search(
+            Journal.read_db(user.id),
+            user.id,
+            q,
+            job_id=job_id,
+            start=start,
+            end=end,
+            limit=page_size(limit),
+            cursor=cursor,
+        )
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    return FastJSONResponse(dict(items=items, next_cursor=next_cursor))
+
+
+@api.get("/{clok_id}")
+def get_clok(clok_id: int, user: User = Depends(current_user)):
+    clok = Clok.get_by_id(clok_id, LOAD_DETAIL)
+    # other users' records are answered as missing, not as forbidden
+    if clok is None or clok.user_id != user.id:
+        raise HTTPException(status_code=404, detail="Clock record not found")
+    return clok.to_dict
@@ -1,6 +1,39 @@
-from fastapi import APIRouter
+from fastapi import APIRouter, Depends, HTTPException, Query
 
+from web_server.auth import current_user
+from web_server.models import Job, User
+from web_server.pagination import keyset_page, page_size
+from web_server.serialization import FastJSONResponse
 
 api = APIRouter()
 
 
+@api.get("/")
+def list_jobs(
+    limit: int = Query(None, ge=1),
+    cursor: str = None,
+    user: User = Depends(current_user),
+):
+    """
+    Lists the authenticated user's jobs, newest first, with the same cursors as the
+    clock list.
+    """
+    # plain rows in the shape of Job.to_dict, no Job instances are built
+    query = Job.read_rows("id", "name", "user_id", owner=user.id).filter(
+        Job.user_id == user.id
+    )
+    try:
+        rows, next_cursor = keyset_page(query, [Job.id], cursor, page_size(limit))
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    items = [row._asdict() for row in rows]
+    return FastJSONResponse(dict(items=items, next_cursor=next_cursor))
+
+
+@api.get("/{job_id}")
+def get_job(job_id: int, user: User = Depends(current_user)):
+    job = Job.get_by_id(job_id)
+    # other users' jobs are answered as missing, not as forbidden
+    if job is None or job.user_id != user.id:
+        raise HTTPException(status_code=404, detail="Job not found")
+    return job.to_dict
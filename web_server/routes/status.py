@@ -0,0 +1,44 @@
+from fastapi import APIRouter, HTTPException, Query
+
+from web_server.database import DB
+from web_server.extensions import sql_profiler
+
+api = APIRouter()
+
+
+def _pool_monitor():
+    if DB.pool_monitor is None:
+        raise HTTPException(status_code=404, detail="Pool statistics are disabled")
+    return DB.pool_monitor
+
+
+@api.get("/pool")
+def get_pool_stats():
+    """
+    The database pool statistics of this worker process: checkout waits, saturation,
+    overflow use and connection churn.
+    """
+    return _pool_monitor().snapshot()
+
+
+@api.post("/pool/reset")
+def reset_pool_stats():
+    """Returns the pool statistics and starts a new measurement."""
+    monitor = _pool_monitor()
+    stats = monitor.snapshot()
+    monitor.reset()
+    return stats
+
+
+@api.get("/sql")
+def get_sql_profiles(limit: int = Query(20, ge=1), clear: bool = False):
+    """
+    The SQL profiles of the last requests handled by this worker process, newest
+    first. Only available with SQL_PROFILING. Pass clear=true to empty the history.
+    """
+    if not sql_profiler.enabled:
+        raise HTTPException(status_code=404, detail="SQL profiling is disabled")
+    profiles = sql_profiler.history(limit)
+    if clear:
+        sql_profiler.clear()
+    return dict(items=profiles)
@@ -1,7 +1,76 @@
-from fastapi import APIRouter
+from typing import List, Optional
 
+from fastapi import APIRouter, Body, Depends, HTTPException, Query
+from fastapi.responses import StreamingResponse
+from pydantic import BaseModel
+
+from web_server.auth import current_user
+from web_server.export import EXPORT_MEDIA_TYPES, stream_json, stream_ndjson
+from web_server.importer import import_dump
+from web_server.models import Clok, User
 
 api = APIRouter()
 
 
-# @api.get()
+class ImportBody(BaseModel):
+    user: Optional[dict] = None
+    users: List[dict] = []
+    jobs: List[dict] = []
+    cloks: List[dict] = []
+    journals: List[dict] = []
+
+
+@api.get("/export")
+def export_records(
+    format: str = "ndjson",
+    chunk_size: int = Query(1000, ge=1),
+    user: User = Depends(current_user),
+):
+    """
+    Streams everything stored for the authenticated user as NDJSON or as one JSON
+    document.
+    """
+    if format not in EXPORT_MEDIA_TYPES:
+        raise HTTPException(status_code=400, detail=f"Unknown export format {format}")
+
+    records = user.iter_dump(chunk_size=chunk_size)
+    body = stream_ndjson(records) if format == "ndjson" else stream_json(records)
+    return StreamingResponse(body, media_type=EXPORT_MEDIA_TYPES[format])
+
+
+def _own_user_id(user_id: int, user: User) -> int:
+    """Answers the ids of other users as missing, not as forbidden."""
+    if user_id != user.id:
+        raise HTTPException(status_code=404, detail="User not found")
+    return user_id
+
+
+@api.get("/{user_id}")
+def get_user(user_id: int, user: User = Depends(current_user)):
+    _own_user_id(user_id, user)
+    return user.to_dict
+
+
+@api.get("/{user_id}/latest")
+def get_latest_record(
+    user_id: int, job_id: int = None, user: User = Depends(current_user)
+):
+    """
+    The authenticated user's record with the latest clock in time, for one job or
+    across all of them, or null. Served from a short lived cache so clients can poll
+    it.
+    """
+    return dict(clok=Clok.get_latest_summary(_own_user_id(user_id, user), job_id))
+
+
+@api.post("/import")
+def import_records(
+    data: ImportBody = Body(..., description="User.dump() shaped records"),
+    batch_size: int = 1000,
+    user: User = Depends(current_user),
+):
+    """
+    Bulk imports the authenticated user's jobs, cloks and journals, skipping existing
+    records. Users in the payload are ignored and every record is stored as the user's.
+    """
+    return import_dump(data.dict(), batch_size=batch_size, user_id=user.id)
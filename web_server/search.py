@@ -0,0 +1,220 @@
+"""This file contains the full text search over journal entries. MySQL databases get a
+FULLTEXT index on the entry column, SQLite databases an external content FTS5 table
+kept in sync with the journal table by triggers, so a search only reads the index and
+the matching rows instead of every journal of the history. Results are scoped to a
+user (and optionally a job and a clock in range), ranked by relevance and paged with
+(score, id) cursors. """
+import logging
+import re
+from datetime import datetime
+from typing import List, Tuple
+
+from sqlalchemy import DDL, DateTime, Float, bindparam, event, literal_column, text
+from sqlalchemy.exc import OperationalError
+
+from web_server.pagination import decode_cursor, encode_cursor
+
+logger = logging.getLogger(__name__)
+
+MYSQL_FULLTEXT_INDEX = "ft_time_clok_journal_entry"
+_WORDS = re.compile(r"(\w+)(\*?)", re.UNICODE)
+_LIKE_ESCAPE = "!"
+_LIKE_SPECIAL = re.compile(r"[!%_]")
+
+
+def _escape_like(match) -> str:
+    return _LIKE_ESCAPE + match.group(0)
+
+
+class JournalSearch:
+    """
+    Builds and queries the search index of a Journal style model (with clok_id and
+    entry columns) whose records belong to a Clok style model (with user_id, job_id
+    and time_in columns).
+    """
+
+    def __init__(self, journal_model=None, clok_model=None):
+        self.journal = None
+        self.clok = None
+        if journal_model is not None:
+            self.init_model(journal_model, clok_model)
+
+    def init_model(self, journal_model, clok_model):
+        self.journal = journal_model
+        self.clok = clok_model
+        # databases created from now on get the index with their tables
+        table = journal_model.__table__
+        event.listen(table, "after_create", self._after_create)
+
+    @property
+    def fts_table(self) -> str:
+        return f"{self.journal.__tablename__}_fts"
+
+    def _sqlite_ddl(self) -> List[str]:
+        fts, table = self.fts_table, self.journal.__tablename__
+        insert = f"INSERT INTO {fts}(rowid, entry) VALUES (new.id, new.entry);"
+        delete = (
+            f"INSERT INTO {fts}({fts}, rowid, entry) "
+            f"VALUES ('delete', old.id, old.entry);"
+        )
+        return [
+            f"CREATE VIRTUAL TABLE IF NOT EXISTS {fts} USING fts5(entry, "
+            f"content='{table}', content_rowid='id')",
+            f"CREATE TRIGGER IF NOT EXISTS {fts}_insert AFTER INSERT ON {table} "
+            f"BEGIN {insert} END",
+            f"CREATE TRIGGER IF NOT EXISTS {fts}_delete AFTER DELETE ON {table} "
+            f"BEGIN {delete} END",
+            f"CREATE TRIGGER IF NOT EXISTS {fts}_update AFTER UPDATE OF entry ON "
+            f"{table} BEGIN {delete} {insert} END",
+        ]
+
+    def _after_create(self, table, connection, **kwargs):
+        dialect = connection.dialect.name
+        if dialect == "sqlite":
+            # an index left behind by a dropped journal table would hold stale rows
+            connection.execute(DDL(f"DROP TABLE IF EXISTS {self.fts_table}"))
+            try:
+                for statement in self._sqlite_ddl():
+                    connection.execute(DDL(statement))
+            except OperationalError as e:
+                logger.warning("journal search falls back to LIKE, no fts5: %s", e)
+        elif dialect == "mysql":
+            connection.execute(
+                DDL(
+                    f"ALTER TABLE {table.name} ADD FULLTEXT INDEX "
+                    f"{MYSQL_FULLTEXT_INDEX} (entry)"
+                )
+            )
+
+    def create_index(self, engine) -> bool:
+        """
+        Adds the index to an existing database and (re)builds it from the journal
+        table. Returns False when the database can't have one (no fts5 in SQLite).
+        """
+        table = self.journal.__table__
+        with engine.begin() as connection:
+            dialect = connection.dialect.name
+            if dialect == "sqlite":
+                try:
+                    for statement in self._sqlite_ddl():
+                        connection.execute(statement)
+                except OperationalError as e:
+                    logger.warning("can not create the journal search table: %s", e)
+                    return False
+                fts = self.fts_table
+                connection.execute(f"INSERT INTO {fts}({fts}) VALUES ('rebuild')")
+                return True
+            if dialect == "mysql":
+                indexes = {
+                    row[2]
+                    for row in connection.execute(f"SHOW INDEX FROM {table.name}")
+                }
+                if MYSQL_FULLTEXT_INDEX not in indexes:
+                    connection.execute(
+                        f"ALTER TABLE {table.name} ADD FULLTEXT INDEX "
+                        f"{MYSQL_FULLTEXT_INDEX} (entry)"
+                    )
+                return True
+        return False
+
+    def _has_fts_table(self, session) -> bool:
+        found = session.execute(
+            text("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = :name"),
+            dict(name=self.fts_table),
+        ).first()
+        return found is not None
+
+    def search(
+        self,
+        session,
+        user_id: int,
+        query: str,
+        job_id: int = None,
+        start: datetime = None,
+        end: datetime = None,
+        limit: int = 50,
+        cursor: str = None,
+    ) -> Tuple[List[dict], str]:
+        """
+        Returns one page of the user's journal entries matching `query`, best match
+        first, as dicts (id, clok_id, job_id, time, time_in, entry, score), and the
+        cursor of the next page or None. Every word of the query has to match and a
+        trailing * matches words starting with it, also in MySQL, which ignores its
+        stopwords and words shorter than its minimum token size. Raises ValueError for
+        a query without words or an invalid cursor.
+        """
+        words = _WORDS.findall(query or "")
+        if not words:
+            raise ValueError("The search query has no words")
+
+        journal = self.journal.__tablename__
+        params = dict(user_id=user_id, limit=limit + 1)
+        filters = ["c.user_id = :user_id"]
+        if job_id is not None:
+            filters.append("c.job_id = :job_id")
+            params["job_id"] = job_id
+        if start is not None:
+            filters.append("c.time_in >= :start")
+            params["start"] = start
+        if end is not None:
+            filters.append("c.time_in < :end")
+            params["end"] = end
+
+        dialect = session.bind.dialect.name
+        if dialect == "sqlite" and self._has_fts_table(session):
+            # every word quoted so no user input is read as fts5 query syntax
+            params["match"] = " ".join(f'"{w}"{prefix}' for w, prefix in words)
+            matches = (
+                f"SELECT j.id, j.clok_id, c.job_id, j.time, c.time_in, j.entry, "
+                f"-bm25({self.fts_table}) AS score FROM {self.fts_table} "
+                f"JOIN {journal} j ON j.id = {self.fts_table}.rowid "
+                f"JOIN {self.clok.__tablename__} c ON c.id = j.clok_id "
+                f"WHERE {self.fts_table} MATCH :match"
+            )
+        elif dialect == "mysql":
+            # every word required, \w+ words carry no boolean mode operators
+            params["match"] = " ".join(f"+{w}{prefix}" for w, prefix in words)
+            matches = (
+                f"SELECT j.id, j.clok_id, c.job_id, j.time, c.time_in, j.entry, "
+                f"MATCH (j.entry) AGAINST (:match IN BOOLEAN MODE) AS score "
+                f"FROM {journal} j JOIN {self.clok.__tablename__} c "
+                f"ON c.id = j.clok_id "
+                f"WHERE MATCH (j.entry) AGAINST (:match IN BOOLEAN MODE)"
+            )
+        else:
+            # no index: every entry of the user is scanned and all matches rank equal
+            likes = []
+            for i, (word, _) in enumerate(words):
+                # _ is a word character, but a LIKE wildcard
+                likes.append(f"j.entry LIKE :word_{i} ESCAPE '{_LIKE_ESCAPE}'")
+                params[f"word_{i}"] = f"%{_LIKE_SPECIAL.sub(_escape_like, word)}%"
+            matches = (
+                f"SELECT j.id, j.clok_id, c.job_id, j.time, c.time_in, j.entry, "
+                f"0.0 AS score FROM {journal} j JOIN {self.clok.__tablename__} c "
+                f"ON c.id = j.clok_id WHERE {' AND '.join(likes)}"
+            )
+
+        page = f"SELECT * FROM ({matches} AND {' AND '.join(filters)}) m"
+        if cursor:
+            columns = [literal_column("score", Float), self.journal.id]
+            params["cursor_score"], params["cursor_id"] = decode_cursor(cursor, columns)
+            page += (
+                " WHERE m.score < :cursor_score "
+                "OR (m.score = :cursor_score AND m.id < :cursor_id)"
+            )
+        page += " ORDER BY m.score DESC, m.id DESC LIMIT :limit"
+
+        statement = text(page).columns(time=DateTime, time_in=DateTime)
+        statement = statement.bindparams(
+            *[
+                bindparam(name, type_=DateTime)
+                for name in ("start", "end")
+                if name in params
+            ]
+        )
+        rows = [dict(row) for row in session.execute(statement, params)]
+        next_cursor = None
+        if len(rows) > limit:
+            rows = rows[:limit]
+            next_cursor = encode_cursor([rows[-1]["score"], rows[-1]["id"]])
+        return rows, next_cursor
@@ -0,0 +1,45 @@
+"""This file contains the JSON encoding used by the models, the exports and the API
+responses. orjson is used when it is installed: it encodes datetimes natively (as ISO
+8601, like FastAPI's own encoder) and is several times faster than the standard
+library, which remains the fallback. """
+import json
+from datetime import date, datetime
+from decimal import Decimal
+from typing import Any
+
+from starlette.responses import JSONResponse
+
+try:
+    import orjson
+except ImportError:  # pragma: no cover
+    orjson = None
+
+
+def _default(value):
+    if isinstance(value, (datetime, date)):
+        return value.isoformat()
+    if isinstance(value, Decimal):
+        return float(value)
+    raise TypeError(f"Object of type {type(value).__name__} is not JSON serializable")
+
+
+def dumps(data: Any) -> bytes:
+    """Encodes data, including datetimes, to compact JSON bytes."""
+    if orjson is not None:
+        return orjson.dumps(data, default=_default, option=orjson.OPT_NON_STR_KEYS)
+    return json.dumps(data, default=_default, separators=(",", ":")).encode("utf-8")
+
+
+def dumps_str(data: Any) -> str:
+    return dumps(data).decode("utf-8")
+
+
+class FastJSONResponse(JSONResponse):
+    """
+    JSONResponse rendered with `dumps`. Endpoints that return one directly also skip
+    FastAPI's jsonable_encoder pass over the content, so their content should only
+    hold dicts, lists, scalars and datetimes.
+    """
+
+    def render(self, content: Any) -> bytes:
+        return dumps(content)
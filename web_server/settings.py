@@ -1,3 +1,5 @@
+from typing import List, Optional
+
 from pydantic import BaseSettings as Base
 
 
@@ -12,8 +14,38 @@ class BaseSettings(Base):
     )
     TOKEN_SALT_LENGTH: int = 32
     TOKEN_TIMEOUT: int = 60 * 60 * 24  # 24 hours
+    # validated tokens are cached so repeat requests skip the signature check
+    TOKEN_CACHE_SIZE: int = 1024
+    TOKEN_CACHE_TTL: int = 60 * 5  # 5 minutes
+    # open shifts remembered per user and job so clocking out skips the history
+    OPEN_SHIFT_CACHE_SIZE: int = 10000
+    OPEN_SHIFT_CACHE_TTL: int = 60 * 60 * 24  # 24 hours
+    # latest record per user and job for polling clients, dropped when a record of
+    # the user is written, the ttl bounds how stale other processes can see it
+    LATEST_RECORD_CACHE_SIZE: int = 10000
+    LATEST_RECORD_CACHE_TTL: int = 30
+    # day / week / month hour totals per user, dropped whenever a record of the user is
+    # written. The current periods expire after REPORT_CACHE_TTL seconds, the closed
+    # ones after REPORT_CACHE_CLOSED_TTL. With several worker processes and the
+    # default in process backend other workers only see a write once these expire,
+    # plug a shared backend into report_cache.init_app instead. Unset (None) keeps
+    # closed periods until a write, which only a plugged in backend allows.
+    REPORT_CACHE_SIZE: int = 4096
+    REPORT_CACHE_TTL: float = 60.0
+    REPORT_CACHE_CLOSED_TTL: Optional[float] = 3600.0
     PASSWORD_HASH_MODE: str = "pbkdf2:sha256:50000"
     PASSWORD_SALT_LENGTH: int = 16
+    # the async password hashing runs on a "thread" or "process" pool
+    PASSWORD_HASH_POOL: str = "thread"
+    PASSWORD_HASH_WORKERS: int = 2
+    # hashes handed to the pool at once, callers beyond this wait for a free slot
+    # for PASSWORD_HASH_TIMEOUT seconds before they are turned away
+    PASSWORD_HASH_MAX_PENDING: int = 16
+    PASSWORD_HASH_TIMEOUT: float = 5.0
+
+    # default and largest page size of the list endpoints
+    API_PAGE_SIZE: int = 50
+    API_MAX_PAGE_SIZE: int = 500
 
     DATABASE_USERNAME: str = ""
     DATABASE_PASSWORD: str = ""
@@ -21,15 +53,61 @@ class BaseSettings(Base):
     DATABASE_HOST: str = "127.0.0.1"
     DATABASE_PORT: int = 3306
     DATABASE_CONNECTOR: str = ""
-    DATABASE_POOL_SIZE: int = ""
+    # connections each worker process keeps open, and how many more it may open under
+    # load (-1 for no limit). Requests wait up to DATABASE_POOL_TIMEOUT seconds for a
+    # connection before failing. The database has to allow (size + overflow) times
+    # the number of uvicorn workers connections
+    DATABASE_POOL_SIZE: int = 5
+    DATABASE_MAX_OVERFLOW: int = 10
+    DATABASE_POOL_TIMEOUT: float = 30.0
+    # seconds after which a connection is replaced, keep it below MySQL's wait_timeout
+    DATABASE_POOL_RECYCLE: int = 3600
+    # test every connection with a round trip on checkout and replace dead ones
+    DATABASE_POOL_PRE_PING: bool = False
+    # collect checkout waits, saturation, overflow use and connection churn of the
+    # pool (see core.pool.PoolMonitor and /api/v1/status/pool), the wait percentiles
+    # cover the last DATABASE_POOL_STATS_WINDOW checkouts
+    DATABASE_POOL_STATS: bool = True
+    DATABASE_POOL_STATS_WINDOW: int = 10000
+    # read only work (reports, exports and the list endpoints) goes to these replicas,
+    # "host" or "host:port" with the credentials and database name above. In sqlite
+    # mode SQLITE_REPLICA_NAMES lists database files that stand in for them
+    DATABASE_REPLICA_HOSTS: List[str] = []
+    SQLITE_REPLICA_NAMES: List[str] = []
+    # "round_robin" or "least_connections" (fewest checked out connections)
+    DATABASE_REPLICA_SELECTION: str = "round_robin"
+    # a user's reads stay on the primary for this many seconds after a write of theirs,
+    # keep it above the replication lag. The pins are kept in process, so with several
+    # workers a user's next request may land on a worker that doesn't know of the write
+    # and read a replica, plug a shared pin_backend into DB.init_app for that
+    DATABASE_REPLICA_STICKY_SECONDS: float = 5.0
     # set this to True to enable sqlite database
     USE_SQLITE_DATABASE: bool = False
     # if **USE_SQLITE_DATABASE** is set to true, then this can be used
     # to declare a file_path to store an sqlite database
     # leave blank for an in memory database
     SQLITE_DATABASE_NAME: str = ""
-    # Declare this variable to override the database connection pool class
+    # "tuned" runs sqlite in WAL mode with the pragmas below, keeps a pool of
+    # connections and lets one writer at a time write (others queue for up to
+    # SQLITE_BUSY_TIMEOUT seconds) while readers keep reading, see core.sqlite.
+    # "default" keeps sqlite's own settings
+    SQLITE_PROFILE: str = "default"
+    SQLITE_SYNCHRONOUS: str = "NORMAL"
+    # pages to cache per connection, or KiB when negative
+    SQLITE_CACHE_SIZE: int = -64000
+    SQLITE_MMAP_SIZE: int = 256 * 1024 * 1024
+    SQLITE_BUSY_TIMEOUT: float = 5.0
+    # Declare this variable to override the database connection pool class, checkout
+    # waits are only measured with the default core.pool.TimedQueuePool
     # DATABASE_POOL_TYPE: object = QueuePool
     DATABASE_ECHO: bool = False
+    # profile the SQL of every request: statement count and database time in the
+    # X-DB-* response headers, the last SQL_PROFILE_HISTORY reports (with the
+    # SQL_PROFILE_SLOWEST slowest statements and the ones that ran at least
+    # SQL_PROFILE_REPEAT_THRESHOLD times, like lazy loads per row) at /api/v1/status/sql
+    SQL_PROFILING: bool = False
+    SQL_PROFILE_HISTORY: int = 200
+    SQL_PROFILE_SLOWEST: int = 5
+    SQL_PROFILE_REPEAT_THRESHOLD: int = 5
 
 settings = BaseSettings()
\ No newline at end of file